@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+from typing import Any
+
+from weetags.tree import Tree
+from weetags.engine.sql import SqlConverter
+from app.relations import Relations, relation_scope
+from app.exceptions import MissingParameter
+from app.interning import storage_table
+
+Conditions = list[list[tuple[str, str, Any] | str] | str]
+
+CREATE_SIZES = "CREATE TABLE {table_name} (nid TEXT PRIMARY KEY, parent TEXT, size INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID;"
+FILL_SIZES = """\
+INSERT INTO {table_name}(nid, parent, size)
+WITH RECURSIVE up(ancestor) AS (
+SELECT parent FROM {nodes_table} WHERE parent IS NOT NULL
+UNION ALL
+SELECT n.parent FROM up JOIN {nodes_table} n ON n.id = up.ancestor WHERE n.parent IS NOT NULL
+)
+SELECT n.id, n.parent, coalesce(c.size, 0) FROM {nodes_table} n
+LEFT JOIN (SELECT ancestor, count(*) AS size FROM up GROUP BY ancestor) c ON c.ancestor = n.id;
+"""
+INSERT_SIZES_TRIGGER = """\
+CREATE TRIGGER {table_name}__insert_trigger AFTER INSERT ON {nodes_table} BEGIN
+INSERT INTO {table_name}(nid, parent, size) VALUES (NEW.id, NEW.parent, 0);
+UPDATE {table_name} SET size = size + 1 WHERE nid = NEW.parent;
+END;
+"""
+DELETE_SIZES_TRIGGER = """\
+CREATE TRIGGER {table_name}__delete_trigger AFTER DELETE ON {nodes_table} BEGIN
+UPDATE {table_name} SET size = size - 1 - (SELECT size FROM {table_name} WHERE nid = OLD.id) WHERE nid = OLD.parent;
+DELETE FROM {table_name} WHERE nid = OLD.id;
+END;
+"""
+MOVE_SIZES_TRIGGER = """\
+CREATE TRIGGER {table_name}__move_trigger AFTER UPDATE OF parent ON {nodes_table} WHEN OLD.parent IS NOT NEW.parent BEGIN
+UPDATE {table_name} SET size = size - 1 - (SELECT size FROM {table_name} WHERE nid = NEW.id) WHERE nid = OLD.parent;
+UPDATE {table_name} SET size = size + 1 + (SELECT size FROM {table_name} WHERE nid = NEW.id) WHERE nid = NEW.parent;
+UPDATE {table_name} SET parent = NEW.parent WHERE nid = NEW.id;
+END;
+"""
+# forward size variations to the ancestors, one level per trigger recursion.
+PROPAGATE_SIZES_TRIGGER = """\
+CREATE TRIGGER {table_name}__propagate_trigger AFTER UPDATE OF size ON {table_name} WHEN NEW.parent IS NOT NULL BEGIN
+UPDATE {table_name} SET size = size + (NEW.size - OLD.size) WHERE nid = NEW.parent;
+END;
+"""
+TRIGGERS = ["insert", "delete", "move", "propagate"]
+
+
+class SubtreeSizes(object):
+    """
+    Per node count of descendants, in the `_sizes__<tree>` table.
+    Filled once from the parent links, then maintained by triggers on the nodes table: a write updates its parent counter,
+    and the variation is forwarded to the ancestors by a recursive trigger on the counters table.
+    Recursive triggers are enabled on the tree connection for that purpose. Counters of trees deeper than
+    sqlite max trigger depth (1000) cannot be maintained.
+    Must be used within the tree thread.
+    """
+    def __init__(self, tree: Tree) -> None:
+        self.tree = tree
+        self.nodes_table = storage_table(tree)
+        self.table_name = f"_sizes__{tree.tree_name}"
+
+    def build(self) -> None:
+        self.tree.con.execute("PRAGMA recursive_triggers = ON;")
+        if self._is_built():
+            return
+
+        self.drop()
+        params = {"table_name": self.table_name, "nodes_table": self.nodes_table}
+        self.tree._execute_many(
+            CREATE_SIZES.format(**params),
+            FILL_SIZES.format(**params),
+            INSERT_SIZES_TRIGGER.format(**params),
+            DELETE_SIZES_TRIGGER.format(**params),
+            MOVE_SIZES_TRIGGER.format(**params),
+            PROPAGATE_SIZES_TRIGGER.format(**params),
+        )
+
+    def drop(self) -> None:
+        self.tree._execute_many(
+            *[f"DROP TRIGGER IF EXISTS {self.table_name}__{t}_trigger;" for t in TRIGGERS],
+            f"DROP TABLE IF EXISTS {self.table_name};"
+        )
+
+    def _is_built(self) -> bool:
+        triggers = self.tree.con.execute(
+            "SELECT count(*) AS n FROM sqlite_master WHERE type='trigger' AND name IN (?, ?, ?, ?);",
+            [f"{self.table_name}__{t}_trigger" for t in TRIGGERS]
+        ).fetchone()
+        return triggers["n"] == len(TRIGGERS)
+
+
+class Aggregator(object):
+    """
+    SQL aggregates over a set of nodes, so clients get numbers instead of node lists.
+    The set of nodes is defined as in the records routes:
+        - conditions: nodes complying with the conditions.
+        - relation & nid: nodes related to `nid`, complying with the conditions.
+        - relation: nodes related to the nodes complying with the conditions (see `Tree.nodes_relation_where`).
+    Must be used within the tree thread.
+    """
+    def __init__(self, tree: Tree, sizes: SubtreeSizes) -> None:
+        self.tree = tree
+        self.sizes = sizes
+
+    def count(
+        self,
+        conditions: Conditions | None = None,
+        relation: Relations | None = None,
+        nid: str | None = None,
+        include_base: bool = False
+    ) -> dict[str, int]:
+        stmt, values = self._nodes(["id"], conditions, relation, nid, include_base)
+        return self._one(f"SELECT count(*) AS count FROM ({stmt}) AS nodes", values)
+
+    def min(
+        self,
+        field_name: str | None = None,
+        conditions: Conditions | None = None,
+        relation: Relations | None = None,
+        nid: str | None = None,
+        include_base: bool = False
+    ) -> dict[str, Any]:
+        self._validate_field(field_name)
+        stmt, values = self._nodes(["id", field_name], conditions, relation, nid, include_base)
+        return self._one(f"SELECT min({field_name}) AS min FROM ({stmt}) AS nodes", values)
+
+    def max(
+        self,
+        field_name: str | None = None,
+        conditions: Conditions | None = None,
+        relation: Relations | None = None,
+        nid: str | None = None,
+        include_base: bool = False
+    ) -> dict[str, Any]:
+        self._validate_field(field_name)
+        stmt, values = self._nodes(["id", field_name], conditions, relation, nid, include_base)
+        return self._one(f"SELECT max({field_name}) AS max FROM ({stmt}) AS nodes", values)
+
+    def group_by(
+        self,
+        field_name: str | None = None,
+        conditions: Conditions | None = None,
+        relation: Relations | None = None,
+        nid: str | None = None,
+        include_base: bool = False,
+        limit: int | None = None
+    ) -> list[dict[str, Any]]:
+        """count of nodes per value of a field, most frequent first. JSONLIST fields are grouped by element."""
+        self._validate_field(field_name)
+        stmt, values = self._nodes(["id", field_name], conditions, relation, nid, include_base)
+        if self.tree.namespaces[field_name].ftype == "JSONLIST":
+            source, value = f"({stmt}) AS nodes, json_each(nodes.{field_name}) AS j", "j.value"
+        else:
+            source, value = f"({stmt}) AS nodes", f"nodes.{field_name}"
+        stmt = f"SELECT {value} AS value, count(*) AS count FROM {source} GROUP BY {value} ORDER BY count DESC, value LIMIT ?"
+        return self.tree.con.execute(stmt, values + [limit or -1]).fetchall()
+
+    def subtree_sizes(
+        self,
+        conditions: Conditions | None = None,
+        relation: Relations | None = None,
+        nid: str | None = None,
+        include_base: bool = False,
+        limit: int | None = None
+    ) -> list[dict[str, Any]]:
+        """number of descendants of each node, largest subtrees first. Served from the maintained counters."""
+        stmt, values = self._nodes(["id"], conditions, relation, nid, include_base)
+        stmt = (
+            f"SELECT nodes.id AS id, s.size AS size FROM ({stmt}) AS nodes JOIN {self.sizes.table_name} s ON s.nid = nodes.id "
+            "ORDER BY s.size DESC, nodes.id LIMIT ?"
+        )
+        return self.tree.con.execute(stmt, values + [limit or -1]).fetchall()
+
+    def _nodes(
+        self,
+        fields: list[str],
+        conditions: Conditions | None,
+        relation: Relations | None,
+        nid: str | None,
+        include_base: bool
+    ) -> tuple[str, list[Any]]:
+        """select statement of the aggregated nodes."""
+        if relation is None:
+            return self._select(fields, conditions)
+
+        if nid is not None:
+            seed, seed_values = "?", [nid]
+            stmt, values = self._select(fields, conditions)
+        else:
+            seed, seed_values = self._select(["id"], conditions)
+            stmt, values = self._select(fields, None)
+
+        scope = relation_scope(self.sizes.nodes_table, relation, seed)
+        in_scope = "nodes.id IN scope"
+        if include_base:
+            in_scope = f"{in_scope} OR nodes.id IN ({seed})"
+            values = values + seed_values
+        return (f"{scope} SELECT * FROM ({stmt}) AS nodes WHERE {in_scope}", seed_values + values)
+
+    def _select(self, fields: list[str], conditions: Conditions | None) -> tuple[str, list[Any]]:
+        converter = SqlConverter(namespaces=self.tree.namespaces, tables=self.tree.tables, fields=fields, conds=conditions)
+        stmt, values = converter.read_many()
+        return (stmt.strip().rstrip(";").strip(), values)
+
+    def _one(self, stmt: str, values: list[Any]) -> dict[str, Any]:
+        return self.tree.con.execute(stmt, values).fetchone()
+
+    def _validate_field(self, field_name: str | None) -> None:
+        if field_name is None:
+            raise MissingParameter("field_name")
+        if field_name not in self.tree.namespaces:
+            raise KeyError(f"Unknown field name: {field_name}")
@@ -9,6 +9,7 @@ from sanic.request import Request
 from typing import Any, Optional
 
 from weetags.engine.engine import TreeEngine
+from app.profiling import profiled
 from weetags.engine.schema import (
     User,
     Restriction,
@@ -28,23 +29,40 @@ from weetags.exceptions import (
 StrOrPath = str | Path
 Users = Restricions = list[dict[str, Any]] | None
 
+# routes without a tree in their path. `multi` is checked against the trees of its `trees` param. The others check,
+# or filter down to, the trees of what they return with `permitted`.
+TREELESS_ROUTES = ["multi", "slow_queries", "profiles", "profile", "job", "cancel_job"]
+
 from functools import wraps
 
 def protected(f):
     @wraps(f)
     async def wrapped(request: Request, *args, **kwargs):
         authenticator: Authenticator = request.app.ctx.authenticator
-        if authenticator is None:
-            response = await f(request, *args, **kwargs)
+        warmup = getattr(request.app.ctx, "warmup", None)
+        request.ctx.warmup = warmup is not None and warmup.authorized(request)
+        if authenticator is None or request.ctx.warmup:
+            response = await profiled(f, request, *args, **kwargs)
             return response
 
         elif authenticator.authorize(request):
-            response = await f(request, *args, **kwargs)
+            response = await profiled(f, request, *args, **kwargs)
             return response
         else:
             raise AccessDenied()
     return wrapped
 
+def permitted(request: Request, trees: list[str], blueprints: list[str]) -> bool:
+    """
+    whether the authorized request token may access each of the trees, on each of the blueprints.
+    Always true without authentication, and for the warm-up replays.
+    """
+    authenticator: Authenticator | None = request.app.ctx.authenticator
+    auth_level = getattr(request.ctx, "auth_level", None)
+    if authenticator is None or auth_level is None:
+        return True
+    return all([authenticator.allowed(auth_level, tree, blueprint) for tree in trees for blueprint in blueprints])
+
 class Authenticator(TreeEngine):
     def __init__(self, database: StrOrPath = ":memory:") -> None:
         super().__init__("", database)
@@ -99,6 +117,11 @@ class Authenticator(TreeEngine):
         return jwt.encode({"auth_level": auth_level, "max_age": self._max_time_age(max_age)}, request.app.config.SECRET)
 
     def authorize(self, request: Request) -> bool:
+        """
+        Check the request token against the restrictions of the requested trees, for the route blueprint.
+        The `multi` route is checked against the trees of its `trees` param. The other `TREELESS_ROUTES` only check
+        the token here, their handlers check the trees of what they return.
+        """
         token = request.token
         route = request.route
         tree = request.match_info.get("tree_name")
@@ -106,12 +129,19 @@ class Authenticator(TreeEngine):
         if token is None:
             raise AuthorizationTokenRequired()
 
-        if tree is None:
-            raise ValueError("tree name not available")
-
         if route is None:
             raise ValueError("Route name not available")
 
+        _, blueprint, name = route.name.split('.')
+        if tree is not None:
+            trees = [tree]
+        elif name == "multi":
+            trees = list(getattr(request.ctx.params, "trees", None) or [])
+        elif name in TREELESS_ROUTES:
+            trees = []
+        else:
+            raise ValueError("tree name not available")
+
         try:
             payload = jwt.decode(
                 token, request.app.config.SECRET, algorithms=["HS256"]
@@ -119,16 +149,18 @@ class Authenticator(TreeEngine):
         except jwt.exceptions.InvalidTokenError:
             raise InvalidToken()
 
-        _, blueprint, _ = route.name.split('.')
-        restriction = self._get_restriction(tree, blueprint)
-
-        if restriction is not None and not any([level in payload["auth_level"] for level in restriction["auth_level"]]):
+        if not all([self.allowed(payload["auth_level"], tree, blueprint) for tree in trees]):
             raise AccessDenied()
 
         if int(time.time()) > payload["max_age"]:
             raise OutatedAuthorizationToken()
+        request.ctx.auth_level = payload["auth_level"]
         return True
-            
+
+    def allowed(self, auth_level: list[str], tree: str, blueprint: str) -> bool:
+        restriction = self._get_restriction(tree, blueprint)
+        return restriction is None or any([level in auth_level for level in restriction["auth_level"]])
+
     def _max_time_age(self, max_age: int) -> int:
         return int(time.time()) + max_age
 
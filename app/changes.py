@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import json
+import asyncio
+from time import time
+from collections import deque
+
+from typing import Any
+
+from app.metrics import Metrics
+
+HISTORY_SIZE = 1024
+BUFFER_SIZE = 256
+
+
+class Subscriber(object):
+    """
+    A change feed consumer with a bounded buffer of pre-serialized events.
+    A subscriber whose buffer is full is considered too slow: its backlog is dropped and it is closed.
+    The events replayed on subscription are kept apart, in `backlog`, and sent before the buffered ones: a client
+    resuming from far behind catches up whatever the buffer size.
+    """
+    def __init__(self, buffer_size: int = BUFFER_SIZE) -> None:
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=buffer_size)
+        self.backlog: list[bytes] = []
+        self.overflowed = False
+
+    def push(self, payload: bytes) -> bool:
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            self.close(overflowed=True)
+            return False
+
+    def close(self, overflowed: bool = False) -> None:
+        self.overflowed = overflowed
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class ChangeFeed(object):
+    """
+    Mutations of one tree, as server sent events.
+    Every event carries a monotonic sequence number (the SSE `id`), so a client can resume from it.
+    The last `history_size` events are kept for resumption.
+    """
+    def __init__(self, tree_name: str, history_size: int = HISTORY_SIZE, buffer_size: int = BUFFER_SIZE, metrics: Metrics | None = None) -> None:
+        self.tree_name = tree_name
+        self.seq = 0
+        self.buffer_size = buffer_size
+        self.history: deque[tuple[int, bytes]] = deque(maxlen=history_size)
+        self.subscribers: set[Subscriber] = set()
+        self.metrics = metrics
+
+    def publish(self, op: str, data: dict[str, Any]) -> int:
+        self.seq += 1
+        event = {"seq": self.seq, "tree": self.tree_name, "op": op, "ts": time(), "data": data}
+        payload = self.sse(self.seq, "change", event)
+        self.history.append((self.seq, payload))
+
+        dropped = [sub for sub in self.subscribers if not sub.push(payload)]
+        self.subscribers.difference_update(dropped)
+        if self.metrics is not None:
+            self.metrics.incr("changes_published", self.tree_name)
+            if dropped:
+                self.metrics.incr("changes_slow_subscribers", self.tree_name, len(dropped))
+        return self.seq
+
+    def subscribe(self, since: int | None = None) -> Subscriber:
+        """register a subscriber. Events following `since` are replayed when still in history, otherwise a `reset` event is sent first."""
+        subscriber = Subscriber(self.buffer_size)
+        if since is not None and since < self.seq:
+            oldest = self.history[0][0] if self.history else self.seq + 1
+            if since < oldest - 1:
+                subscriber.backlog.append(self.sse(None, "reset", {"tree": self.tree_name, "since": since, "seq": self.seq}))
+            subscriber.backlog.extend([payload for seq, payload in self.history if seq > since])
+        elif since is not None and since > self.seq:
+            # sequence numbers are restarted with the process.
+            subscriber.backlog.append(self.sse(None, "reset", {"tree": self.tree_name, "since": since, "seq": self.seq}))
+
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    @staticmethod
+    def sse(seq: int | None, event: str, data: dict[str, Any]) -> bytes:
+        head = f"id: {seq}\n" if seq is not None else ""
+        return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class ChangeFeeds(dict):
+    """tree name -> ChangeFeed, created on first use."""
+    def __init__(self, history_size: int = HISTORY_SIZE, buffer_size: int = BUFFER_SIZE, metrics: Metrics | None = None) -> None:
+        super().__init__()
+        self.history_size = history_size
+        self.buffer_size = buffer_size
+        self.metrics = metrics
+
+    def __missing__(self, tree_name: str) -> ChangeFeed:
+        feed = ChangeFeed(tree_name, self.history_size, self.buffer_size, self.metrics)
+        self[tree_name] = feed
+        return feed
+
+    def publish(self, tree_name: str, op: str, data: dict[str, Any]) -> int:
+        return self[tree_name].publish(op, data)
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import sqlite3
+
+from typing import Any, Literal, get_args
+
+from app.exceptions import UnknownFormat
+
+Node = dict[str, Any]
+Row = tuple[Any, ...]
+Format = Literal["rows", "columnar"]
+
+
+class Rows(object):
+    """
+    Records of a query as a header of field names and value tuples, read from the cursor without building a dict per node.
+    Columns selected twice (`*` over joined tables) keep their last value, as the tree record factory does.
+    """
+    __slots__ = ("fields", "rows")
+
+    def __init__(self, fields: list[str], rows: list[Row]) -> None:
+        self.fields = fields
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def from_cursor(cls, cursor: sqlite3.Cursor) -> Rows:
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        positions = {name:i for i, name in enumerate(columns)}
+        if len(positions) == len(columns):
+            return cls(columns, rows)
+        indexes = list(positions.values())
+        return cls(list(positions), [tuple([row[i] for i in indexes]) for row in rows])
+
+    @classmethod
+    def from_nodes(cls, nodes: list[Node] | Node | None) -> Rows:
+        """records already built as dicts (relation traversals). Fields are the ones of the first node."""
+        if nodes is None:
+            return cls([], [])
+        nodes = nodes if isinstance(nodes, list) else [nodes]
+        fields = list(nodes[0]) if nodes else []
+        return cls(fields, [tuple([node.get(f, None) for f in fields]) for node in nodes])
+
+    def encode(self, format: Format) -> dict[str, Any]:
+        """
+        rows: `{"fields": [...], "data": [[v0, v1...], ...]}`, one array of values per node, in `fields` order.
+        columnar: `{"fields": [...], "data": [[v0...], [v1...], ...]}`, one array of values per field, in `fields` order.
+        """
+        if format == "rows":
+            return {"format": format, "fields": self.fields, "data": self.rows}
+        columns = [list(column) for column in zip(*self.rows)] if self.rows else [[] for _ in self.fields]
+        return {"format": format, "fields": self.fields, "data": columns}
+
+
+def response_format(format: str | None) -> Format | None:
+    """requested compact format of a records response, None for the default list of nodes."""
+    if format is None:
+        return None
+    if format not in get_args(Format):
+        raise UnknownFormat(format, list(get_args(Format)))
+    return format
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+from pathlib import Path
+from time import perf_counter
+from sanic.log import logger
+from collections import defaultdict
+from attrs import define, field, validators
+
+from typing import Any, Iterable, Literal
+
+from weetags.tree import Tree
+from weetags.engine.sql import DTYPES
+from weetags.loaders import JlLoader
+from app.exceptions import DeltaError
+
+StrOrPath = str | Path
+Node = dict[str, Any]
+Op = Literal["upsert", "move", "delete"]
+
+STRUCTURAL_FIELDS = ["id", "parent", "children"]
+
+
+def strOrNone(instance: DeltaRecord, attribute: Any, value: Any) -> None:
+    if value is None:
+        return
+    if not isinstance(value, str):
+        raise TypeError(f"{attribute.name} must be of type str | None")
+
+
+@define(slots=False, kw_only=True)
+class DeltaRecord:
+    """
+    One line of a delta file.
+        {"op": "upsert", "node": {"id": "x", "parent": "y", ...}}. `parent` can be omitted to update an existing node in place.
+        {"op": "move", "id": "x", "parent": "z"}
+        {"op": "delete", "id": "x"}. delete the node and its whole subtree.
+    """
+    op: Op = field(validator=[validators.in_(["upsert", "move", "delete"])])
+    id: str = field(validator=[validators.instance_of(str)])
+    parent: str | None = field(default=None, validator=[strOrNone])
+    node: Node | None = field(default=None)
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> DeltaRecord:
+        op = payload.get("op", None)
+        if op == "upsert":
+            node = payload.get("node", None)
+            if not isinstance(node, dict) or "id" not in node:
+                raise ValueError("upsert records must carry a `node` with an `id`")
+            return cls(op=op, id=node["id"], parent=node.get("parent", None), node=node)
+        return cls(op=op, id=payload.get("id", None), parent=payload.get("parent", None))
+
+
+class DeltaApplier(object):
+    """
+    Apply delta records onto a built tree, in batched transactions.
+    Only the nodes touched by the delta are read and written, so the cost is proportional to the delta,
+    not to the tree (moves and deletes still walk the moved or deleted subtree).
+    `children`, `depth` and `is_leaf` are maintained here. Index tables follow through their triggers.
+    Must run within the tree thread.
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self, tree: Tree, batch_size: int | None = None) -> None:
+        self.tree = tree
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.nodes_table = tree.tables["nodes"]
+
+    def apply(self, records: Iterable[dict[str, Any]]) -> dict[str, Any]:
+        t = perf_counter()
+        counts, pending, committed, i = defaultdict(int), 0, 0, -1
+        try:
+            for i, payload in enumerate(records):
+                record = DeltaRecord.from_payload(payload)
+                getattr(self, record.op)(record)
+                counts[record.op] += 1
+                pending += 1
+                if pending == self.batch_size:
+                    self.tree.con.commit()
+                    committed, pending = committed + pending, 0
+            self.tree.con.commit()
+        except Exception as e:
+            self.tree.con.rollback()
+            raise DeltaError(i, committed, str(e))
+        return {"applied": dict(counts), "duration": round(perf_counter() - t, 5)}
+
+    def upsert(self, record: DeltaRecord) -> None:
+        node = {k:v for k,v in record.node.items() if k != "children"} # type: ignore
+        current = self.tree.node(record.id, ["id", "parent"])
+        if current is None:
+            self._insert(node)
+            return
+
+        setter = [(k, v) for k,v in self._validate(node).items() if k not in STRUCTURAL_FIELDS]
+        if setter:
+            self.tree._update("nodes", setter, [[("id", "=", record.id)]], commit=False)
+        if "parent" in node and node["parent"] != current["parent"]:
+            self._move(record.id, node["parent"])
+
+    def move(self, record: DeltaRecord) -> None:
+        if self.tree.node(record.id, ["id"]) is None:
+            raise KeyError(f"node {record.id} does not exist")
+        self._move(record.id, record.parent)
+
+    def delete(self, record: DeltaRecord) -> None:
+        node = self.tree.node(record.id, ["id", "parent", "depth"])
+        if node is None:
+            return
+        if node["depth"] == 0:
+            raise ValueError("cannot delete root node")
+
+        subtree = [record.id] + [nid for level in self._levels([record.id]) for nid in level]
+        for chunk in self._chunks(subtree):
+            # metadata rows are removed by cascade, index tables by their delete triggers.
+            self.tree._delete([[("id", "IN", chunk)]], commit=False)
+        self._detach(node["parent"], record.id)
+
+    def _insert(self, node: Node) -> None:
+        pid = node.get("parent", None)
+        if pid is None:
+            raise ValueError("tree can only have one root")
+        pnode = self.tree.node(pid, ["id", "depth", "children"])
+        if pnode is None:
+            raise KeyError(f"parent node {pid} does not exist")
+
+        node = self._validate(node)
+        for fname, f in self.nodes_table.fields.items():
+            if f.dtype == "JSON" and node.get(fname, None) is None:
+                node.update({fname: {}})
+            elif f.dtype == "JSONLIST" and node.get(fname, None) is None:
+                node.update({fname: []})
+        node.update({"children": []})
+
+        self.tree._write_one("nodes", list(node.keys()), list(node.values()), "none", commit=False)
+        self.tree._write_one(
+            "metadata",
+            ["nid", "depth", "is_root", "is_leaf"],
+            [node["id"], pnode["depth"] + 1, False, True],
+            "none",
+            commit=False
+        )
+        self._attach(pnode, node["id"])
+
+    def _move(self, nid: str, pid: str | None) -> None:
+        if pid is None:
+            raise ValueError("tree can only have one root")
+        node = self.tree.node(nid, ["id", "parent", "depth"])
+        pnode = self.tree.node(pid, ["id", "parent", "depth", "children"])
+        if pnode is None:
+            raise KeyError(f"parent node {pid} does not exist")
+        if node["depth"] == 0:
+            raise ValueError("cannot move root node")
+
+        # the new parent cannot be part of the moved subtree
+        ancestor = pnode
+        while ancestor is not None:
+            if ancestor["id"] == nid:
+                raise ValueError(f"cannot move {nid} under its own descendant {pid}")
+            ancestor = self.tree.node(ancestor["parent"], ["id", "parent"]) if ancestor["parent"] else None
+
+        self._detach(node["parent"], nid)
+        self._attach(pnode, nid)
+        self.tree._update("nodes", [("parent", pid)], [[("id", "=", nid)]], commit=False)
+
+        depth = pnode["depth"] + 1
+        if depth == node["depth"]:
+            return
+        self._set_depth([nid], depth)
+        for level in self._levels([nid]):
+            depth += 1
+            self._set_depth(level, depth)
+
+    def _attach(self, pnode: Node, cnid: str) -> None:
+        if cnid in pnode["children"]:
+            return
+        children = pnode["children"] + [cnid]
+        self.tree._update("nodes", [("children", children)], [[("id", "=", pnode["id"])]], commit=False)
+        self.tree._update("metadata", [("is_leaf", False)], [[("nid", "=", pnode["id"])]], commit=False)
+
+    def _detach(self, pid: str | None, cnid: str) -> None:
+        pnode = self.tree.node(pid, ["id", "children"]) if pid else None
+        if pnode is None or cnid not in pnode["children"]:
+            return
+        pnode["children"].remove(cnid)
+        self.tree._update("nodes", [("children", pnode["children"])], [[("id", "=", pid)]], commit=False)
+        if len(pnode["children"]) == 0:
+            self.tree._update("metadata", [("is_leaf", True)], [[("nid", "=", pid)]], commit=False)
+
+    def _set_depth(self, nids: list[str], depth: int) -> None:
+        for chunk in self._chunks(nids):
+            self.tree._update("metadata", [("depth", depth)], [[("nid", "IN", chunk)]], commit=False)
+
+    def _levels(self, nids: list[str]) -> Iterable[list[str]]:
+        """descendants of the given nodes, level by level."""
+        level = nids
+        while level:
+            children = []
+            for chunk in self._chunks(level):
+                nodes = self.tree._get_children_from_ids(self.nodes_table._name, chunk)
+                children.extend([cid for n in nodes for cid in n["children"]])
+            if children:
+                yield children
+            level = children
+
+    def _validate(self, node: Node) -> Node:
+        fields = self.nodes_table.fields
+        for k,v in node.items():
+            f = fields.get(k, None)
+            if f is None:
+                raise KeyError(f"Unknown field name: {k}")
+            if v is not None and isinstance(v, DTYPES.get(f.dtype, object)) is False:
+                raise ValueError(f"node field {k} has wrong dtype.")
+        return node
+
+    def _chunks(self, values: list[Any]) -> Iterable[list[Any]]:
+        for i in range(0, len(values), self.batch_size):
+            yield values[i:i + self.batch_size]
+
+
+def apply_delta_files(tree: Tree, paths: list[StrOrPath]) -> list[dict[str, Any]]:
+    """apply delta files in order. Must run within the tree thread."""
+    reports = []
+    for path in paths:
+        report = DeltaApplier(tree).apply(JlLoader(str(path), "lazy").loader())
+        logger.info(f"[{tree.name}] delta {path} applied: {report['applied']} in {report['duration']}s")
+        reports.append({"path": str(path), **report})
+    return reports
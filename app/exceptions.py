@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from weetags.exceptions import WeetagsException
+
+
+class QueryTimeout(WeetagsException):
+    message = """Query aborted: exceeded its deadline of {timeout}ms"""
+    status = 504
+    def __init__(self, timeout: int | None) -> None:
+        super().__init__(self.message.format(timeout=timeout))
+
+class ReloadInProgress(WeetagsException):
+    message = """the tree "{name}" is already being reloaded"""
+    status = 409
+    def __init__(self, name: str) -> None:
+        super().__init__(self.message.format(name=name))
+
+class TreeRetired(WeetagsException):
+    message = """the tree "{name}" was reloaded while the request ran. retry it"""
+    status = 503
+    def __init__(self, name: str) -> None:
+        super().__init__(self.message.format(name=name))
+
+class DeltaError(WeetagsException):
+    message = """delta record {index} could not be applied: {reasons}. {committed} records were committed before it"""
+    status = 400
+    def __init__(self, index: int, committed: int, reasons: str) -> None:
+        super().__init__(self.message.format(index=index, committed=committed, reasons=reasons))
+
+class MissingParameter(WeetagsException):
+    message = """Parameter "{name}" is required"""
+    status = 400
+    def __init__(self, name: str) -> None:
+        super().__init__(self.message.format(name=name))
+
+class SearchNotEnabled(WeetagsException):
+    message = """full text search is not enabled on the tree "{name}" (set its `search` fields)"""
+    status = 400
+    def __init__(self, name: str) -> None:
+        super().__init__(self.message.format(name=name))
+
+class InvalidSearchQuery(WeetagsException):
+    message = """invalid search query "{query}": {reasons}"""
+    status = 400
+    def __init__(self, query: str, reasons: str) -> None:
+        super().__init__(self.message.format(query=query, reasons=reasons))
+
+class UnknownAggregate(WeetagsException):
+    message = """Aggregate "{aggregate}" is unknown. possible aggregates : [{aggregates}]"""
+    status = 400
+    def __init__(self, aggregate: str, aggregates: list[str]) -> None:
+        super().__init__(self.message.format(aggregate=aggregate, aggregates=", ".join(aggregates)))
+
+class UnknownLookup(WeetagsException):
+    message = """Lookup "{lookup}" is unknown. possible lookups : [{lookups}]"""
+    status = 400
+    def __init__(self, lookup: str, lookups: list[str]) -> None:
+        super().__init__(self.message.format(lookup=lookup, lookups=", ".join(lookups)))
+
+class UnknownProfile(WeetagsException):
+    message = """profile {pid} does not exist or was evicted"""
+    status = 404
+    def __init__(self, pid: int) -> None:
+        super().__init__(self.message.format(pid=pid))
+
+class ProfilerBusy(WeetagsException):
+    message = """a request profile is already being captured. retry later, or without the `X-Profile` header"""
+    status = 409
+    def __init__(self) -> None:
+        super().__init__(self.message)
+
+class UnknownJob(WeetagsException):
+    message = """job {job_id} does not exist or was evicted"""
+    status = 404
+    def __init__(self, job_id: str) -> None:
+        super().__init__(self.message.format(job_id=job_id))
+
+class UnknownFormat(WeetagsException):
+    message = """Format "{format}" is unknown. possible formats : [{formats}]"""
+    status = 400
+    def __init__(self, format: str, formats: list[str]) -> None:
+        super().__init__(self.message.format(format=format, formats=", ".join(formats)))
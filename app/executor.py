@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+from threading import Event
+from functools import partial
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from sanic.request import Request
+
+from typing import Any, Callable, Iterator
+
+from weetags.tree import Tree
+from weetags.tree_builder import TreeBuilder
+from weetags.exceptions import CoversionError
+from app.exceptions import QueryTimeout, TreeRetired
+from app.options import release_tree
+from app.profiling import RequestProfile
+from app.slowlog import QueryTrace, SlowQueryLog
+
+# number of sqlite VM instructions between two deadline checks.
+PROGRESS_STEPS = 1000
+TIMEOUT_HEADER = "X-Timeout-Ms"
+
+
+class TreeExecutor(object):
+    """
+    Single worker thread owning a tree sqlite connection.
+    Sqlite connections are bound to the thread that opened them, so the tree is built and queried from this thread only.
+    Running the queries out of the event loop keeps the server responsive and let us abort them
+    once their deadline is passed or their client is gone.
+    Callers submitting several calls over time (streams, background jobs, handlers) hold the tree with `using`, so
+    that a reloaded tree is only retired once they are done with it. Calls submitted to a retired tree, by callers
+    that got it before its reload, are refused with a retryable error (503).
+    """
+    def __init__(self, tree_name: str) -> None:
+        self.tree_name = tree_name
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"weetags-{tree_name}")
+        self.users = 0
+        self.retired = False
+        self._released = asyncio.Event()
+        self._released.set()
+
+    def build(self, **settings: Any) -> Tree:
+        return self.pool.submit(partial(self._build, **settings)).result()
+
+    async def build_async(self, **settings: Any) -> Tree:
+        return await self.submit(self._build, **settings)
+
+    @contextmanager
+    def using(self) -> Iterator[None]:
+        """hold the tree across several submissions. Must be entered from the event loop."""
+        self.users += 1
+        self._released.clear()
+        try:
+            yield
+        finally:
+            self.users -= 1
+            if self.users == 0:
+                self._released.set()
+
+    async def retire(self, tree: Tree, drop: bool = False) -> None:
+        """
+        Close the tree once its users are gone and every query already submitted to its thread is done, then stop the thread.
+        :drop: drop the tree tables beforehand. Used to release shared in-memory databases.
+        """
+        def close() -> None:
+            if drop:
+                release_tree(tree)
+                tables = sorted(tree.tables.values(), key=lambda t: t._name.endswith("__nodes"))
+                [tree._drop(table._name) for table in tables]
+            tree.con.close()
+
+        while self.users > 0:
+            await self._released.wait()
+        self.retired = True
+        await asyncio.get_running_loop().run_in_executor(self.pool, close)
+        self.pool.shutdown(wait=False)
+
+    def _build(self, **settings: Any) -> Tree:
+        tree = TreeBuilder.build_tree(**settings)
+        tree.executor = self
+        return tree
+
+    async def submit(self, f: Callable, *args: Any, **kwargs: Any) -> Any:
+        """run a callable within the tree thread, without any deadline. Used for mutations."""
+        if self.retired:
+            raise TreeRetired(self.tree_name)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, partial(f, *args, **kwargs))
+
+    async def guarded(
+        self,
+        f: Callable,
+        deadline: float | None,
+        *args: Any,
+        profile: RequestProfile | None = None,
+        trace: QueryTrace | None = None,
+        **kwargs: Any
+    ) -> Any:
+        """
+        run a callable within the tree thread. The running query is interrupted when the deadline is passed or the awaiting task is cancelled.
+        :profile: profile of the request, capturing the call within the tree thread.
+        :trace: records the statements of the call, for the slow query log.
+        """
+        if self.retired:
+            raise TreeRetired(self.tree_name)
+        loop = asyncio.get_running_loop()
+        cancelled = Event()
+        try:
+            return await loop.run_in_executor(self.pool, partial(self._guarded, f, deadline, cancelled, profile, trace, args, kwargs))
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    @staticmethod
+    def _guarded(
+        f: Callable,
+        deadline: float | None,
+        cancelled: Event,
+        profile: RequestProfile | None,
+        trace: QueryTrace | None,
+        args: tuple,
+        kwargs: dict[str, Any]
+    ) -> Any:
+        def expired() -> bool:
+            return cancelled.is_set() or (deadline is not None and perf_counter() > deadline)
+
+        if expired():
+            # waited too long in the queue, don't even start.
+            raise sqlite3.OperationalError("interrupted")
+
+        con = bound_tree(f).con
+        con.set_progress_handler(expired, PROGRESS_STEPS)
+        try:
+            with profile.capture() if profile is not None else nullcontext():
+                with trace.capture(con) if trace is not None else nullcontext():
+                    return f(*args, **kwargs)
+        finally:
+            con.set_progress_handler(None, PROGRESS_STEPS)
+
+
+def bound_tree(f: Callable) -> Tree:
+    """tree a bound method works on: the tree itself or an app level structure attached to it, such as its search index."""
+    owner = f.__self__
+    return owner if isinstance(owner, Tree) else owner.tree
+
+def request_timeout(request: Request) -> int | None:
+    """
+    Resolve the request timeout in ms.
+    The `X-Timeout-Ms` header takes precedence over the route timeout (`ROUTE_TIMEOUTS_MS`), itself over the default one (`TIMEOUT_MS`).
+    Header timeouts are capped by `MAX_TIMEOUT_MS`.
+    """
+    config = request.app.config
+    route = request.route.name.split(".")[-1] if request.route else None
+    timeout = config.get("ROUTE_TIMEOUTS_MS", {}).get(route, config.get("TIMEOUT_MS", None))
+
+    header = request.headers.get(TIMEOUT_HEADER, None)
+    if header is not None:
+        if not header.isdigit():
+            raise CoversionError(header, "int")
+        timeout = int(header)
+        max_timeout = config.get("MAX_TIMEOUT_MS", None)
+        if max_timeout is not None:
+            timeout = min(timeout, max_timeout)
+    return timeout
+
+
+def tree_timeout(request: Request, tree_name: str, timeouts: dict[str, int] | None) -> int | None:
+    """Resolve the timeout in ms of one tree of a multi trees request: its own timeout if any, capped by `MAX_TIMEOUT_MS`, else the request timeout."""
+    if not timeouts or tree_name not in timeouts:
+        return request_timeout(request)
+    timeout = timeouts[tree_name]
+    if not isinstance(timeout, int):
+        raise CoversionError(timeout, "int")
+    max_timeout = request.app.config.get("MAX_TIMEOUT_MS", None)
+    return timeout if max_timeout is None else min(timeout, max_timeout)
+
+
+async def query(request: Request, f: Callable, *args: Any, **kwargs: Any) -> Any:
+    """run a tree read method within its tree thread, bounded by the request deadline."""
+    return await query_within(request, request_timeout(request), f, *args, **kwargs)
+
+
+async def query_within(request: Request, timeout: int | None, f: Callable, *args: Any, **kwargs: Any) -> Any:
+    """run a tree read method within its tree thread, bounded by `timeout` ms from the request start."""
+    tree = bound_tree(f)
+    executor: TreeExecutor = tree.executor
+    metrics = request.app.ctx.metrics
+    slow_queries: SlowQueryLog | None = getattr(request.app.ctx, "slow_queries", None)
+    trace = slow_queries.trace() if slow_queries is not None else None
+    deadline = None
+    if timeout is not None:
+        deadline = request.ctx.t + timeout / 1000
+
+    try:
+        result = await executor.guarded(f, deadline, *args, profile=getattr(request.ctx, "profile", None), trace=trace, **kwargs)
+        if trace is not None and trace.slow:
+            metrics.incr("slow_queries", tree.tree_name)
+            slow_queries.record(request, tree.tree_name, f.__name__, kwargs, result, trace)
+        return result
+    except asyncio.CancelledError:
+        metrics.incr("queries_aborted", "disconnect")
+        raise
+    except sqlite3.OperationalError as e:
+        if str(e) != "interrupted":
+            raise
+        metrics.incr("queries_aborted", "deadline")
+        raise QueryTimeout(timeout)
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from weetags.tree import Tree
+from app.fetch import fetch_nodes
+
+Node = dict[str, Any]
+Nodes = list[Node]
+# relation -> {"fields": list[str] | None, "limit": int | None}
+Include = dict[str, dict[str, Any]]
+
+
+class NodeExpander(object):
+    """
+    A node and its requested relations, as one composite document: `{"node": {...}, "relations": {"parent": {...}, "children": [...]}}`.
+    Relations are resolved in the same tree thread pass as the node. Parent, children and siblings are read from the
+    ids the node itself holds. Ancestors and descendants go through the topology cache when enabled.
+    Each relation has its own `fields` and `limit`.
+    Must run within the tree thread.
+    """
+    def __init__(self, tree: Tree) -> None:
+        self.tree = tree
+        topology = getattr(tree, "topology", None)
+        self.source = tree if topology is None else topology
+
+    def node(self, nid: str, fields: Optional[list[str]] = None, include: Optional[Include] = None) -> dict[str, Any]:
+        include = include or {}
+        # the node holds the ids of its parent and children: read them along, then leave them out if not requested.
+        extra = [] if fields is None else [f for f in ["parent", "children"] if f not in fields]
+        node = self.tree.node(nid, None if fields is None else fields + extra)
+        if node is None:
+            return {"node": None, "relations": {relation:(None if relation == "parent" else []) for relation in include}}
+
+        relations = {}
+        for relation, spec in include.items():
+            relations[relation] = self.relation(nid, node, relation, spec.get("fields", None), spec.get("limit", None))
+        for f in extra:
+            node.pop(f, None)
+        return {"node": node, "relations": relations}
+
+    def relation(self, nid: str, node: Node, relation: str, fields: list[str] | None, limit: int | None) -> Node | Nodes | None:
+        if relation == "parent":
+            nodes = fetch_nodes(self.tree, [node["parent"]], fields) if node["parent"] is not None else []
+            return nodes[0] if nodes else None
+        if relation == "children":
+            return fetch_nodes(self.tree, node["children"][:limit], fields)
+        if relation == "siblings":
+            if node["parent"] is None:
+                return []
+            parent = fetch_nodes(self.tree, [node["parent"]], ["children"])
+            siblings = [sibling for sibling in (parent[0]["children"] if parent else []) if sibling != nid]
+            return fetch_nodes(self.tree, siblings[:limit], fields)
+        if relation == "ancestors":
+            return self.source.ancestors_nodes(nid, fields, limit=limit)
+        return self.source.descendants_nodes(nid, fields, limit=limit)
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from typing import Any
+
+from weetags.tree import Tree
+from weetags.engine.sql import SqlConverter, READ_MANY
+
+Nodes = list[dict[str, Any]]
+
+
+def fetch_nodes(
+    tree: Tree,
+    ids: list[str],
+    fields: list[str] | None = None,
+    order_by: list[str] | None = None,
+    axis: int = 1,
+    limit: int | None = None
+) -> Nodes:
+    """
+    fetch the fields of a list of nodes in one query, whatever their number: ids are bound as a single json array.
+    Without `order_by`, the order of `ids` is kept.
+    """
+    if not ids:
+        return []
+
+    nodes_table = tree.tables["nodes"]._name
+    projection = fields if fields is None or "id" in fields else ["id"] + fields
+    converter = SqlConverter(
+        namespaces=tree.namespaces,
+        tables=tree.tables,
+        fields=projection,
+        order_by=order_by,
+        axis=axis,
+        limit=limit
+    )
+    stmt = READ_MANY.format(
+        fields=converter.parse_fields(),
+        node_table=nodes_table,
+        joins=converter.parse_joins(),
+        conditions=f"WHERE {nodes_table}.id IN (SELECT value FROM json_each(?))",
+        order=converter.parse_order(),
+        axis=converter.parse_axis(),
+        limit=converter.parse_limit()
+    )
+    nodes = tree.con.execute(stmt, [tree._serialize(ids)]).fetchall()
+    if order_by is None:
+        rows = {n["id"]:n for n in nodes}
+        nodes = [rows[nid] for nid in ids if nid in rows]
+    if projection is not fields:
+        [n.pop("id") for n in nodes]
+    return nodes
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import sqlite3
+
+from typing import Any
+
+from weetags.tree import Tree
+from weetags.engine.engine import TreeEngine
+
+# field types that can be interned. JSON values are interned as their serialized text.
+INTERNED_TYPES = ["TEXT", "JSON", "JSONLIST"]
+STRUCTURAL_FIELDS = ["id", "parent", "children"]
+# TreeBuilder settings that are not connection parameters.
+BUILD_SETTINGS = ["tree_name", "database", "data", "indexes", "read_only", "replace"]
+
+# the generated columns carry the declared types of the json fields, so that the connection converters still apply on read.
+CREATE_DICTIONARY = (
+    "CREATE TABLE {dictionary} (code INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE, "
+    "json JSON GENERATED ALWAYS AS (value) VIRTUAL, jsonlist JSONLIST GENERATED ALWAYS AS (value) VIRTUAL);"
+)
+FILL_DICTIONARY = (
+    "INSERT INTO {dictionary}(value) SELECT DISTINCT {field} FROM {table} "
+    "WHERE {field} IS NOT NULL AND {field} NOT IN (SELECT value FROM {dictionary});"
+)
+RECODE = "UPDATE {table} SET {field} = (SELECT code FROM {dictionary} WHERE value = {table}.{field}) WHERE {field} IS NOT NULL;"
+CREATE_VIEW = "CREATE VIEW {nodes_table} AS SELECT {columns} FROM {table} AS p {joins};"
+
+# new values are added to the dictionary one by one, so that an outer `OR REPLACE` never reassigns existing codes.
+INTERN = "INSERT INTO {dictionary}(value) SELECT NEW.{field} WHERE NEW.{field} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {dictionary} WHERE value = NEW.{field});"
+CODE = "(SELECT code FROM {dictionary} WHERE value = NEW.{field})"
+INSERT_TRIGGER = """
+CREATE TRIGGER {table}__insert_trigger INSTEAD OF INSERT ON {nodes_table} BEGIN
+{intern}
+INSERT INTO {table}({fields}) VALUES ({values});
+END;
+"""
+# one statement per modified column, so that the triggers of the storage table (`AFTER UPDATE OF parent`...) see the same
+# columns as without interning. id last, the other statements match on the old one.
+UPDATE_TRIGGER = """
+CREATE TRIGGER {table}__update_trigger INSTEAD OF UPDATE ON {nodes_table} BEGIN
+{intern}
+{updates}
+END;
+"""
+UPDATE_COLUMN = "UPDATE {table} SET {field} = {value} WHERE id = OLD.id AND NEW.{field} IS NOT OLD.{field};"
+DELETE_TRIGGER = """
+CREATE TRIGGER {table}__delete_trigger INSTEAD OF DELETE ON {nodes_table} BEGIN
+DELETE FROM {table} WHERE id = OLD.id;
+END;
+"""
+
+
+class Interning(object):
+    """
+    Deduplicated storage of repeated field values of a tree.
+    The values of the interned fields are stored once in a dictionary table, `_dictionary__{tree}`, and the nodes only
+    hold their integer codes. The nodes table is renamed `_interned__{tree}`, a view takes its name and expands the
+    codes back on read, its triggers intern the written values. Reads, conditions and writes of the tree are unchanged.
+    The tree metadata, index tables and their triggers follow the renamed table. The app level structures reading the
+    tree shape, or setting triggers on the nodes, use `storage_table` instead of the view.
+    Must run within the tree thread.
+    """
+    def __init__(self, tree: Tree, fields: list[str]) -> None:
+        self.tree = tree
+        self.fields = fields
+        self.nodes_table = tree.tables["nodes"]._name
+        self.table = f"_interned__{tree.tree_name}"
+        self.dictionary = f"_dictionary__{tree.tree_name}"
+        self._validate()
+
+    def build(self) -> None:
+        columns = [c["name"] for c in self.tree.con.execute(f"PRAGMA table_info({self.nodes_table});").fetchall()]
+        params = {"nodes_table": self.nodes_table, "table": self.table, "dictionary": self.dictionary}
+        statements = [
+            f"ALTER TABLE {self.nodes_table} RENAME TO {self.table};",
+            CREATE_DICTIONARY.format(**params),
+        ]
+        for field in self.fields:
+            statements.append(FILL_DICTIONARY.format(field=field, **params))
+            statements.append(RECODE.format(field=field, **params))
+
+        expanded = {f:f"_{f}.{self._column(f)}" for f in self.fields}
+        statements.append(CREATE_VIEW.format(
+            columns=", ".join([f"{expanded.get(c, f'p.{c}')} AS {c}" for c in columns]),
+            joins=" ".join([f"LEFT JOIN {self.dictionary} AS _{f} ON _{f}.code = p.{f}" for f in self.fields]),
+            **params
+        ))
+
+        intern = "\n".join([INTERN.format(field=f, **params) for f in self.fields])
+        values = {c:(CODE.format(field=c, **params) if c in self.fields else f"NEW.{c}") for c in columns}
+        updates = [UPDATE_COLUMN.format(field=c, value=values[c], **params) for c in columns if c != "id"]
+        updates.append(UPDATE_COLUMN.format(field="id", value="NEW.id", **params))
+        statements.extend([
+            INSERT_TRIGGER.format(intern=intern, fields=", ".join(columns), values=", ".join(values.values()), **params),
+            UPDATE_TRIGGER.format(intern=intern, updates="\n".join(updates), **params),
+            DELETE_TRIGGER.format(**params),
+        ])
+        for statement in statements:
+            self.tree.con.execute(statement)
+        self.tree.con.commit()
+        self._compact()
+
+    def drop(self) -> None:
+        """remove the view and the dictionary. The renamed table takes its name back, codes included: used before dropping the tree tables."""
+        statements = [
+            f"DROP VIEW IF EXISTS {self.nodes_table};",
+            f"ALTER TABLE {self.table} RENAME TO {self.nodes_table};",
+            f"DROP TABLE IF EXISTS {self.dictionary};",
+        ]
+        for statement in statements:
+            self.tree.con.execute(statement)
+        self.tree.con.commit()
+
+    def stats(self) -> dict[str, Any]:
+        entries = self.tree.con.execute(f"SELECT count(*) AS n, coalesce(sum(length(value)), 0) AS size FROM {self.dictionary};").fetchone()
+        return {
+            "fields": self.fields,
+            "dictionary_entries": entries["n"],
+            "dictionary_value_bytes": entries["size"],
+        }
+
+    def _compact(self) -> None:
+        """
+        Recoded rows leave free space within their pages, kept by in memory databases. Rebuild the database of the tree.
+        Skipped when busy: the free space then goes to the next writes.
+        """
+        try:
+            self.tree.con.execute("VACUUM;")
+        except sqlite3.OperationalError:
+            pass
+
+    def _column(self, field: str) -> str:
+        ftype = self.tree.namespaces[field].ftype
+        return "value" if ftype == "TEXT" else ftype.lower()
+
+    def _validate(self) -> None:
+        for field in self.fields:
+            namespace = self.tree.namespaces.get(field, None)
+            if namespace is None or namespace.table != self.nodes_table or field in STRUCTURAL_FIELDS:
+                raise ValueError(f"field {field} cannot be interned. interned fields must be node fields, other than {STRUCTURAL_FIELDS}")
+            if namespace.ftype not in INTERNED_TYPES:
+                raise ValueError(f"field {field} of type {namespace.ftype} cannot be interned. possible types: {INTERNED_TYPES}")
+            # the index tables of list fields are filled from the stored values.
+            if getattr(namespace, "index_table", None) is not None:
+                raise ValueError(f"indexed list field {field} cannot be interned")
+            # an index would hold the codes, while the conditions compare the values of the view.
+            if field in self._indexed():
+                raise ValueError(f"indexed field {field} cannot be interned")
+
+    def _indexed(self) -> set[str]:
+        """fields of the nodes table covered by an index, the primary key aside."""
+        indexes = self.tree.con.execute(f"PRAGMA index_list({self.nodes_table});").fetchall()
+        columns = set()
+        for index in indexes:
+            if index["origin"] != "c":
+                continue
+            columns.update([c["name"] for c in self.tree.con.execute(f"PRAGMA index_info({index['name']});").fetchall()])
+        return columns
+
+
+def storage_table(tree: Tree) -> str:
+    """table holding the nodes of a tree: the nodes table, or its interned storage table."""
+    interning = getattr(tree, "interning", None)
+    return interning.table if interning is not None else tree.tables["nodes"]._name
+
+def discard_interned(settings: dict[str, Any]) -> None:
+    """
+    Drop the tables of an interned tree left in a shared in memory database by a previous build, as the TreeBuilder
+    does not see the view of the nodes and would not build the tree again.
+    """
+    tree_name = settings["tree_name"]
+    params = {k:v for k,v in settings.items() if k not in BUILD_SETTINGS}
+    engine = TreeEngine(tree_name, settings.get("database", ":memory:"), **params)
+    try:
+        tables = [row["name"] for row in engine.con.execute("SELECT name FROM sqlite_master WHERE type = 'table';").fetchall()]
+        if f"_interned__{tree_name}" not in tables:
+            return
+        # the tables referencing the nodes first.
+        statements = [f"DROP VIEW IF EXISTS {tree_name}__nodes;"]
+        statements.extend([f"DROP TABLE {table};" for table in tables if table.startswith(f"{tree_name}__")])
+        statements.extend([f"DROP TABLE IF EXISTS _interned__{tree_name};", f"DROP TABLE IF EXISTS _dictionary__{tree_name};"])
+        for statement in statements:
+            engine.con.execute(statement)
+        engine.con.commit()
+    finally:
+        engine.con.close()
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+from uuid import uuid4
+from time import time, perf_counter
+from collections import OrderedDict
+
+from typing import Any, Literal
+
+from weetags.tree import Tree
+from app.changes import ChangeFeeds
+from app.delta import DeltaApplier
+
+Conditions = list[list[tuple[str, str, Any] | str] | str]
+Setter = list[tuple[str, Any]]
+JobOp = Literal["delete_nodes_where", "update_nodes_where"]
+JobStatus = Literal["pending", "running", "done", "failed", "cancelled"]
+
+
+class Job(object):
+    """
+    Bulk mutation of the nodes complying with `conditions`, run in the background in chunked transactions.
+    The complying nodes are resolved once, when the job starts. Each chunk is then committed on its own, and
+    the tree thread is released between chunks, so that the queued reads go through.
+    A cancelled or failed job keeps the chunks committed before it.
+    Deletes follow `Tree.delete_nodes_where`: the complying nodes are removed, their children left orphans, and
+    with the tree `remove_orphans` (default) the dead branches go as well. Those are resolved upfront, counted in
+    the total and chunked with the complying nodes, deepest first, so that each chunk leaves a consistent tree.
+    """
+    def __init__(self, tree_name: str, op: JobOp, conditions: Conditions | None, set_values: Setter | None, chunk_size: int) -> None:
+        self.id = uuid4().hex
+        self.tree_name = tree_name
+        self.op = op
+        self.conditions = conditions
+        self.set_values = set_values
+        self.chunk_size = chunk_size
+        self.status: JobStatus = "pending"
+        self.total: int | None = None
+        self.processed = 0
+        self.chunks = 0
+        self.error: str | None = None
+        self.created = time()
+        self.finished: float | None = None
+        self.duration: float | None = None
+        self.cancelled = False
+        self.task: asyncio.Task | None = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ["done", "failed", "cancelled"]
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "tree": self.tree_name,
+            "op": self.op,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "progress": round(self.processed / self.total, 4) if self.total else (1.0 if self.status == "done" else 0.0),
+            "chunks": self.chunks,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+            "duration": self.duration,
+        }
+
+    async def run(self, tree: Tree, changes: ChangeFeeds, trees: dict[str, Tree]) -> None:
+        """
+        :trees: served trees. The job holds its tree while running, and is cancelled once a reload swaps it out:
+            the remaining chunks are not applied, the committed ones went with the retired tree.
+        """
+        t = perf_counter()
+        self.status = "running"
+        try:
+            executor = tree.executor
+            with executor.using():
+                nids = await executor.submit(self._targets, tree)
+                self.total = len(nids)
+                for i in range(0, len(nids), self.chunk_size):
+                    if self.cancelled:
+                        self.status = "cancelled"
+                        break
+                    if trees.get(self.tree_name, None) is not tree:
+                        self.status = "cancelled"
+                        self.error = "tree reloaded during the job, its committed chunks went with the previous tree"
+                        break
+                    chunk = nids[i:i + self.chunk_size]
+                    await executor.submit(self._apply, tree, chunk)
+                    self.processed += len(chunk)
+                    self.chunks += 1
+                    changes.publish(self.tree_name, self.op.replace("_where", ""), {"job": self.id, "nids": chunk, "set_values": self.set_values})
+                else:
+                    self.status = "done"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            self.error = "server stopped"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.finished = time()
+            self.duration = round(perf_counter() - t, 5)
+
+    def _targets(self, tree: Tree) -> list[str]:
+        """complying node ids, checked before any write. Must run within the tree thread."""
+        if self.op == "update_nodes_where":
+            self._validate(tree)
+        nids = [n["id"] for n in tree.statements.nodes_where(self.conditions, ["id"])]
+        if self.op == "delete_nodes_where":
+            if tree.root_id in nids:
+                raise ValueError("cannot delete root node")
+            if tree.remove_orphans:
+                nids = self._dead_branches(tree, nids)
+        return nids
+
+    def _dead_branches(self, tree: Tree, nids: list[str]) -> list[str]:
+        """deleted nodes, their descendants and the branches already dead, as `Tree.delete_dead_branches` finds them, deepest first."""
+        heads = nids + [o["id"] for o in tree.orphans_nodes(["id"])]
+        levels = [heads] + list(DeltaApplier(tree)._levels(heads))
+        return list(dict.fromkeys([nid for level in reversed(levels) for nid in level]))
+
+    def _validate(self, tree: Tree) -> None:
+        tree.statements.validate(self.set_values)
+
+    def _apply(self, tree: Tree, chunk: list[str]) -> None:
+        """one transaction. Must run within the tree thread."""
+        try:
+            if self.op == "delete_nodes_where":
+                self._delete(tree, chunk)
+            else:
+                tree.statements.update_nodes(chunk, self.set_values, commit=False)
+            tree.con.commit()
+        except Exception:
+            tree.con.rollback()
+            raise
+
+    def _delete(self, tree: Tree, chunk: list[str]) -> None:
+        """remove the nodes, detached from their remaining parent. Their remaining children are left orphans."""
+        applier = DeltaApplier(tree)
+        deleted = set(chunk)
+        orphans = []
+        for nid in chunk:
+            node = tree.node(nid, ["id", "parent", "children"])
+            if node is None:
+                continue
+            orphans.extend([cid for cid in node["children"] if cid not in deleted])
+            if node["parent"] not in deleted:
+                applier._detach(node["parent"], nid)
+        for ids in applier._chunks(orphans):
+            tree._update("nodes", [("parent", None)], [[("id", "IN", ids)]], commit=False)
+        # metadata rows are removed by cascade, index tables by their delete triggers.
+        for ids in applier._chunks(chunk):
+            tree._delete([[("id", "IN", ids)]], commit=False)
+
+
+class Jobs(object):
+    """
+    Background jobs of the app, kept once done for their results, up to `history_size` of them.
+    """
+    CHUNK_SIZE = 500
+
+    def __init__(self, changes: ChangeFeeds, trees: dict[str, Tree], history_size: int = 256) -> None:
+        self.changes = changes
+        self.trees = trees
+        self.history_size = history_size
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+
+    def submit(
+        self,
+        tree: Tree,
+        tree_name: str,
+        op: JobOp,
+        conditions: Conditions | None,
+        set_values: Setter | None = None,
+        chunk_size: int | None = None
+    ) -> Job:
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        job = Job(tree_name, op, conditions, set_values, chunk_size or self.CHUNK_SIZE)
+        self.jobs[job.id] = job
+        self._evict()
+        job.task = asyncio.get_running_loop().create_task(job.run(tree, self.changes, self.trees), name=f"weetags-job-{job.id}")
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id, None)
+
+    def cancel(self, job_id: str) -> Job | None:
+        """stop the job before its next chunk."""
+        job = self.jobs.get(job_id, None)
+        if job is not None and not job.done:
+            job.cancelled = True
+        return job
+
+    def _evict(self) -> None:
+        finished = [jid for jid, job in self.jobs.items() if job.done]
+        for jid in finished[:max(0, len(self.jobs) - self.history_size)]:
+            del self.jobs[jid]
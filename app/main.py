@@ -10,9 +10,19 @@ from typing import Any, Optional
 
 from weetags.tree import Tree
 from app.parsers import get_config
-from weetags.tree_builder import TreeBuilder
+from app.metrics import Metrics
+from app.singleflight import SingleFlight
+from app.profiling import Profiles, dumps
+from app.warmup import WarmUp
+from app.slowlog import SlowQueryLog
+from app.changes import ChangeFeeds
+from app.jobs import Jobs
+from app.executor import TreeExecutor
+from app.reloader import TreeReloader, active_settings
+from app.options import pop_tree_options, prepare_tree
+from app.interning import discard_interned
 from app.authentication import Authenticator
-from app.routes import base, shower, records, utils, writer, login
+from app.routes import base, shower, records, utils, writer, login, admin
 from app.middlewares import log_entry, log_exit, cookie_token, error_handler
 
 Settings = dict[str, Any]
@@ -36,7 +46,7 @@ class Weetags(object):
         if sanic is None:
             sanic = {}
 
-        self.app = Sanic("Weetags", log_config=self.configurate_logging(logging))
+        self.app = Sanic("Weetags", log_config=self.configurate_logging(logging), dumps=dumps)
         self.app.config.update({k.upper():v for k,v in sanic.get("app", {}).items()})
         self.register_bluprints(sanic.get("blueprints", None))
 
@@ -45,7 +55,30 @@ class Weetags(object):
         self.app.on_request(cookie_token, priority=99)
         self.app.error_handler.add(Exception, error_handler)
 
-        self.app.ctx.trees = self.register_trees(trees)
+        options = {name:pop_tree_options(settings) for name, settings in trees.items()}
+
+        self.app.ctx.metrics = Metrics()
+        self.app.ctx.profiles = Profiles(
+            size=self.app.config.get("PROFILES_SIZE", 32),
+            sample_rate=self.app.config.get("PROFILE_SAMPLE_RATE", 0.0)
+        )
+        self.app.ctx.changes = ChangeFeeds(
+            history_size=self.app.config.get("CHANGES_HISTORY", 1024),
+            buffer_size=self.app.config.get("CHANGES_BUFFER", 256),
+            metrics=self.app.ctx.metrics
+        )
+        self.app.ctx.single_flight = SingleFlight(self.app.ctx.metrics) if self.app.config.get("SINGLE_FLIGHT", True) else None
+        self.app.ctx.trees = self.register_trees(trees, options)
+        self.app.ctx.jobs = Jobs(self.app.ctx.changes, self.app.ctx.trees, history_size=self.app.config.get("JOBS_HISTORY", 256))
+        self.app.ctx.reloader = TreeReloader(self.app.ctx.trees, trees, options, self.app.ctx.changes)
+        self.register_watchers({name:opts["watch"] for name, opts in options.items()})
+
+        self.app.ctx.slow_queries = SlowQueryLog(
+            threshold_ms=self.app.config.get("SLOW_QUERY_MS", None),
+            size=self.app.config.get("SLOW_QUERIES_SIZE", 50)
+        )
+        self.app.ctx.warmup = WarmUp(**self.app.config.get("WARMUP", {}), secret=self.app.config.get("SECRET", None))
+        self.app.register_listener(self.app.ctx.warmup.start, "after_server_start")
 
         self.app.ctx.authenticator = None
         if authentication:
@@ -62,8 +95,16 @@ class Weetags(object):
         print((Path(__file__).parent / "banner").read_text())
         print(f"Booting {self.env} ENV")
 
-    def register_trees(self, trees_settings: dict[str, Settings]) -> dict[str, Tree]:
-        return {name:TreeBuilder.build_tree(**settings) for name, settings in trees_settings.items()}
+    def register_trees(self, trees_settings: dict[str, Settings], options: dict[str, Settings]) -> dict[str, Tree]:
+        [discard_interned(settings) for name, settings in trees_settings.items() if options[name]["intern"]]
+        trees = {name:TreeExecutor(name).build(**active_settings(settings)) for name, settings in trees_settings.items()}
+        for name, tree in trees.items():
+            tree.executor.pool.submit(prepare_tree, tree, options[name]).result()
+        return trees
+
+    def register_watchers(self, watchers: dict[str, float]) -> None:
+        reloader: TreeReloader = self.app.ctx.reloader
+        [self.app.add_task(reloader.watch(name, interval)) for name, interval in watchers.items() if interval]
 
     def register_bluprints(self, blueprints: list[str] | None) -> None:
         self.app.blueprint(base)
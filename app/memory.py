@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import resource
+
+from typing import Any
+
+from weetags.tree import Tree
+
+
+def process_rss() -> int:
+    """current resident set size of the process, in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # no procfs, fallback on the peak RSS (kB on linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def is_in_memory(tree: Tree) -> bool:
+    return tree.database == ":memory:" or tree.params.get("mode", None) == "memory"
+
+def database_bytes(tree: Tree) -> int:
+    """size of the sqlite database holding the tree. Must be called from the tree thread."""
+    page_count = tree.con.execute("PRAGMA page_count;").fetchone()["page_count"]
+    page_size = tree.con.execute("PRAGMA page_size;").fetchone()["page_size"]
+    return page_count * page_size
+
+def tree_objects(tree: Tree) -> list[dict[str, Any]]:
+    """
+    tables and indexes of a tree: the `{tree}__*` tables of weetags, and the `_{structure}__{tree}` tables of the app,
+    full text search shadow tables included. Must be called from the tree thread.
+    """
+    owned = re.compile(rf"^(?:{re.escape(tree.tree_name)}__.+|_[a-z0-9]+__{re.escape(tree.tree_name)}(?:_data|_idx|_docsize|_config|_content)?)$")
+    rows = tree.con.execute("SELECT type, name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index');").fetchall()
+    return [row for row in rows if owned.match(row["tbl_name"])]
+
+def table_memory(tree: Tree) -> dict[str, Any] | None:
+    """
+    bytes used by each table of a tree and by its indexes, from the pages of the database (dbstat).
+    None when sqlite is built without dbstat. Must be called from the tree thread.
+    """
+    objects = tree_objects(tree)
+    try:
+        rows = tree.con.execute(
+            "SELECT name, sum(pgsize) AS bytes, sum(payload) AS payload FROM dbstat "
+            "WHERE name IN (SELECT value FROM json_each(?)) GROUP BY name;",
+            [[o["name"] for o in objects]]
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return None
+
+    pages = {row["name"]:row for row in rows}
+    tables = {}
+    for o in sorted(objects, key=lambda o: o["type"] != "table"):
+        row = pages.get(o["name"], None)
+        size = row["bytes"] if row is not None else 0
+        if o["type"] == "table":
+            tables[o["name"]] = {"bytes": size, "payload": row["payload"] if row is not None else 0, "indexes": {}}
+        elif o["tbl_name"] in tables:
+            tables[o["tbl_name"]]["indexes"][o["name"]] = size
+    total = sum([t["bytes"] + sum(t["indexes"].values()) for t in tables.values()])
+    return {"bytes": total, "tables": tables}
+
+def tree_memory(tree: Tree) -> dict[str, Any]:
+    """Must be called from the tree thread."""
+    interning = getattr(tree, "interning", None)
+    return {
+        "uri": tree.uri,
+        "in_memory": is_in_memory(tree),
+        "database_bytes": database_bytes(tree),
+        "tree": table_memory(tree),
+        "interning": interning.stats() if interning is not None else None,
+    }
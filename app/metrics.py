@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from threading import Lock
+from collections import defaultdict
+
+from typing import Any
+
+
+class Metrics(object):
+    """
+    Process wide counters, exposed on `/weetags/metrics`.
+    Counters are incremented from the trees worker threads as well as from the event loop.
+    :attributes:
+        :counters: (dict[str, dict[str, int]]) counter name -> label -> value.
+    """
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.counters: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def incr(self, name: str, label: str = "total", value: int = 1) -> None:
+        with self._lock:
+            self.counters[name][label] += value
+
+    def get(self, name: str, label: str = "total") -> int:
+        with self._lock:
+            return self.counters.get(name, {}).get(label, 0)
+
+    @property
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {name:dict(labels) for name, labels in self.counters.items()}
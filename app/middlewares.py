@@ -8,6 +8,7 @@ from sanic.response import HTTPResponse, json
 
 from weetags.exceptions import WeetagsException
 from app.params_handler import ParamParser
+from app.warmup import WARMUP_TAG
 
 
 logger = logging.getLogger("endpointAccess")
@@ -17,8 +18,10 @@ async def log_entry(request: Request) -> None:
 
 async def log_exit(request: Request, response: HTTPResponse) -> None:
     perf = round(perf_counter() - request.ctx.t, 5)
+    # authorized warm-up replays are tagged, so that the next warm-ups leave them out.
+    tag = f" {WARMUP_TAG}" if getattr(request.ctx, "warmup", False) else ""
     if response.status == 200:
-        logger.info(f"[{request.host}] > {request.method} {request.url} [{str(response.status)}][{str(len(response.body))}b][{perf}s]")
+        logger.info(f"[{request.host}] > {request.method} {request.url} [{str(response.status)}][{str(len(response.body))}b][{perf}s]{tag}")
 
 async def extract_params(request: Request) -> None:
     nid = {k:unquote(v) for k,v in request.match_info.items() if k in ["nid", "nid0", "nid1"]} or {}
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from typing import Any
+
+from weetags.tree import Tree
+from app.search import SearchIndex
+from app.aggregate import Aggregator, SubtreeSizes
+from app.topology import Topology
+from app.topk import TopK
+from app.statements import StatementCache
+from app.delta import apply_delta_files
+from app.storage import storage_settings, apply_storage
+from app.interning import Interning
+
+Settings = dict[str, Any]
+
+# app level tree settings. They are not forwarded to the TreeBuilder.
+#   watch (float): polling interval, in seconds, of the tree data files. Modified files trigger a reload.
+#   deltas (list[str]): delta files applied, in order, after the tree is built or reloaded.
+#   search (list[str]): fields indexed for full text search.
+#   topology (bool): serve relation traversals from an in memory topology cache.
+#   topk (bool): maintain in memory top-k structures for `order_by` + `limit` queries. Default: False.
+#   storage (str | dict): sqlite storage profile (read-heavy, write-heavy, memory-constrained), or settings
+#       (mmap_size, cache_size, journal_mode, synchronous, temp_store, wal_autocheckpoint) overriding an optional `profile`.
+#   intern (list[str]): fields whose values are stored once in a shared dictionary table. In memory trees only.
+TREE_OPTIONS = ["watch", "deltas", "search", "topology", "topk", "storage", "intern"]
+
+
+def pop_tree_options(settings: Settings) -> Settings:
+    options = {option:settings.pop(option, None) for option in TREE_OPTIONS}
+    # fail at startup on invalid storage settings.
+    storage_settings(options["storage"])
+    if options["intern"]:
+        if settings.get("database", ":memory:") != ":memory:" and settings.get("mode", None) != "memory":
+            raise ValueError("interning is only available to in memory trees")
+        if options["search"]:
+            raise ValueError("interned trees cannot be indexed for full text search")
+        # a database of its own, compacted after interning without renumbering the rows of the other trees.
+        if settings.get("mode", None) != "memory":
+            settings.update({"database": f"{settings['tree_name']}-0", "mode": "memory", "cache": "shared"})
+    return options
+
+def prepare_tree(tree: Tree, options: Settings) -> None:
+    """set up the app level structures of a freshly built tree. Must run within the tree thread."""
+    storage = options.get("storage", None)
+    apply_storage(tree, storage_settings(storage))
+    tree.storage_profile = storage if isinstance(storage, str) else (storage or {}).get("profile", None)
+
+    # first, the structures below set their triggers on the storage table.
+    tree.interning = None
+    if options.get("intern", None):
+        tree.interning = Interning(tree, options["intern"])
+        tree.interning.build()
+
+    tree.search_index = None
+    if options.get("search", None):
+        tree.search_index = SearchIndex(tree, options["search"])
+        tree.search_index.build()
+
+    sizes = SubtreeSizes(tree)
+    sizes.build()
+    tree.aggregator = Aggregator(tree, sizes)
+
+    tree.topology = None
+    if options.get("topology", None):
+        tree.topology = Topology(tree)
+        tree.topology.build()
+
+    tree.statements = StatementCache(tree)
+    tree.topk = TopK(tree, enabled=bool(options.get("topk", None)))
+
+    # deltas last, so the derived structures follow them.
+    if options.get("deltas", None):
+        apply_delta_files(tree, options["deltas"])
+
+def release_tree(tree: Tree) -> None:
+    """drop the app level structures of a tree. Must run within the tree thread."""
+    if getattr(tree, "search_index", None) is not None:
+        tree.search_index.drop()
+    if getattr(tree, "aggregator", None) is not None:
+        tree.aggregator.sizes.drop()
+    if getattr(tree, "interning", None) is not None:
+        tree.interning.drop()
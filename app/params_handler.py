@@ -69,6 +69,22 @@ def boolOrNone(instance: ParamParser, attribute: Attribute, value: Any) -> None:
     if not isinstance(value, bool):
         raise ParsingError(attribute, value, "bool | None")
 
+def includeOrNone(instance: ParamParser, attribute: Attribute, value: Any) -> None:
+    if value is None:
+        return
+    if not isinstance(value, dict):
+        raise ParsingError(attribute, value, "list[Relations] | dict[Relations, dict] | None")
+    for relation, spec in value.items():
+        if relation not in _Relations.values():
+            raise ValueError(f"possible relations: {_Relations.values()}")
+        if not isinstance(spec, dict) or any([k not in ["fields", "limit"] for k in spec]):
+            raise ParsingError(attribute, value, "dict[Relations, {fields: list[str] | None, limit: int | None}]")
+        if not isinstance(spec.get("fields", None), (list, type(None))):
+            raise ParsingError(attribute, value, "fields: list[str] | None")
+        limit = spec.get("limit", None)
+        if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 0):
+            raise ParsingError(attribute, value, "limit: int | None")
+
 def dictOrNone(instance: ParamParser, attribute: Attribute, value: Any) -> None:
     if value is None:
         return
@@ -92,6 +108,19 @@ def list_converter(value: Any) -> list[Any]:
     else:
         raise TypeError(f"Only comma separated strings can be converted into list")
     
+def include_converter(value: Any) -> dict[str, dict[str, Any]] | None:
+    """relations to include, as a list of names or a mapping of relation -> {fields, limit}."""
+    if value is None:
+        return None
+
+    if isinstance(value, str):
+        value = list_converter(value)
+    if isinstance(value, list):
+        value = {relation:{} for relation in value}
+    if isinstance(value, dict):
+        return {relation:(spec or {}) for relation, spec in value.items()}
+    return value
+
 def int_converter(value: Any) -> int | None:
     if value is None:
         return None
@@ -100,6 +129,16 @@ def int_converter(value: Any) -> int | None:
         raise CoversionError(value, "int")
     return int(value)
 
+def int_list_converter(value: Any) -> list[int] | None:
+    if isinstance(value, int):
+        return [value]
+    value = list_converter(value)
+    if isinstance(value, int):
+        return [value]
+    if isinstance(value, list):
+        return [int_converter(v) for v in value]
+    return value
+
 def bool_converter(value: Any) -> bool | None:
     if value is None:
         return None
@@ -164,6 +203,42 @@ class ParamParser:
     # check_siblings (bool | None). when questioning 2 nodes relations. allow to check for siblings relations or only branches relations.
     check_siblings: bool | None = field(default=None, converter=bool_converter, validator=[boolOrNone])
 
+    # query (str | None). full text search query.
+    query: str | None = field(default=None, validator=[strOrNone])
+
+    # prefix (bool | None). full text search. complete the last word of the query, for autocompletion.
+    prefix: bool | None = field(default=None, converter=bool_converter, validator=[boolOrNone])
+
+    # max_depth (int | None). number of levels returned below the base node of a subtree.
+    max_depth: int | None = field(default=None, converter=int_converter, validator=[intOrNone])
+
+    # child_limits (list[int] | None). maximum number of children per node, for each level of a subtree. The last limit applies to deeper levels.
+    child_limits: list[int] | None = field(default=None, converter=int_list_converter, validator=[listOrNone])
+
+    # stream (bool | None). stream the response while it is read, for large outputs.
+    stream: bool | None = field(default=None, converter=bool_converter, validator=[boolOrNone])
+
+    # explain (bool | None). report how the query was served: execution path and sqlite query plan.
+    explain: bool | None = field(default=None, converter=bool_converter, validator=[boolOrNone])
+
+    # include (dict[Relations, dict] | None). relations returned along a node, each with its own `fields` and `limit`.
+    include: dict[str, dict[str, Any]] | None = field(default=None, converter=include_converter, validator=[includeOrNone])
+
+    # trees (list[str] | None). trees a multi trees lookup runs against.
+    trees: list[str] | None = field(default=None, converter=list_converter, validator=[listOrNone])
+
+    # lookup (str | None). query run by a multi trees lookup: node, nodes_where, relations or search.
+    lookup: str | None = field(default=None, validator=[strOrNone])
+
+    # timeouts (dict[str, int] | None). per tree timeouts in ms of a multi trees lookup.
+    timeouts: dict[str, int] | None = field(default=None, converter=simple_ast, validator=[dictOrNone])
+
+    # job (bool | None). run a bulk mutation as a background job, answered with the job id.
+    job: bool | None = field(default=None, converter=bool_converter, validator=[boolOrNone])
+
+    # chunk_size (int | None). number of nodes written per transaction by a background job.
+    chunk_size: int | None = field(default=None, converter=int_converter, validator=[intOrNone])
+
     # nid0 & nid1 (str | None). define 2 nodes to be compared.
     nid0: str | None = field(default=None, validator=[strOrNone])
     nid1: str | None = field(default=None, validator=[strOrNone])
@@ -178,6 +253,12 @@ class ParamParser:
     value: Any | None = field(default=None, converter=simple_ast)
     values: list[Any] | None = field(default=None, converter=list_converter, validator=[listOrNone])
 
+    # since (int | None). sequence number of the last change event received, to resume a change stream.
+    since: int | None = field(default=None, converter=int_converter, validator=[intOrNone])
+
+    # format (str | None). output format of the requested resource.
+    format: str | None = field(default=None, validator=[strOrNone])
+
     style: Style | None = field(default=None, validator=[styleOrNone])
     extra_space: bool | None = field(default=None, converter=bool_converter, validator=[boolOrNone])
 
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import io
+import sys
+import time
+import random
+import pstats
+import marshal
+import cProfile
+from threading import Lock, current_thread
+from collections import deque
+from contextvars import ContextVar
+from contextlib import contextmanager, nullcontext
+from sanic.request import Request
+from sanic.response.types import json_dumps
+
+from typing import Any, Iterator, Callable
+
+from app.exceptions import ProfilerBusy
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PER_THREAD_PROFILERS = sys.version_info < (3, 12)
+
+_current: ContextVar[RequestProfile | None] = ContextVar("profile", default=None)
+
+
+class RequestProfile(object):
+    """
+    cProfile captures of one request: each of its queries, on its tree thread (`Tree` methods, sqlite calls),
+    and its handler on the event loop.
+    Before python 3.12 profilers are per thread: the whole handler is captured on the loop, along with the
+    queries. From 3.12 a single profiler runs at a time, whatever its thread: queries of the same request running
+    on several tree threads (`records/multi`) are captured one after the other, and only the response
+    serialization is captured on the loop, as it can't hold the profiler while its queries run.
+    Stats of all the captures are merged.
+    """
+    def __init__(self, pid: int, request: Request, sampled: bool) -> None:
+        self.id = pid
+        self.method = request.method
+        self.url = request.url
+        self.route = request.route.name if request.route else None
+        self.blueprint = request.route.name.split(".")[1] if request.route else None
+        tree_name = request.match_info.get("tree_name", None)
+        self.trees = [tree_name] if tree_name is not None else list(getattr(getattr(request.ctx, "params", None), "trees", None) or [])
+        self.sampled = sampled
+        self.created = time.time()
+        self.duration: float | None = None
+        self.status: int | None = None
+        self.threads: list[str] = []
+        self._profilers: list[cProfile.Profile] = []
+        self._lock = Lock()
+        self._capturing = Lock()
+
+    @contextmanager
+    def capture(self, wait: bool = True) -> Iterator[None]:
+        """
+        profile the current thread. From python 3.12, captures of the request wait for each other, or run
+        unprofiled meanwhile without `wait`. The call also runs unprofiled if another profiling tool took over.
+        """
+        if PER_THREAD_PROFILERS:
+            with self._profile():
+                yield
+            return
+        if not self._capturing.acquire(blocking=wait):
+            yield
+            return
+        try:
+            with self._profile():
+                yield
+        finally:
+            self._capturing.release()
+
+    @contextmanager
+    def _profile(self) -> Iterator[None]:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profilers.append(profiler)
+                thread = current_thread().name
+                if thread not in self.threads:
+                    self.threads.append(thread)
+
+    def stats(self) -> pstats.Stats:
+        with self._lock:
+            return pstats.Stats(*self._profilers)
+
+    def dump(self) -> bytes:
+        """stats in the `pstats` file format, as written by `cProfile -o`."""
+        return marshal.dumps(self.stats().stats)
+
+    def summary(self, limit: int | None = None) -> str:
+        stream = io.StringIO()
+        stats = self.stats()
+        stats.stream = stream
+        stats.sort_stats("cumulative").print_stats(limit or Profiles.SUMMARY_LIMIT)
+        return stream.getvalue()
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "url": self.url,
+            "route": self.route,
+            "blueprint": self.blueprint,
+            "trees": self.trees,
+            "sampled": self.sampled,
+            "created": self.created,
+            "duration": self.duration,
+            "status": self.status,
+            "threads": self.threads,
+        }
+
+
+class Profiles(object):
+    """
+    Ring buffer of the last request profiles, exposed on `utils/profiles`.
+    Authorized requests are profiled when they carry the `X-Profile: 1` header, or at random at `sample_rate`.
+    One request is profiled at a time, per process. Requests asking for a profile meanwhile, or while another
+    profiling tool is active, are refused (409). Sampled ones simply run unprofiled.
+    """
+    SUMMARY_LIMIT = 40
+
+    def __init__(self, size: int = 32, sample_rate: float = 0.0) -> None:
+        self.sample_rate = sample_rate
+        self.profiles: deque[RequestProfile] = deque(maxlen=size)
+        self.active: RequestProfile | None = None
+        self._seq = 0
+        self._lock = Lock()
+
+    def start(self, request: Request) -> RequestProfile | None:
+        """open the profile of a request, if it opted in or is sampled."""
+        requested = request.headers.get(PROFILE_HEADER, "").lower() in ["1", "true"]
+        sampled = not requested and self.sample_rate > 0 and random.random() < self.sample_rate
+        if not (requested or sampled):
+            return None
+        with self._lock:
+            if self.active is not None or profiler_active():
+                if requested:
+                    raise ProfilerBusy()
+                return None
+            self._seq += 1
+            self.active = RequestProfile(self._seq, request, sampled)
+            return self.active
+
+    def finish(self, profile: RequestProfile, request: Request, status: int | None) -> None:
+        profile.duration = round(time.perf_counter() - request.ctx.t, 5)
+        profile.status = status
+        with self._lock:
+            self.profiles.append(profile)
+            if self.active is profile:
+                self.active = None
+
+    def get(self, pid: int) -> RequestProfile | None:
+        with self._lock:
+            return next((p for p in self.profiles if p.id == pid), None)
+
+    def describe(self) -> list[dict[str, Any]]:
+        """profiles, latest first."""
+        with self._lock:
+            return [p.describe() for p in reversed(self.profiles)]
+
+
+def profiler_active() -> bool:
+    """whether a profiling tool is already set: process wide on python >= 3.12, on the current thread before."""
+    if sys.version_info >= (3, 12):
+        return sys.monitoring.get_tool(sys.monitoring.PROFILER_ID) is not None
+    return sys.getprofile() is not None
+
+
+def dumps(body: Any, **kwargs: Any) -> str:
+    """
+    responses json encoder. From python 3.12, captures the serialization of a profiled response, unless one of its
+    queries still holds the profiler (timed out). Before, the handler capture already covers it.
+    """
+    profile = _current.get()
+    if profile is None or PER_THREAD_PROFILERS:
+        return encode(body, **kwargs)
+    with profile.capture(wait=False):
+        return encode(body, **kwargs)
+
+
+def encode(body: Any, **kwargs: Any) -> str:
+    """sanic default encoder, behind a python frame: the profiler skips the C one."""
+    return json_dumps(body, **kwargs)
+
+
+async def profiled(f: Callable, request: Request, *args: Any, **kwargs: Any) -> Any:
+    """run a route handler, profiled when the request opted in or is sampled. Its tree queries are captured by `query`."""
+    profiles: Profiles | None = getattr(request.app.ctx, "profiles", None)
+    profile = profiles.start(request) if profiles is not None else None
+    request.ctx.profile = profile
+    if profile is None:
+        return await f(request, *args, **kwargs)
+
+    status = None
+    current = _current.set(profile)
+    try:
+        with profile.capture() if PER_THREAD_PROFILERS else nullcontext():
+            response = await f(request, *args, **kwargs)
+        status = getattr(response, "status", None)
+    except Exception as e:
+        status = getattr(e, "status", 500)
+        raise
+    finally:
+        _current.reset(current)
+        profiles.finish(profile, request, status)
+
+    if response is not None:
+        response.headers[PROFILE_ID_HEADER] = str(profile.id)
+    return response
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+from typing import Literal
+
+Relations = Literal["parent", "children", "siblings", "ancestors", "descendants"]
+
+# `scope(id)` ctes of the nodes related to a set of seed nodes. `{seed}` is an sql expression selecting the seed ids.
+SCOPES = {
+    "parent": "WITH scope(id) AS (SELECT parent FROM {nodes_table} WHERE id IN ({seed}))",
+    "children": "WITH scope(id) AS (SELECT j.value FROM {nodes_table} n, json_each(n.children) j WHERE n.id IN ({seed}))",
+    "siblings": """\
+WITH scope(id) AS (
+SELECT j.value FROM {nodes_table} n JOIN {nodes_table} p ON p.id = n.parent, json_each(p.children) j WHERE n.id IN ({seed}) AND j.value != n.id
+)""",
+    "ancestors": """\
+WITH RECURSIVE scope(id) AS (
+SELECT parent FROM {nodes_table} WHERE id IN ({seed}) AND parent IS NOT NULL
+UNION
+SELECT n.parent FROM scope s JOIN {nodes_table} n ON n.id = s.id WHERE n.parent IS NOT NULL
+)""",
+    "descendants": """\
+WITH RECURSIVE scope(id) AS (
+SELECT j.value FROM {nodes_table} n, json_each(n.children) j WHERE n.id IN ({seed})
+UNION
+SELECT j.value FROM scope s JOIN {nodes_table} n ON n.id = s.id, json_each(n.children) j
+)""",
+}
+
+
+def relation_scope(nodes_table: str, relation: Relations, seed: str = "?") -> str:
+    """`scope(id)` cte of the nodes related to the seed nodes. By default, the seed is a single bound node id."""
+    return SCOPES[relation].format(nodes_table=nodes_table, seed=seed)
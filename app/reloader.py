@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import os
+import asyncio
+from pathlib import Path
+from time import perf_counter
+from sanic.log import logger
+from collections import defaultdict
+
+from typing import Any
+
+from weetags.tree import Tree
+from app.executor import TreeExecutor
+from app.changes import ChangeFeeds
+from app.options import prepare_tree
+from app.exceptions import ReloadInProgress
+from app.memory import process_rss, tree_memory, is_in_memory
+
+Settings = dict[str, Any]
+
+
+class TreeReloader(object):
+    """
+    Rebuild trees in the background from their TreeBuilder settings, then swap them into `app.ctx.trees`.
+    Each rebuild (generation) is written into its own database, so the serving tree is never touched while building:
+        - in memory trees are built into a private shared memory database.
+        - on disk trees are built into a sibling file: `path/to/db.<generation>.db`. The active generation is written
+        next to the configured database, `path/to/db.db.generation`, so that a restart opens it instead of the configured
+        one. Retired generation files are deleted, the configured database is kept.
+    Queries already submitted to the old tree finish on it before it is closed, streams and jobs holding it (`TreeExecutor.using`) are waited for.
+    :attributes:
+        :trees: (dict[str, Tree]) served trees. Same mapping as `app.ctx.trees`.
+        :settings: (dict[str, Settings]) TreeBuilder settings of each tree.
+        :options: (dict[str, Settings]) app level options of each tree (deltas, search...), re-applied onto each rebuilt tree.
+        :changes: (ChangeFeeds | None) change feeds notified of every swap.
+        :reports: (dict[str, dict[str, Any]]) last reload report of each tree.
+    """
+    def __init__(
+        self,
+        trees: dict[str, Tree],
+        settings: dict[str, Settings],
+        options: dict[str, Settings] | None = None,
+        changes: ChangeFeeds | None = None
+    ) -> None:
+        self.trees = trees
+        self.settings = settings
+        self.options = options or {}
+        self.changes = changes
+        self.reports: dict[str, dict[str, Any]] = {}
+        self.generations: dict[str, int] = defaultdict(int, {name:stored_generation(s) for name, s in settings.items()})
+        self._reloading: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self, tree_name: str) -> int:
+        """reload a tree in the background. Return the generation being built."""
+        generation = self._reserve(tree_name)
+        task = asyncio.create_task(self._reload(tree_name, generation))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return generation
+
+    async def reload(self, tree_name: str) -> dict[str, Any]:
+        generation = self._reserve(tree_name)
+        return await self._reload(tree_name, generation)
+
+    async def watch(self, tree_name: str, interval: float) -> None:
+        """poll the tree data files and reload the tree whenever one of them is modified."""
+        paths = [Path(p) for p in self.settings[tree_name].get("data", None) or [] if isinstance(p, (str, Path))]
+        if not paths:
+            logger.warning(f"[{tree_name}] nothing to watch: tree data is not made of files")
+            return
+
+        mtimes = self._mtimes(paths)
+        while True:
+            await asyncio.sleep(interval)
+            current = self._mtimes(paths)
+            if current == mtimes or tree_name in self._reloading:
+                continue
+            mtimes = current
+            logger.info(f"[{tree_name}] data files modified, reloading")
+            await self.reload(tree_name)
+
+    def generation_settings(self, tree_name: str, generation: int) -> Settings:
+        settings = dict(self.settings[tree_name])
+        settings.update({"replace": True})
+        if on_disk(settings):
+            settings.update({"database": generation_file(settings, generation)})
+        else:
+            settings.update({"database": f"{tree_name}-{generation}", "mode": "memory", "cache": "shared"})
+        return settings
+
+    async def _reload(self, tree_name: str, generation: int) -> dict[str, Any]:
+        t = perf_counter()
+        report = {"state": "building", "generation": generation}
+        self.reports[tree_name] = report
+        executor, swapped = TreeExecutor(tree_name), False
+        try:
+            rss_before = process_rss()
+            settings = self.generation_settings(tree_name, generation)
+            tree = await executor.build_async(**settings)
+            await executor.submit(prepare_tree, tree, self.options.get(tree_name, {}))
+            old = self.trees[tree_name]
+
+            report.update({
+                "rss_before": rss_before,
+                "rss_swap": process_rss(),
+                "old": await old.executor.submit(tree_memory, old),
+                "new": await executor.submit(tree_memory, tree),
+            })
+            self.trees[tree_name] = tree
+            swapped = True
+            self.generations[tree_name] = generation
+            if self.changes is not None:
+                self.changes.publish(tree_name, "reload", {"generation": generation})
+            logger.info(
+                f"[{tree_name}] generation {generation} swapped in. "
+                f"old: {report['old']['database_bytes']}b, new: {report['new']['database_bytes']}b, rss: {report['rss_swap']}b"
+            )
+
+            if on_disk(self.settings[tree_name]):
+                store_generation(self.settings[tree_name], generation)
+            await old.executor.retire(old, drop=is_in_memory(old))
+            if on_disk(self.settings[tree_name]) and old.database != self.settings[tree_name]["database"]:
+                remove_database(old.database)
+            report.update({"state": "swapped", "rss_after": process_rss(), "duration": round(perf_counter() - t, 5)})
+
+        except Exception as e:
+            if not swapped:
+                executor.pool.shutdown(wait=False)
+            report.update({"state": "failed", "reasons": str(e), "duration": round(perf_counter() - t, 5)})
+            logger.error(f"[{tree_name}] generation {generation} reload failed: {str(e)}")
+        finally:
+            self._reloading.discard(tree_name)
+        return report
+
+    def _reserve(self, tree_name: str) -> int:
+        if tree_name in self._reloading:
+            raise ReloadInProgress(tree_name)
+        self._reloading.add(tree_name)
+        return self.generations[tree_name] + 1
+
+    @staticmethod
+    def _mtimes(paths: list[Path]) -> list[float | None]:
+        return [os.stat(p).st_mtime if p.exists() else None for p in paths]
+
+
+def on_disk(settings: Settings) -> bool:
+    return settings.get("database", ":memory:") != ":memory:" and settings.get("mode", None) != "memory"
+
+def generation_file(settings: Settings, generation: int) -> str:
+    """database file of a generation of an on disk tree. Generation 0 is the configured database."""
+    if generation == 0:
+        return settings["database"]
+    path = Path(settings["database"])
+    return str(path.with_name(f"{path.stem}.{generation}{path.suffix}"))
+
+def stored_generation(settings: Settings) -> int:
+    """active generation of an on disk tree, 0 when it was never reloaded or its generation file is gone."""
+    if not on_disk(settings):
+        return 0
+    pointer = Path(f"{settings['database']}.generation")
+    if not pointer.exists():
+        return 0
+    generation = int(pointer.read_text())
+    return generation if Path(generation_file(settings, generation)).exists() else 0
+
+def store_generation(settings: Settings, generation: int) -> None:
+    pointer = Path(f"{settings['database']}.generation")
+    tmp = pointer.with_name(f"{pointer.name}.tmp")
+    tmp.write_text(str(generation))
+    os.replace(tmp, pointer)
+
+def active_settings(settings: Settings) -> Settings:
+    """TreeBuilder settings opening the active generation of a tree. Used at startup."""
+    generation = stored_generation(settings)
+    if generation == 0:
+        return settings
+    return {**settings, "database": generation_file(settings, generation)}
+
+def remove_database(database: str) -> None:
+    """delete a retired database file, along with its journal files."""
+    for suffix in ["", "-wal", "-shm", "-journal"]:
+        Path(f"{database}{suffix}").unlink(missing_ok=True)
@@ -1,20 +1,43 @@
 from __future__ import annotations
 
+import asyncio
+
 from sanic import Blueprint
 from sanic.request import Request
-from sanic.response import json, text, empty, HTTPResponse, html, JSONResponse
+from sanic.response import json, text, empty, raw, HTTPResponse, html, JSONResponse
 from sanic_ext import openapi
 
 from typing import Any, Literal, get_args
 
 from weetags.tree import Tree
+from weetags.loaders import JlLoader
+from app.executor import query, query_within, tree_timeout
+from app.reloader import TreeReloader
+from app.delta import DeltaApplier
+from app.changes import ChangeFeed
+from app.search import SearchIndex
+from app.aggregate import Aggregator
+from app.subtree import Subtree, SubtreeEncoder
+from app.topology import Topology
+from app.topk import TopK
+from app.statements import StatementCache
+from app.columnar import Rows, response_format
+from app.expand import NodeExpander
+from app.profiling import Profiles, RequestProfile
+from app.storage import active_storage
+from app.memory import tree_memory
+from app.warmup import WarmUp
+from app.jobs import Job, JobOp
+from app.exceptions import SearchNotEnabled, UnknownAggregate, UnknownLookup, MissingParameter, UnknownProfile, UnknownJob
 from app.middlewares import extract_params
-from app.authentication import Authenticator, protected
+from app.authentication import Authenticator, protected, permitted
+from app.singleflight import coalesced
 from weetags.exceptions import (
     MissingLogin,
     TreeDoesNotExist,
     UnknownRelation,
-    OutputError
+    OutputError,
+    AccessDenied
 )
 
 
@@ -22,6 +45,11 @@ from weetags.exceptions import (
 Node = dict[str, Any]
 Nodes = list[dict[str, Any]]
 Relations = Literal["parent", "children", "siblings", "ancestors", "descendants"]
+Aggregates = Literal["count", "min", "max", "group_by", "subtree_sizes"]
+Lookups = Literal["node", "nodes_where", "relations", "search"]
+
+# seconds between two keepalive comments on idle change streams.
+CHANGES_KEEPALIVE = 15
 
 base = Blueprint("base")
 login = Blueprint("login", url_prefix="/")
@@ -29,6 +57,7 @@ records = Blueprint("records", "/records")
 shower = Blueprint("shower", "/show")
 utils = Blueprint("utils", "/utils")
 writer = Blueprint("writer", "/records")
+admin = Blueprint("admin", "/admin")
 
 records.on_request(extract_params, priority=100)
 shower.on_request(extract_params, priority=100)
@@ -38,6 +67,37 @@ writer.on_request(extract_params, priority=100)
 from typing import Optional, Callable
 from functools import wraps
 
+def relations_source(tree: Tree) -> Tree | Topology:
+    """relation traversals are served by the tree topology cache, when enabled."""
+    topology = getattr(tree, "topology", None)
+    return tree if topology is None else topology
+
+def statements_source(tree: Tree) -> Tree | StatementCache:
+    """condition queries are served by the tree compiled statements, when set."""
+    statements = getattr(tree, "statements", None)
+    return tree if statements is None else statements
+
+def lookup_callback(tree: Tree, tree_name: str, lookup: Lookups, relation: Relations | None) -> Callable:
+    """read method of a tree serving a multi trees lookup."""
+    if lookup == "node":
+        return tree.node
+    if lookup == "nodes_where":
+        return (getattr(tree, "topk", None) or tree).nodes_where
+    if lookup == "search":
+        if getattr(tree, "search_index", None) is None:
+            raise SearchNotEnabled(tree_name)
+        return tree.search_index.search
+    if relation is None:
+        raise MissingParameter("relation")
+    source = relations_source(tree)
+    return source.parent_node if relation == "parent" else getattr(source, f"{relation}_nodes")
+
+def submit_job(request: Request, tree: Tree, tree_name: str, op: JobOp) -> JSONResponse:
+    params = request.ctx.params
+    job = request.app.ctx.jobs.submit(tree, tree_name, op, params.conditions, params.set_values, params.chunk_size)
+    data = {"job": job.id, "url": request.app.url_for("writer.job", job_id=job.id)}
+    return json({"status": 202, "reasons": "Accepted", "data": data}, status=202)
+
 class Auth:
     username: str
     password: str
@@ -66,6 +126,8 @@ class NodesParams:
     order_by: Optional[list[str]] = None,
     axis: Optional[int] = 1,
     limit: Optional[int] = None
+    explain: Optional[bool] = None
+    format: Optional[str] = None
 
 class RelationNodesParams:
     relation: Relations
@@ -76,6 +138,36 @@ class RelationNodesParams:
     limit: Optional[int] = None
     include_base: Optional[bool] = False
 
+class SearchParams:
+    query: str
+    prefix: Optional[bool] = False
+    fields: Optional[list[str]] = None
+    limit: Optional[int] = None
+    relation: Optional[str] = None
+    nid: Optional[str] = None
+
+class MultiParams:
+    trees: list[str]
+    lookup: str
+    nid: Optional[str] = None
+    relation: Optional[str] = None
+    query: Optional[str] = None
+    prefix: Optional[bool] = False
+    conditions: Optional[list[list[list[str, str, Any] | str] | str]] = None
+    fields: Optional[list[str]] = None
+    order_by: Optional[list[str]] = None
+    axis: Optional[int] = 1
+    limit: Optional[int] = None
+    timeouts: Optional[dict[str, int]] = None
+
+class AggregateParams:
+    conditions: Optional[list[list[list[str, str, Any] | str] | str]] = None
+    relation: Optional[str] = None
+    nid: Optional[str] = None
+    include_base: Optional[bool] = False
+    field_name: Optional[str] = None
+    limit: Optional[int] = None
+
 class AddNode:
     id: str
     parent: str
@@ -83,6 +175,8 @@ class AddNode:
 
 class DeleteNodes:
     conditions: Optional[list[list[list[str, str, Any] | str] | str]] = None
+    job: Optional[bool] = False
+    chunk_size: Optional[int] = None
    
 class UpdateNode:
     set_values: list[list[str, Any]]
@@ -90,6 +184,12 @@ class UpdateNode:
 class UpdateNodes:
     conditions: Optional[list[list[list[str, str, Any] | str] | str]] = None
     set_values: list[list[str, Any]]
+    job: Optional[bool] = False
+    chunk_size: Optional[int] = None
+
+class Delta:
+    path: Optional[str] = None
+    records: Optional[list[dict[str, Any]]] = None
 
 class AppendNode:
     field_name: str
@@ -122,14 +222,33 @@ async def favicon(request: Request):
 @base.route("/weetags/infos", methods=["GET"])
 async def infos(request: Request):
     trees = request.app.ctx.trees
-    return json({"status": 200, "reasons": "OK", "data": {name:tree.info for name,tree in trees.items()}})
+    data = {name:await tree.executor.submit(lambda tree=tree: {**tree.info, "storage": active_storage(tree), "memory": tree_memory(tree)}) for name,tree in trees.items()}
+    return json({"status": 200, "reasons": "OK", "data": data})
 
 @base.route("/weetags/infos/<tree_name:str>", methods=["GET"])
 async def tree_infos(request: Request, tree_name: str):
     tree: Tree = request.app.ctx.trees.get(tree_name, None)
     if tree is None:
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
-    return json({"status": 200, "reasons": "OK", "data": tree.info})
+    with tree.executor.using():
+        info = await tree.executor.submit(lambda: {**tree.info, "storage": active_storage(tree), "memory": tree_memory(tree)})
+        if getattr(tree, "topology", None) is not None:
+            info["topology"] = await tree.executor.submit(tree.topology.memory)
+    return json({"status": 200, "reasons": "OK", "data": info})
+
+@base.route("/weetags/ready", methods=["GET"])
+@openapi.description("Readiness probe: 503 until the startup warm-up is over, 200 afterwards.")
+async def ready(request: Request) -> JSONResponse:
+    warmup: WarmUp = request.app.ctx.warmup
+    status = 200 if warmup.ready else 503
+    return json({"status": status, "reasons": "OK" if warmup.ready else "warming up", "data": warmup.stats}, status=status)
+
+@base.route("/weetags/metrics", methods=["GET"])
+async def metrics(request: Request):
+    data = request.app.ctx.metrics.snapshot
+    trees = request.app.ctx.trees.items()
+    data["statement_cache"] = {name:tree.statements.stats() for name, tree in trees if getattr(tree, "statements", None) is not None}
+    return json({"status": 200, "reasons": "OK", "data": data})
 
 @login.get("login")
 @openapi.description("Login Template. Following auth set the JwtToken as a cookie.")
@@ -192,25 +311,42 @@ async def setJwtToken(request: Request):
 @openapi.description("Retrieve a Node from a tree.")
 @openapi.parameter("nid", str, location="path", description="Node id")
 @openapi.parameter("fields", Optional[list[str]], location="query", description="list of fields to be returned")
+@openapi.parameter("include", Optional[str], location="query", description="relations returned along the node, as `{'node', 'relations'}`: names (`parent,children`), or {relation: {fields, limit}}")
 @protected
+@coalesced
 async def node(request: Request, tree_name: str, nid: str) -> JSONResponse:
     tree: Tree = request.app.ctx.trees.get(tree_name, None)
     if tree is None:
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
+
+    if request.ctx.params.include:
+        expander = NodeExpander(tree)
+        params = request.ctx.params.get_kwargs(expander.node)
+        return json({"status": "200", "reasons": "OK", "data": await query(request, expander.node, **params)}, status=200)
     params = request.ctx.params.get_kwargs(tree.node)
-    return json({"status": "200", "reasons": "OK", "data": tree.node(**params)}, status=200)
+    return json({"status": "200", "reasons": "OK", "data": await query(request, tree.node, **params)}, status=200)
 
 @records.route("nodes/<tree_name:str>/where", methods=["POST"])
 @openapi.description("Retrieve nodes complying with a set of conditions from a tree.")
 @openapi.body({"application/json": NodesParams})
 @protected
+@coalesced
 async def nodes_where(request: Request, tree_name: str) -> JSONResponse:
     tree: Tree = request.app.ctx.trees.get(tree_name, None)
     if tree is None:
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
 
     params = request.ctx.params.get_kwargs(tree.nodes_where)
-    return json({"status": "200", "reasons": "OK", "data": tree.nodes_where(**params)}, status=200)
+    format = response_format(request.ctx.params.format)
+    if format is not None:
+        rows = await query(request, tree.statements.rows, **params)
+        return json({"status": "200", "reasons": "OK", **rows.encode(format)}, status=200)
+
+    source = getattr(tree, "topk", None) or tree
+    if request.ctx.params.explain and isinstance(source, TopK):
+        result = await query(request, source.explained, **params)
+        return json({"status": "200", "reasons": "OK", "data": result["nodes"], "explain": result["explain"]}, status=200)
+    return json({"status": "200", "reasons": "OK", "data": await query(request, source.nodes_where, **params)}, status=200)
 
 
 @records.route("node/<tree_name:str>/<relation:str>/<nid:str>", methods=["GET"])
@@ -222,6 +358,7 @@ async def nodes_where(request: Request, tree_name: str) -> JSONResponse:
 @openapi.parameter("axis", schema= {"type": int, "enum": [0, 1]}, location="query", description="ordering axis. default: 1 (ASC).")
 @openapi.parameter("limit", Optional[int], location="query", description="Number of returned records")
 @protected
+@coalesced
 async def node_relations(request: Request, tree_name: str, relation: Relations, nid: str) -> JSONResponse:
     tree: Tree = request.app.ctx.trees.get(tree_name, None)
     if tree is None:
@@ -233,9 +370,9 @@ async def node_relations(request: Request, tree_name: str, relation: Relations,
     if relation != "parent":
         raise OutputError(relation, "Node")
 
-    callback = tree.parent_node
+    callback = relations_source(tree).parent_node
     params = request.ctx.params.get_kwargs(callback)
-    return json({"status": "200", "reasons": "OK", "data": callback(**params)}, status=200)
+    return json({"status": "200", "reasons": "OK", "data": await query(request, callback, **params)}, status=200)
 
 
 @records.route("nodes/<tree_name:str>/<relation:str>/<nid:str>", methods=["GET"])
@@ -246,7 +383,9 @@ async def node_relations(request: Request, tree_name: str, relation: Relations,
 @openapi.parameter("order_by", Optional[list[str]], location="query", description="Ordering priorities")
 @openapi.parameter("axis", schema= {"type": int, "enum": [0, 1]}, location="query", description="ordering axis. default: 1 (ASC).")
 @openapi.parameter("limit", Optional[int], location="query", description="Number of returned records")
+@openapi.parameter("format", schema= {"type":"str", "enum":["rows", "columnar"]}, location="query", description="compact response: a `fields` header, then values per node (rows) or per field (columnar).")
 @protected
+@coalesced
 async def nodes_relations(request: Request, tree_name: str, relation: Relations, nid: str) -> JSONResponse:
     tree: Tree = request.app.ctx.trees.get(tree_name, None)
     if tree is None:
@@ -258,16 +397,21 @@ async def nodes_relations(request: Request, tree_name: str, relation: Relations,
     if relation == "parent":
         raise OutputError(relation, "list[Node]")
 
+    source = relations_source(tree)
     callback = {
-        "parent": tree.parent_node,
-        "children": tree.children_nodes,
-        "siblings": tree.siblings_nodes,
-        "ancestors": tree.ancestors_nodes,
-        "descendants": tree.descendants_nodes
+        "parent": source.parent_node,
+        "children": source.children_nodes,
+        "siblings": source.siblings_nodes,
+        "ancestors": source.ancestors_nodes,
+        "descendants": source.descendants_nodes
     }[relation]
 
     params = request.ctx.params.get_kwargs(callback)
-    return json({"status": "200", "reasons": "OK", "data": callback(**params)}, status=200)
+    format = response_format(request.ctx.params.format)
+    if format is not None:
+        rows = Rows.from_nodes(await query(request, callback, **params))
+        return json({"status": "200", "reasons": "OK", **rows.encode(format)}, status=200)
+    return json({"status": "200", "reasons": "OK", "data": await query(request, callback, **params)}, status=200)
 
 
 @records.route("nodes/<tree_name:str>/<relation:str>/where", methods=["POST"])
@@ -275,6 +419,7 @@ async def nodes_relations(request: Request, tree_name: str, relation: Relations,
 @openapi.parameter("relation", schema= {"type":"str", "enum":["parent","siblings", "children", "ancestors", "descendants"]}, location="path", description="requested Relation")
 @openapi.body({"application/json": NodesParams})
 @protected
+@coalesced
 async def nodes_relation_where(request: Request, tree_name: str, relation: str) -> JSONResponse:
     tree: Tree = request.app.ctx.trees.get(tree_name, None)
     if tree is None:
@@ -283,29 +428,223 @@ async def nodes_relation_where(request: Request, tree_name: str, relation: str)
     if relation not in get_args(Relations):
         raise UnknownRelation(relation, list(get_args(Relations)))
 
-    params = request.ctx.params.get_kwargs(tree.nodes_relation_where)
+    source = statements_source(tree)
+    params = {**request.ctx.params.get_kwargs(source.nodes_relation_where), "relation": relation}
+    format = response_format(request.ctx.params.format)
+    if format is not None:
+        rows = Rows.from_nodes(await query(request, source.nodes_relation_where, **params))
+        return json({"status": "200", "reasons": "OK", **rows.encode(format)}, status=200)
     return json(
         {
             "status": "200",
             "reasons": "OK",
-            "data": tree.nodes_relation_where(**params)
+            "data": await query(request, source.nodes_relation_where, **params)
         },
         status=200
     )
 
 
+@records.route("subtree/<tree_name:str>/<nid:str>", methods=["GET"])
+@openapi.description("Subtree of a node as nested nodes: each node holds its child nodes under `children`. Built from a single depth first scan, streamed as it is walked with `stream`.")
+@openapi.parameter("nid", str, location="path", description="Node id")
+@openapi.parameter("fields", Optional[list[str]], location="query", description="list of fields to be returned")
+@openapi.parameter("max_depth", Optional[int], location="query", description="number of levels below the node. default: all")
+@openapi.parameter("child_limits", Optional[list[int]], location="query", description="maximum number of children per level. The last limit applies to deeper levels")
+@openapi.parameter("stream", Optional[bool], location="query", description="stream the nodes while they are read. For deep trees")
+@protected
+@coalesced
+async def subtree(request: Request, tree_name: str, nid: str) -> JSONResponse | None:
+    tree: Tree = request.app.ctx.trees.get(tree_name, None)
+    if tree is None:
+        raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
+
+    materializer = Subtree(tree)
+    params = request.ctx.params.get_kwargs(materializer.nested)
+    if not request.ctx.params.stream:
+        return json({"status": "200", "reasons": "OK", "data": await query(request, materializer.nested, **params)}, status=200)
+
+    # the tree is held until the last batch, a reload retires it afterwards.
+    # the deadline covers the scan up to its first rows.
+    with tree.executor.using():
+        cursor = await query(request, materializer.scan, **params)
+        try:
+            encoder = SubtreeEncoder()
+            response = await request.respond(content_type="application/json")
+            await response.send('{"status": "200", "reasons": "OK", "data": ')
+            while rows := await tree.executor.submit(cursor.fetchmany, Subtree.BATCH_SIZE):
+                await response.send(encoder.feed(rows))
+            await response.send(encoder.close() + "}")
+        finally:
+            tree.executor.pool.submit(cursor.close)
+    await response.eof()
+
+
+@records.route("search/<tree_name:str>", methods=["GET", "POST"])
+@openapi.description("Ranked full text search over the tree searchable fields. `prefix` completes the last word, for autocompletion.")
+@openapi.parameter("query", str, location="query", description="FTS5 query, or plain words with `prefix`")
+@openapi.parameter("prefix", Optional[bool], location="query", description="complete the last word of the query")
+@openapi.parameter("fields", Optional[list[str]], location="query", description="list of fields to be returned")
+@openapi.parameter("limit", Optional[int], location="query", description="Number of returned records")
+@openapi.parameter("relation", schema= {"type":"str", "enum":["parent","siblings", "children", "ancestors", "descendants"]}, location="query", description="search only within the nodes related to `nid`")
+@openapi.parameter("nid", Optional[str], location="query", description="base node of the relation")
+@openapi.body({"application/json": SearchParams})
+@protected
+@coalesced
+async def search(request: Request, tree_name: str) -> JSONResponse:
+    tree: Tree = request.app.ctx.trees.get(tree_name, None)
+    if tree is None:
+        raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
+
+    index: SearchIndex | None = getattr(tree, "search_index", None)
+    if index is None:
+        raise SearchNotEnabled(tree_name)
+
+    params = request.ctx.params.get_kwargs(index.search)
+    return json({"status": "200", "reasons": "OK", "data": await query(request, index.search, **params)}, status=200)
+
+
+@records.route("multi", methods=["POST"])
+@openapi.description(
+    "Run one lookup against several trees concurrently, each within its own tree thread. "
+    "Results are keyed by tree name. Failing trees are reported under `errors` (207) without failing the others. "
+    "`timeouts` sets per tree timeouts in ms, the other trees use the request timeout."
+)
+@openapi.body({"application/json": MultiParams})
+@protected
+async def multi(request: Request) -> JSONResponse:
+    params = request.ctx.params
+    if not params.trees:
+        raise MissingParameter("trees")
+    if params.lookup is None:
+        raise MissingParameter("lookup")
+    if params.lookup not in get_args(Lookups):
+        raise UnknownLookup(params.lookup, list(get_args(Lookups)))
+
+    async def lookup(tree_name: str) -> Any:
+        tree: Tree = request.app.ctx.trees.get(tree_name, None)
+        if tree is None:
+            raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
+        callback = lookup_callback(tree, tree_name, params.lookup, params.relation)
+        timeout = tree_timeout(request, tree_name, params.timeouts)
+        return await query_within(request, timeout, callback, **params.get_kwargs(callback))
+
+    trees = list(dict.fromkeys(params.trees))
+    results = await asyncio.gather(*[lookup(tree_name) for tree_name in trees], return_exceptions=True)
+    data, errors = {}, {}
+    for tree_name, result in zip(trees, results):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, Exception):
+            errors[tree_name] = {"status": getattr(result, "status", 500), "reasons": str(result)}
+        else:
+            data[tree_name] = result
+
+    status = 207 if errors else 200
+    reasons = "Partial failure" if errors else "OK"
+    return json({"status": str(status), "reasons": reasons, "data": data, "errors": errors}, status=status)
+
+
+@records.route("changes/<tree_name:str>", methods=["GET"])
+@openapi.description("Stream of the tree mutations, as server sent events. Resume with the `Last-Event-ID` header or the `since` parameter.")
+@openapi.parameter("since", Optional[int], location="query", description="sequence number of the last received event")
+@protected
+async def changes(request: Request, tree_name: str) -> None:
+    if tree_name not in request.app.ctx.trees:
+        raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
+
+    since = request.ctx.params.since
+    last_event_id = request.headers.get("Last-Event-ID", None)
+    if last_event_id is not None and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    feed: ChangeFeed = request.app.ctx.changes[tree_name]
+    subscriber = feed.subscribe(since)
+    response = await request.respond(
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    try:
+        for payload in subscriber.backlog:
+            await response.send(payload)
+        subscriber.backlog.clear()
+        while True:
+            try:
+                payload = await asyncio.wait_for(subscriber.queue.get(), CHANGES_KEEPALIVE)
+            except asyncio.TimeoutError:
+                await response.send(b": keepalive\n\n")
+                continue
+            if payload is None:
+                if subscriber.overflowed:
+                    await response.send(ChangeFeed.sse(None, "overflow", {"tree": tree_name, "seq": feed.seq}))
+                break
+            await response.send(payload)
+    finally:
+        feed.unsubscribe(subscriber)
+    await response.eof()
 
 
 @utils.route("<tree_name:str>/related/<nid0:str>/<nid1:str>", methods=["GET"])
 @openapi.parameter("nid0", str, location="path")
 @openapi.parameter("nid0", str, location="path")
 @protected
+@coalesced
 async def is_related(request: Request, tree_name: str, nid0: str, nid1: str) -> JSONResponse:
     tree: Tree = request.app.ctx.trees.get(tree_name, None)
     if tree is None:
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
-    params = request.ctx.params.get_kwargs(tree.is_related)
-    return json({"status": "200", "reasons": "OK", "data": tree.is_related(**params)},status=200)
+    callback = relations_source(tree).is_related
+    params = request.ctx.params.get_kwargs(callback)
+    return json({"status": "200", "reasons": "OK", "data": await query(request, callback, **params)},status=200)
+
+@utils.route("<tree_name:str>/aggregate/<aggregate:str>", methods=["GET", "POST"])
+@openapi.description("SQL aggregates over the nodes complying with `conditions`, or related (`relation`) to `nid` or to the complying nodes.")
+@openapi.parameter("aggregate", schema= {"type":"str", "enum":["count", "min", "max", "group_by", "subtree_sizes"]}, location="path", description="requested aggregate")
+@openapi.body({"application/json": AggregateParams})
+@protected
+@coalesced
+async def aggregate(request: Request, tree_name: str, aggregate: str) -> JSONResponse:
+    tree: Tree = request.app.ctx.trees.get(tree_name, None)
+    if tree is None:
+        raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
+
+    if aggregate not in get_args(Aggregates):
+        raise UnknownAggregate(aggregate, list(get_args(Aggregates)))
+
+    aggregator: Aggregator = tree.aggregator
+    callback = getattr(aggregator, aggregate)
+    params = request.ctx.params.get_kwargs(callback)
+    return json({"status": "200", "reasons": "OK", "data": await query(request, callback, **params)}, status=200)
+
+@utils.route("slow-queries", methods=["GET"])
+@openapi.description("Slowest queries over the `slow_query_ms` threshold, slowest first, with their params, statements and query plans.")
+@protected
+async def slow_queries(request: Request) -> JSONResponse:
+    # only the queries of the trees the token may access, on the queried blueprint as on this one.
+    entries = [e for e in request.app.ctx.slow_queries.top() if permitted(request, [e["tree"]], [e["blueprint"], "utils"])]
+    return json({"status": "200", "reasons": "OK", "data": entries}, status=200)
+
+@utils.route("profiles", methods=["GET"])
+@openapi.description("Profiled requests kept in the profiles ring buffer, latest first. Requests opt in with the `X-Profile: 1` header.")
+@protected
+async def profiles(request: Request) -> JSONResponse:
+    # only the requests to the trees the token may access, on the profiled blueprint as on this one.
+    data = [p for p in request.app.ctx.profiles.describe() if permitted(request, p["trees"], [p["blueprint"], "utils"])]
+    return json({"status": "200", "reasons": "OK", "data": data}, status=200)
+
+@utils.route("profiles/<profile_id:int>", methods=["GET"])
+@openapi.description("Download a request profile, as a `pstats` file (`python -m pstats <file>`, snakeviz...) or as a text summary with `format=text`.")
+@openapi.parameter("format", schema= {"type":"str", "enum":["pstats", "text"]}, location="query", description="default: pstats")
+@protected
+async def profile(request: Request, profile_id: int) -> HTTPResponse:
+    profiles: Profiles = request.app.ctx.profiles
+    profile: RequestProfile | None = profiles.get(profile_id)
+    if profile is None or not permitted(request, profile.trees, [profile.blueprint, "utils"]):
+        raise UnknownProfile(profile_id)
+
+    if request.ctx.params.format == "text":
+        return text(profile.summary())
+    headers = {"Content-Disposition": f'attachment; filename="weetags-{profile_id}.prof"'}
+    return raw(profile.dump(), headers=headers, content_type="application/octet-stream")
 
 @utils.route("export/<tree_name:str>", methods=["GET"])
 @openapi.exclude()
@@ -325,7 +664,7 @@ async def show(request: Request, tree_name: str) -> HTTPResponse:
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
 
     params = request.ctx.params.get_kwargs(tree.draw_tree)
-    return text(tree.draw_tree(**params))
+    return text(await query(request, tree.draw_tree, **params))
 
 
 @writer.route("add/node/<tree_name:str>/<nid:str>", methods=["POST"])
@@ -343,7 +682,8 @@ async def add_node(request: Request, tree_name:str, nid: str) -> JSONResponse:
 
     params.get("node").update({"id": nid})
     params.get("node").pop("nid", None)
-    tree.add_node(**params)
+    await tree.executor.submit(tree.add_node, **params)
+    request.app.ctx.changes.publish(tree_name, "add_node", params)
     return json({"status": 200, "reasons": "OK", "data": {"added": nid}},status=200)
 
 @writer.route("delete/node/<tree_name:str>/<nid:str>", methods=["GET"])
@@ -355,7 +695,8 @@ async def delete_node(request: Request, tree_name:str, nid: str):
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
 
     params = request.ctx.params.get_kwargs(tree.delete_node)
-    tree.delete_node(**params)
+    await tree.executor.submit(tree.delete_node, **params)
+    request.app.ctx.changes.publish(tree_name, "delete_node", {"nid": nid})
     return json({"status": 200, "reasons": "OK", "data": {"deleted": nid}},status=200)
 
 @writer.route("delete/nodes/<tree_name:str>", methods=["POST"])
@@ -366,8 +707,13 @@ async def deletes_nodes_where(request: Request, tree_name: str):
     if tree is None:
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
     
-    params = request.ctx.params.get_kwargs(tree.delete_nodes_where)
-    tree.delete_nodes_where(**params)
+    if request.ctx.params.job:
+        return submit_job(request, tree, tree_name, "delete_nodes_where")
+
+    source = statements_source(tree)
+    params = request.ctx.params.get_kwargs(source.delete_nodes_where)
+    await tree.executor.submit(source.delete_nodes_where, **params)
+    request.app.ctx.changes.publish(tree_name, "delete_nodes", params)
     return json({"status": 200, "reasons": "OK", "data": {}},status=200)
 
 @writer.route("update/node/<tree_name:str>/<nid:str>", methods=["POST"])
@@ -384,7 +730,8 @@ async def update_node(request: Request, tree_name:str, nid: str):
     if params.get("set_values",None) is None:
         raise ValueError("missing set_values payload")
 
-    tree.update_node(nid, params.get("set_values"))
+    await tree.executor.submit(tree.update_node, nid, params.get("set_values"))
+    request.app.ctx.changes.publish(tree_name, "update_node", {"nid": nid, "set_values": params.get("set_values")})
     return json({"status": 200, "reasons": "OK", "data": {"updated": nid}},status=200)
 
 @writer.route("update/nodes/<tree_name:str>", methods=["POST"])
@@ -395,10 +742,38 @@ async def update_nodes(request: Request, tree_name: str):
     if tree is None:
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
     
-    params = request.ctx.params.get_kwargs(tree.update_nodes_where)
-    tree.update_nodes_where(**params)
+    if request.ctx.params.job:
+        return submit_job(request, tree, tree_name, "update_nodes_where")
+
+    source = statements_source(tree)
+    params = request.ctx.params.get_kwargs(source.update_nodes_where)
+    await tree.executor.submit(source.update_nodes_where, **params)
+    request.app.ctx.changes.publish(tree_name, "update_nodes", params)
     return json({"status": 200, "reasons": "OK", "data": {}},status=200)
 
+@writer.route("jobs/<job_id:str>", methods=["GET"])
+@openapi.description("Status, progress and outcome of a background job.")
+@protected
+async def job(request: Request, job_id: str) -> JSONResponse:
+    job: Job | None = request.app.ctx.jobs.get(job_id)
+    if job is None:
+        raise UnknownJob(job_id)
+    if not permitted(request, [job.tree_name], ["writer"]):
+        raise AccessDenied()
+    return json({"status": 200, "reasons": "OK", "data": job.describe()}, status=200)
+
+@writer.route("jobs/<job_id:str>", methods=["DELETE"])
+@openapi.description("Cancel a background job. It stops before its next chunk, the committed chunks are kept.")
+@protected
+async def cancel_job(request: Request, job_id: str) -> JSONResponse:
+    job: Job | None = request.app.ctx.jobs.get(job_id)
+    if job is None:
+        raise UnknownJob(job_id)
+    if not permitted(request, [job.tree_name], ["writer"]):
+        raise AccessDenied()
+    request.app.ctx.jobs.cancel(job_id)
+    return json({"status": 200, "reasons": "OK", "data": job.describe()}, status=200)
+
 @writer.route("append/node/<tree_name:str>/<nid:str>", methods=["POST"])
 @openapi.parameter("nid", str, location="path", description="Node id")
 @openapi.body({"application/json": AppendNode})
@@ -409,7 +784,8 @@ async def append_nodes(request: Request, tree_name: str, nid: str):
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
     
     params = request.ctx.params.get_kwargs(tree.append_node)
-    tree.append_node(**params)
+    await tree.executor.submit(tree.append_node, **params)
+    request.app.ctx.changes.publish(tree_name, "append_node", params)
     return json({"status": 200, "reasons": "OK", "data": {}},status=200)
 
 @writer.route("extend/node/<tree_name:str>/<nid:str>", methods=["GET", "POST"])
@@ -422,9 +798,47 @@ async def extend_node(request: Request, tree_name: str, nid: str):
         raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
     
     params = request.ctx.params.get_kwargs(tree.extend_node)
-    tree.extend_node(**params)
+    await tree.executor.submit(tree.extend_node, **params)
+    request.app.ctx.changes.publish(tree_name, "extend_node", params)
     return json({"status": 200, "reasons": "OK", "data": {}},status=200)
 
 
+@admin.route("reload/<tree_name:str>", methods=["POST"])
+@openapi.description("Rebuild a tree from its data files in the background. The rebuilt tree replaces the served one once ready.")
+@protected
+async def reload_tree(request: Request, tree_name: str) -> JSONResponse:
+    reloader: TreeReloader = request.app.ctx.reloader
+    if tree_name not in request.app.ctx.trees:
+        raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
+
+    generation = reloader.start(tree_name)
+    return json({"status": 202, "reasons": "Accepted", "data": {"reloading": tree_name, "generation": generation}}, status=202)
+
+@admin.route("reload/<tree_name:str>", methods=["GET"])
+@openapi.description("Last reload report of a tree, with the memory used by both copies during the swap.")
+@protected
+async def reload_report(request: Request, tree_name: str) -> JSONResponse:
+    reloader: TreeReloader = request.app.ctx.reloader
+    if tree_name not in request.app.ctx.trees:
+        raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
+    return json({"status": 200, "reasons": "OK", "data": reloader.reports.get(tree_name, None)}, status=200)
+
+@admin.route("delta/<tree_name:str>", methods=["POST"])
+@openapi.description("Apply a delta (upsert, move and delete records) onto a tree. Records are given inline or as a server side jsonlines file path.")
+@openapi.body({"application/json": Delta})
+@protected
+async def apply_delta(request: Request, tree_name: str) -> JSONResponse:
+    tree: Tree = request.app.ctx.trees.get(tree_name, None)
+    if tree is None:
+        raise TreeDoesNotExist(tree_name, list(request.app.ctx.trees.keys()))
 
+    payload = request.load_json() or {}
+    path, records = payload.get("path", None), payload.get("records", None)
+    if (path is None) == (records is None):
+        raise ValueError("set either a delta file `path` or inline `records`")
+    if path is not None:
+        records = JlLoader(path, "lazy").loader()
 
+    report = await tree.executor.submit(DeltaApplier(tree).apply, records)
+    request.app.ctx.changes.publish(tree_name, "delta", report)
+    return json({"status": 200, "reasons": "OK", "data": report}, status=200)
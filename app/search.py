@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+
+from typing import Any
+
+from weetags.tree import Tree
+from app.relations import relation_scope
+from app.exceptions import InvalidSearchQuery, MissingParameter
+
+Nodes = list[dict[str, Any]]
+
+CREATE_FTS = "CREATE VIRTUAL TABLE {table_name} USING fts5({fields}, content='{nodes_table}', content_rowid='rowid', prefix='{prefix}');"
+REBUILD_FTS = "INSERT INTO {table_name}({table_name}) VALUES('rebuild');"
+INSERT_FTS_TRIGGER = """\
+CREATE TRIGGER {table_name}__insert_trigger AFTER INSERT ON {nodes_table} BEGIN
+INSERT INTO {table_name}(rowid, {fields}) VALUES (NEW.rowid, {new_values});
+END;
+"""
+DELETE_FTS_TRIGGER = """\
+CREATE TRIGGER {table_name}__delete_trigger AFTER DELETE ON {nodes_table} BEGIN
+INSERT INTO {table_name}({table_name}, rowid, {fields}) VALUES ('delete', OLD.rowid, {old_values});
+END;
+"""
+UPDATE_FTS_TRIGGER = """\
+CREATE TRIGGER {table_name}__update_trigger AFTER UPDATE OF {fields} ON {nodes_table} BEGIN
+INSERT INTO {table_name}({table_name}, rowid, {fields}) VALUES ('delete', OLD.rowid, {old_values});
+INSERT INTO {table_name}(rowid, {fields}) VALUES (NEW.rowid, {new_values});
+END;
+"""
+SEARCH = "{scope} SELECT n.id FROM {table_name} JOIN {nodes_table} n ON n.rowid = {table_name}.rowid WHERE {table_name} MATCH ? {in_scope} ORDER BY rank LIMIT ?;"
+
+class SearchIndex(object):
+    """
+    Full text index over some fields of a tree, backed by an FTS5 external content table on the tree nodes table.
+    The index is kept in sync by triggers on the nodes table, so writer routes and deltas are reflected as they commit.
+    The FTS table is named `_fts5__<tree>`, out of the `<tree>__` tables namespace used by the tree engine.
+    Must be used within the tree thread.
+    """
+    PREFIX_SIZES = "2 3 4"
+
+    def __init__(self, tree: Tree, fields: list[str]) -> None:
+        nodes_fields = tree.tables["nodes"].fields
+        for fname in fields:
+            if fname not in nodes_fields or fname in ["id", "parent", "children"]:
+                raise KeyError(f"Search Index: field {fname} does not exist or cannot be indexed")
+
+        self.tree = tree
+        self.fields = fields
+        self.nodes_table = tree.tables["nodes"]._name
+        self.table_name = f"_fts5__{tree.tree_name}"
+
+    def build(self) -> None:
+        """create the index, unless an up to date one already exists. A replaced nodes table loses its triggers, which forces a rebuild."""
+        if self._is_built():
+            return
+
+        self.drop()
+        fields = ", ".join(self.fields)
+        params = {
+            "table_name": self.table_name,
+            "nodes_table": self.nodes_table,
+            "fields": fields,
+            "new_values": ", ".join([f"NEW.{f}" for f in self.fields]),
+            "old_values": ", ".join([f"OLD.{f}" for f in self.fields]),
+        }
+        self.tree._execute_many(
+            CREATE_FTS.format(prefix=self.PREFIX_SIZES, **params),
+            INSERT_FTS_TRIGGER.format(**params),
+            DELETE_FTS_TRIGGER.format(**params),
+            UPDATE_FTS_TRIGGER.format(**params),
+            REBUILD_FTS.format(**params),
+        )
+
+    def drop(self) -> None:
+        self.tree._execute_many(
+            *[f"DROP TRIGGER IF EXISTS {self.table_name}__{t}_trigger;" for t in ["insert", "delete", "update"]],
+            f"DROP TABLE IF EXISTS {self.table_name};"
+        )
+
+    def search(
+        self,
+        query: str | None = None,
+        prefix: bool = False,
+        fields: list[str] | None = None,
+        limit: int | None = None,
+        relation: str | None = None,
+        nid: str | None = None
+    ) -> Nodes:
+        """
+        Ranked (bm25) full text search.
+        :query: FTS5 query expression, or plain words when `prefix` is set: the last word is then completed.
+        :relation: & :nid: restrict the search to the nodes related to `nid`.
+        """
+        if query is None:
+            raise MissingParameter("query")
+        match = self.prefix_query(query) if prefix else query
+        if not match:
+            return []
+
+        scope, values = "", []
+        if relation is not None:
+            if nid is None:
+                raise MissingParameter("nid")
+            scope, values = relation_scope(self.nodes_table, relation), [nid]
+
+        stmt = SEARCH.format(
+            scope=scope,
+            table_name=self.table_name,
+            nodes_table=self.nodes_table,
+            in_scope="AND n.id IN scope" if scope else ""
+        )
+        try:
+            ids = [r["id"] for r in self.tree.con.execute(stmt, values + [match, limit or -1]).fetchall()]
+        except sqlite3.OperationalError as e:
+            if str(e) == "interrupted":
+                # deadline, handled by the executor.
+                raise
+            raise InvalidSearchQuery(query, str(e))
+
+        if not ids:
+            return []
+        projection = fields if fields is None or "id" in fields else ["id"] + fields
+        nodes = {n["id"]:n for n in self.tree.nodes_where([[("id", "IN", ids)]], projection)}
+        ranked = [nodes[nid] for nid in ids if nid in nodes]
+        if projection is not fields:
+            [n.pop("id") for n in ranked]
+        return ranked
+
+    @staticmethod
+    def prefix_query(text: str) -> str:
+        """plain words into an FTS5 query: every word must match, the last one as a prefix."""
+        words = re.findall(r"\w+", text)
+        if not words:
+            return ""
+        return " ".join([f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*'])
+
+    def _is_built(self) -> bool:
+        trigger = self.tree.con.execute(
+            "SELECT name FROM sqlite_master WHERE type='trigger' AND name=?;",
+            [f"{self.table_name}__insert_trigger"]
+        ).fetchone()
+        if trigger is None:
+            return False
+        columns = [c[1] for c in self.tree._table_info(self.table_name)]
+        return columns == self.fields
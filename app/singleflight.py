@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import json
+import asyncio
+from time import perf_counter
+from attrs import asdict
+from functools import wraps
+from sanic.request import Request
+from sanic.response import raw, HTTPResponse
+
+from typing import Any, Awaitable, Callable
+
+from app.metrics import Metrics
+from app.exceptions import QueryTimeout
+from app.executor import request_timeout
+
+# body, status and content type of a response shared with the joined requests.
+Shared = tuple[bytes, int, str]
+
+
+class SingleFlight(object):
+    """
+    In-flight deduplication of identical read requests.
+    The first request of a key runs its handler. The identical requests arriving while it runs join it, and get a
+    copy of its serialized response instead of querying the tree again. Only successful responses are shared:
+    when the first request fails, is aborted or streams its response, the joined requests run their own handler.
+    When it exceeds its deadline, the joined requests, sharing its timeout, time out as well rather than querying again.
+    Joined requests wait up to their own deadline.
+    Flights end with their first request, nothing is cached beyond it.
+    Keys carry the sequence number of the tree change feed, so that requests arriving after a write never join a
+    flight started before it, and the request timeout.
+    """
+    def __init__(self, metrics: Metrics | None = None) -> None:
+        self.flights: dict[str, asyncio.Future[Shared | QueryTimeout | None]] = {}
+        self.metrics = metrics
+
+    async def run(
+        self,
+        key: str,
+        tree_name: str,
+        handler: Callable[[], Awaitable[HTTPResponse | None]],
+        timeout: int | None = None,
+        deadline: float | None = None
+    ) -> HTTPResponse | None:
+        flight = self.flights.get(key, None)
+        if flight is not None:
+            # shielded: a joined request going away must not end the flight of the others.
+            try:
+                shared = await asyncio.wait_for(asyncio.shield(flight), None if deadline is None else max(deadline - perf_counter(), 0))
+            except asyncio.TimeoutError:
+                self._incr("single_flight_timeouts", tree_name)
+                raise QueryTimeout(timeout)
+            if isinstance(shared, QueryTimeout):
+                self._incr("single_flight_timeouts", tree_name)
+                raise QueryTimeout(timeout)
+            if shared is None:
+                self._incr("single_flight_fallbacks", tree_name)
+                return await handler()
+            self._incr("single_flight_joins", tree_name)
+            body, status, content_type = shared
+            return raw(body, status=status, content_type=content_type)
+
+        flight = asyncio.get_running_loop().create_future()
+        self.flights[key] = flight
+        shared = None
+        try:
+            response = await handler()
+            if isinstance(response, HTTPResponse) and response.status < 400 and response.body is not None:
+                shared = (response.body, response.status, response.content_type)
+            return response
+        except QueryTimeout as e:
+            shared = e
+            raise
+        finally:
+            del self.flights[key]
+            flight.set_result(shared)
+
+    def _incr(self, name: str, tree_name: str) -> None:
+        if self.metrics is not None:
+            self.metrics.incr(name, tree_name)
+
+
+def flight_key(request: Request, tree_name: str, kwargs: dict[str, Any]) -> str:
+    """tree, route, last change of the tree, timeout and normalized params of a request."""
+    feed = request.app.ctx.changes.get(tree_name, None)
+    params = {k:v for k,v in asdict(request.ctx.params).items() if v is not None}
+    route = request.route.name if request.route else request.path
+    seq = feed.seq if feed is not None else 0
+    return json.dumps([tree_name, route, seq, request_timeout(request), kwargs, params], sort_keys=True, default=str)
+
+def coalesced(f):
+    """share the response of identical concurrent requests of a tree read route. Profiled and streamed requests run on their own."""
+    @wraps(f)
+    async def wrapped(request: Request, *args, **kwargs):
+        single_flight: SingleFlight | None = getattr(request.app.ctx, "single_flight", None)
+        tree_name = kwargs.get("tree_name", None)
+        if (
+            single_flight is None
+            or tree_name is None
+            or getattr(request.ctx, "profile", None) is not None
+            or request.ctx.params.stream
+        ):
+            return await f(request, *args, **kwargs)
+        key = flight_key(request, tree_name, kwargs)
+        timeout = request_timeout(request)
+        deadline = None if timeout is None else request.ctx.t + timeout / 1000
+        return await single_flight.run(key, tree_name, lambda: f(request, *args, **kwargs), timeout, deadline)
+    return wrapped
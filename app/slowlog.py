@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import json
+import heapq
+import sqlite3
+import logging
+import itertools
+from queue import SimpleQueue
+from threading import Lock
+from time import perf_counter, time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from sanic.request import Request
+
+from typing import Any, Iterator
+
+from app.columnar import Rows
+
+# statements explained per slow query.
+MAX_STATEMENTS = 10
+
+
+class QueryTrace(object):
+    """
+    Statements run by one query on its tree connection, through the sqlite trace callback (bound values expanded).
+    Queries running over the threshold get the query plan of their statements, while still on the tree thread.
+    """
+    def __init__(self, threshold: float) -> None:
+        self.threshold = threshold
+        self.statements: list[str] = []
+        self.plans: list[dict[str, Any]] = []
+        self.elapsed = 0.0
+
+    @property
+    def slow(self) -> bool:
+        return self.elapsed >= self.threshold
+
+    @contextmanager
+    def capture(self, con: sqlite3.Connection) -> Iterator[None]:
+        con.set_trace_callback(self.statements.append)
+        t = perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed = perf_counter() - t
+            con.set_trace_callback(None)
+        if self.slow:
+            self.explain(con)
+
+    def explain(self, con: sqlite3.Connection) -> None:
+        reads = [stmt for stmt in dict.fromkeys(self.statements) if stmt.lstrip().upper().startswith(("SELECT", "WITH"))]
+        for stmt in reads[:MAX_STATEMENTS]:
+            try:
+                plan = [r["detail"] for r in con.execute(f"EXPLAIN QUERY PLAN {stmt}").fetchall()]
+            except sqlite3.Error:
+                plan = None
+            self.plans.append({"sql": stmt, "plan": plan})
+
+
+class SlowQueryLog(object):
+    """
+    Queries running over `threshold_ms` on their tree thread, with their tree, route, params, rows, statements and plans.
+    Entries are written as json to the `slowQueries` logger. Its handlers are moved behind a queue, so that
+    they write from a dedicated thread. The `size` slowest entries are kept in memory for `utils/slow-queries`.
+    Disabled without threshold.
+    """
+    LOGGER = "slowQueries"
+
+    def __init__(self, threshold_ms: int | None = None, size: int = 50) -> None:
+        self.threshold_ms = threshold_ms
+        self.size = size
+        self.slowest: list[tuple[float, int, dict[str, Any]]] = []
+        self.logger = logging.getLogger(self.LOGGER)
+        self.listener: QueueListener | None = None
+        self._seq = itertools.count()
+        self._lock = Lock()
+        if threshold_ms is not None and self.logger.handlers:
+            queue = SimpleQueue()
+            self.listener = QueueListener(queue, *self.logger.handlers, respect_handler_level=True)
+            self.logger.handlers = [QueueHandler(queue)]
+            self.listener.start()
+
+    def trace(self) -> QueryTrace | None:
+        return None if self.threshold_ms is None else QueryTrace(self.threshold_ms / 1000)
+
+    def record(self, request: Request, tree_name: str, method: str, params: dict[str, Any], result: Any, trace: QueryTrace) -> None:
+        entry = {
+            "time": time(),
+            "tree": tree_name,
+            "route": request.route.name.split(".")[-1] if request.route else None,
+            "blueprint": request.route.name.split(".")[1] if request.route else None,
+            "method": method,
+            "params": self.normalize(params),
+            "rows": self.rows(result),
+            "elapsed_ms": round(trace.elapsed * 1000, 3),
+            "statements": trace.plans,
+        }
+        self.logger.warning(json.dumps(entry, default=str))
+        with self._lock:
+            item = (trace.elapsed, next(self._seq), entry)
+            if len(self.slowest) < self.size:
+                heapq.heappush(self.slowest, item)
+            else:
+                heapq.heappushpop(self.slowest, item)
+
+    def top(self) -> list[dict[str, Any]]:
+        """slowest queries first."""
+        with self._lock:
+            return [entry for _, _, entry in sorted(self.slowest, reverse=True)]
+
+    @staticmethod
+    def normalize(params: dict[str, Any]) -> dict[str, Any]:
+        """params sorted by name, json compatible."""
+        return json.loads(json.dumps({k:params[k] for k in sorted(params)}, default=str))
+
+    @staticmethod
+    def rows(result: Any) -> int:
+        if result is None:
+            return 0
+        if isinstance(result, list):
+            return len(result)
+        if isinstance(result, dict) and isinstance(result.get("nodes", None), list):
+            return len(result["nodes"])
+        if isinstance(result, Rows):
+            return len(result)
+        return 1
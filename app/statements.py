@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import json
+from collections import OrderedDict
+
+from typing import Any, Callable, Literal, Optional
+
+from weetags.tree import Tree
+from weetags.engine.sql import SqlConverter, UPDATE
+from app.delta import DeltaApplier, STRUCTURAL_FIELDS
+from app.columnar import Rows
+
+Node = dict[str, Any]
+Nodes = list[Node]
+Fields = list[str]
+Conditions = list[list[tuple[str, str, Any] | str] | str]
+Setter = list[tuple[str, Any]]
+Relations = Literal["parent", "children", "siblings", "ancestors", "descendants"]
+Shape = tuple | None
+
+# nodes matched by id, whatever their number: one statement for every id list.
+IDS_CONDITION = "WHERE id IN (SELECT value FROM json_each(?))"
+
+
+class StatementCache(object):
+    """
+    Compiled SQL of the condition queries of a tree, keyed by their shape.
+    Conditions are normalized into a shape, the fields, operators and AND/OR structure (with the size of IN lists),
+    and their bind params. Queries of a known shape skip the SqlConverter, and reuse the same statement text,
+    so that the sqlite3 statement cache of the connection serves them already prepared.
+    The `size` most recently used statements are kept.
+    Must be used within the tree thread.
+    """
+    SIZE = 256
+
+    def __init__(self, tree: Tree, size: int = SIZE) -> None:
+        self.tree = tree
+        self.size = size
+        self.statements: OrderedDict[tuple, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.statements),
+            "capacity": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+    def nodes_where(
+        self,
+        conditions: Optional[Conditions] = None,
+        fields: Optional[Fields] = None,
+        order_by: Optional[Fields] = None,
+        axis: Optional[int] = 1,
+        limit: Optional[int | None] = None
+    ) -> Nodes:
+        stmt, values = self._read_many(conditions, fields, order_by, axis, limit)
+        return self.tree.con.execute(stmt, values).fetchall()
+
+    def rows(
+        self,
+        conditions: Optional[Conditions] = None,
+        fields: Optional[Fields] = None,
+        order_by: Optional[Fields] = None,
+        axis: Optional[int] = 1,
+        limit: Optional[int | None] = None
+    ) -> Rows:
+        """`nodes_where` records as field names and value tuples, straight from the cursor."""
+        stmt, values = self._read_many(conditions, fields, order_by, axis, limit)
+        cursor = self.tree.con.cursor()
+        cursor.row_factory = None
+        try:
+            return Rows.from_cursor(cursor.execute(stmt, values))
+        finally:
+            cursor.close()
+
+    def nodes_relation_where(
+        self,
+        relation: Relations,
+        conditions: Optional[Conditions] = None,
+        fields: Optional[Fields] = None,
+        order_by: Optional[Fields] = None,
+        axis: Optional[int] = 1,
+        limit: Optional[int | None] = None,
+        include_base: bool = False,
+    ) -> Nodes:
+        """nodes related to the nodes complying with `conditions`, without duplicates. Traversals use the topology cache when enabled."""
+        source = getattr(self.tree, "topology", None) or self.tree
+        callback: Callable = {
+            "parent": source.parent_node,
+            "children": source.children_nodes,
+            "siblings": source.siblings_nodes,
+            "ancestors": source.ancestors_nodes,
+            "descendants": source.descendants_nodes
+        }[relation]
+        base_fields = None if fields is None else list(dict.fromkeys(["id"] + fields))
+        res = {}
+        for node in self.nodes_where(conditions, base_fields, order_by, axis, limit):
+            related = callback(node["id"], fields)
+            if include_base:
+                res[json.dumps(node, sort_keys=True, default=str)] = node
+            for n in (related if isinstance(related, list) else [related]):
+                if n is not None:
+                    res[json.dumps(n, sort_keys=True, default=str)] = n
+        return list(res.values())
+
+    def delete_nodes_where(self, conditions: Optional[Conditions] = None) -> None:
+        nids = [n["id"] for n in self.nodes_where(conditions, ["id"])]
+        if self.tree.root_id in nids:
+            raise ValueError("cannot delete root node")
+        for nid in nids:
+            self.tree._delete_node(nid)
+        if self.tree.remove_orphans:
+            self.tree.delete_dead_branches()
+
+    def update_nodes_where(self, conditions: Optional[Conditions] = None, set_values: Optional[Setter] = None) -> None:
+        setter = self.validate(set_values)
+        nids = [n["id"] for n in self.nodes_where(conditions, ["id"])]
+        self.update_nodes(nids, setter)
+
+    def update_nodes(self, nids: list[str], set_values: Setter, commit: bool = True) -> None:
+        """set `set_values` on the `nids` nodes, whatever their number, with a single statement per setter shape."""
+        setter = [tuple(s) for s in set_values]
+        key = ("update", tuple([fname for fname, _ in setter]))
+        stmt = self._compile(key, lambda: UPDATE.format(
+            table_name=self.tree.tables["nodes"]._name,
+            setter=SqlConverter(namespaces=self.tree.namespaces, tables=self.tree.tables).update_setter(setter)[0],
+            conditions=IDS_CONDITION
+        ))
+        self.tree.con.execute(stmt, [v for _, v in setter] + [self.tree._serialize(nids)])
+        if commit:
+            self.tree.con.commit()
+
+    def validate(self, set_values: Optional[Setter]) -> Setter:
+        """updatable fields and their dtypes, checked before any write."""
+        if not set_values:
+            raise ValueError("missing set_values")
+        values = dict([tuple(setter) for setter in set_values])
+        if any([k in STRUCTURAL_FIELDS for k in values]):
+            raise KeyError(f"You cannot update the following fields: {STRUCTURAL_FIELDS}")
+        DeltaApplier(self.tree)._validate(values)
+        return list(values.items())
+
+    def shape(self, conditions: Conditions | None) -> tuple[Shape, list[Any]]:
+        """
+        shape of a set of conditions and its bind params, in statement order.
+        Values go through the field namespace, as the SqlConverter does (ILIKE values are uppercased).
+        IN lists bind one param per value, lists compared with other operators bind a single serialized one.
+        """
+        if conditions is None:
+            return (None, [])
+        shape, values = [], []
+        for cond in conditions:
+            if isinstance(cond, str):
+                shape.append(cond)
+                continue
+            segment = []
+            for c in cond:
+                if isinstance(c, str):
+                    segment.append(c)
+                    continue
+                fname, op, value = c
+                namespace = self.tree.namespaces.get(fname, None)
+                if namespace is None:
+                    raise KeyError(f"Unknown Table Field: {fname}")
+                _, value = namespace.where(op, value)
+                if isinstance(value, list) and op.lower() == "in":
+                    segment.append((fname, op.upper(), len(value)))
+                    values.extend(value)
+                else:
+                    segment.append((fname, op.upper(), None))
+                    values.append(value)
+            shape.append(tuple(segment))
+        return (tuple(shape), values)
+
+    def _read_many(
+        self,
+        conditions: Conditions | None,
+        fields: Fields | None,
+        order_by: Fields | None,
+        axis: int,
+        limit: int | None
+    ) -> tuple[str, list[Any]]:
+        shape, values = self.shape(conditions)
+        key = ("read", shape, self._fields(fields), self._fields(order_by), axis, limit)
+        stmt = self._compile(key, lambda: SqlConverter(
+            namespaces=self.tree.namespaces,
+            tables=self.tree.tables,
+            fields=fields,
+            conds=conditions,
+            order_by=order_by,
+            axis=axis,
+            limit=limit
+        ).read_many()[0])
+        return (stmt, values)
+
+    def _compile(self, key: tuple, compile: Callable[[], str]) -> str:
+        stmt = self.statements.get(key, None)
+        if stmt is not None:
+            self.hits += 1
+            self.statements.move_to_end(key)
+            return stmt
+        self.misses += 1
+        stmt = compile()
+        self.statements[key] = stmt
+        if len(self.statements) > self.size:
+            self.statements.popitem(last=False)
+            self.evictions += 1
+        return stmt
+
+    @staticmethod
+    def _fields(fields: Fields | None) -> tuple | None:
+        return None if fields is None else tuple(fields)
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import sqlite3
+
+from typing import Any
+
+from weetags.tree import Tree
+
+Settings = dict[str, Any]
+
+# sqlite settings of the tree connection. Sizes are in bytes for mmap_size, in pages (> 0) or KiB (< 0) for cache_size.
+STORAGE_SETTINGS = {
+    "mmap_size": int,
+    "cache_size": int,
+    "wal_autocheckpoint": int,
+    "journal_mode": ["delete", "truncate", "persist", "memory", "wal", "off"],
+    "synchronous": ["off", "normal", "full", "extra"],
+    "temp_store": ["default", "file", "memory"],
+}
+
+STORAGE_PROFILES: dict[str, Settings] = {
+    # lookups served from the page cache and the memory mapped database, readers never wait on writers.
+    "read-heavy": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "temp_store": "memory",
+    },
+    # appends to the write ahead log, fsync at checkpoints only. Fewer, larger checkpoints.
+    "write-heavy": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "wal_autocheckpoint": 10000,
+        "mmap_size": 67108864,
+        "cache_size": -16384,
+        "temp_store": "memory",
+    },
+    # small page cache, no memory map, sorts and temporary tables spill to disk.
+    "memory-constrained": {
+        "journal_mode": "truncate",
+        "synchronous": "normal",
+        "mmap_size": 0,
+        "cache_size": -1024,
+        "temp_store": "file",
+    },
+}
+
+
+def storage_settings(storage: str | Settings | None) -> Settings:
+    """
+    Resolve the `storage` option of a tree: a profile name, or a mapping of settings, optionally based on a `profile`.
+    Raise ValueError on unknown profiles, settings or values, as they end up in PRAGMA statements.
+    """
+    if storage is None:
+        return {}
+    settings = {"profile": storage} if isinstance(storage, str) else dict(storage)
+    profile = settings.pop("profile", None)
+    if profile is not None and profile not in STORAGE_PROFILES:
+        raise ValueError(f"unknown storage profile: {profile}. possible profiles: {list(STORAGE_PROFILES)}")
+
+    resolved = {**STORAGE_PROFILES.get(profile, {}), **settings}
+    for name, value in resolved.items():
+        allowed = STORAGE_SETTINGS.get(name, None)
+        if allowed is None:
+            raise ValueError(f"unknown storage setting: {name}. possible settings: {list(STORAGE_SETTINGS)}")
+        if allowed is int and (not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError(f"storage setting {name} must be an int")
+        if isinstance(allowed, list) and str(value).lower() not in allowed:
+            raise ValueError(f"storage setting {name} must be one of {allowed}")
+    return resolved
+
+def apply_storage(tree: Tree, settings: Settings) -> None:
+    """
+    Set the storage settings on the tree connection. Must run within the tree thread.
+    In memory databases keep their own journal mode, read only ones their journal mode as well.
+    """
+    for name, value in settings.items():
+        value = value if isinstance(value, int) else str(value).lower()
+        try:
+            tree.con.execute(f"PRAGMA {name} = {value};").fetchall()
+        except sqlite3.OperationalError:
+            if name != "journal_mode":
+                raise
+
+def active_storage(tree: Tree) -> Settings:
+    """storage settings in use on the tree connection. Must run within the tree thread."""
+    active = {}
+    for name in STORAGE_SETTINGS:
+        row = tree.con.execute(f"PRAGMA {name};").fetchone()
+        active[name] = list(row.values())[0] if row else None
+    active["synchronous"] = STORAGE_SETTINGS["synchronous"][active["synchronous"]]
+    active["temp_store"] = STORAGE_SETTINGS["temp_store"][active["temp_store"]]
+    active["profile"] = getattr(tree, "storage_profile", None)
+    return active
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import json
+from sqlite3 import Cursor
+
+from typing import Any
+
+from weetags.tree import Tree
+
+Node = dict[str, Any]
+
+# one depth first scan: the cte walks the children arrays, carrying a path made of the sibling positions.
+# Ordering its queue on that path makes it emit the subtree in depth first order, siblings in their `children` order,
+# row by row: the rows are read while the subtree is walked, without sorting it first.
+SUBTREE = """\
+WITH RECURSIVE sub AS (
+SELECT 0 AS _lvl, '' AS _path, {nodes_table}.children AS _children, {fields}
+FROM {nodes_table} JOIN {metadata_table} ON {metadata_table}.nid = {nodes_table}.id
+WHERE {nodes_table}.id = ?
+UNION ALL
+SELECT s._lvl + 1, s._path || printf('%08d', j.key), {nodes_table}.children, {fields}
+FROM sub s, json_each(s._children) j
+JOIN {nodes_table} ON {nodes_table}.id = j.value
+JOIN {metadata_table} ON {metadata_table}.nid = j.value
+WHERE (? IS NULL OR s._lvl < ?) AND (? IS NULL OR j.key < json_extract(?, '$[' || min(s._lvl, ?) || ']'))
+ORDER BY 2
+)
+SELECT * FROM sub;
+"""
+# walk columns, left out of the nodes.
+WALK_KEYS = ["_path", "_children"]
+NESTED_KEY = "children"
+
+
+class Subtree(object):
+    """
+    Nested materialization of the subtree of a node: every node holds its child nodes under `children`,
+    in place of the children ids.
+    :max_depth: number of levels below the base node. Default: the whole subtree.
+    :child_limits: maximum number of children kept for the nodes of each level, from the base node.
+        The last limit applies to the deeper levels.
+    Must be used within the tree thread.
+    """
+    BATCH_SIZE = 1000
+
+    def __init__(self, tree: Tree) -> None:
+        self.tree = tree
+        self.nodes_table = tree.tables["nodes"]._name
+        self.metadata_table = tree.tables["metadata"]._name
+
+    def nested(
+        self,
+        nid: str,
+        fields: list[str] | None = None,
+        max_depth: int | None = None,
+        child_limits: list[int] | None = None
+    ) -> Node | None:
+        cursor = self.scan(nid, fields, max_depth, child_limits)
+        try:
+            return self.nest(cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def scan(
+        self,
+        nid: str,
+        fields: list[str] | None = None,
+        max_depth: int | None = None,
+        child_limits: list[int] | None = None
+    ) -> Cursor:
+        """open the depth first scan of the subtree. Rows come in depth first order, with their relative level (`_lvl`)."""
+        limits = json.dumps(child_limits) if child_limits else None
+        last = len(child_limits) - 1 if child_limits else 0
+        stmt = SUBTREE.format(nodes_table=self.nodes_table, metadata_table=self.metadata_table, fields=self._fields(fields))
+        return self.tree.con.execute(stmt, [nid, max_depth, max_depth, limits, limits, last])
+
+    @staticmethod
+    def nest(rows: list[Node]) -> Node | None:
+        root, path = None, []
+        for row in rows:
+            lvl = row.pop("_lvl")
+            [row.pop(k) for k in WALK_KEYS]
+            row[NESTED_KEY] = []
+            del path[lvl:]
+            if path:
+                path[-1][NESTED_KEY].append(row)
+            else:
+                root = row
+            path.append(row)
+        return root
+
+    def _fields(self, fields: list[str] | None) -> str:
+        if fields is None:
+            return f"{self.nodes_table}.*, {self.metadata_table}.*"
+        selected = []
+        for fname in fields:
+            namespace = self.tree.namespaces.get(fname, None)
+            if namespace is None:
+                raise KeyError(f"Unknown field name: {fname}")
+            selected.append(namespace.select())
+        return ", ".join(selected)
+
+
+class SubtreeEncoder(object):
+    """
+    Incremental json encoding of the depth first rows of a subtree, for streamed responses.
+    Nodes are written as soon as they are read: a node is left open until a row of the same or an upper level shows up.
+    """
+    def __init__(self) -> None:
+        self.depth = -1
+
+    def feed(self, rows: list[Node]) -> str:
+        buff = []
+        for row in rows:
+            lvl = row.pop("_lvl")
+            [row.pop(k) for k in WALK_KEYS]
+            row.pop(NESTED_KEY, None)
+            if self.depth >= lvl:
+                buff.append("]}" * (self.depth - lvl + 1) + ", ")
+            body = json.dumps(row)
+            buff.append(f'{body[:-1]}{", " if row else ""}"{NESTED_KEY}": [')
+            self.depth = lvl
+        return "".join(buff)
+
+    def close(self) -> str:
+        if self.depth < 0:
+            return "null"
+        return "]}" * (self.depth + 1)
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import json
+from bisect import insort
+from collections import OrderedDict
+
+from typing import Any
+
+from weetags.tree import Tree
+from weetags.engine.sql import SqlConverter
+from app.fetch import fetch_nodes
+from app.statements import StatementCache
+from app.interning import storage_table
+
+Node = dict[str, Any]
+Nodes = list[Node]
+Conditions = list[list[tuple[str, str, Any] | str] | str]
+
+CREATE_LOG = "CREATE TEMP TABLE IF NOT EXISTS {log_table} (seq INTEGER PRIMARY KEY, id TEXT NOT NULL);"
+# writes stop being logged once the log is full: `seq` runs from 1 as the log is only ever emptied.
+LOG_TRIGGERS = [
+    "CREATE TEMP TRIGGER IF NOT EXISTS {log_table}__insert_trigger AFTER INSERT ON main.{nodes_table} WHEN {not_full} BEGIN INSERT INTO {log_table}(id) VALUES (NEW.id); END;",
+    "CREATE TEMP TRIGGER IF NOT EXISTS {log_table}__delete_trigger AFTER DELETE ON main.{nodes_table} WHEN {not_full} BEGIN INSERT INTO {log_table}(id) VALUES (OLD.id); END;",
+    "CREATE TEMP TRIGGER IF NOT EXISTS {log_table}__update_trigger AFTER UPDATE ON main.{nodes_table} WHEN {not_full} BEGIN INSERT INTO {log_table}(id) VALUES (NEW.id); END;",
+    "CREATE TEMP TRIGGER IF NOT EXISTS {log_table}__metadata_trigger AFTER UPDATE ON main.{metadata_table} WHEN {not_full} BEGIN INSERT INTO {log_table}(id) VALUES (NEW.nid); END;",
+]
+NOT_FULL = "coalesce((SELECT max(seq) FROM {log_table}), 0) <= {max_changes}"
+SORTABLE = ["TEXT", "INTEGER", "BOOL"]
+
+
+class Descending(object):
+    """reversed ordering of a sort key component."""
+    __slots__ = ("key",)
+
+    def __init__(self, key: Any) -> None:
+        self.key = key
+
+    def __lt__(self, other: Descending) -> bool:
+        return other.key < self.key
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Descending) and self.key == other.key
+
+
+def sql_order(value: Any) -> tuple[int, Any]:
+    """sqlite ordering of values of mixed types: NULL, then numbers, then text, then blobs."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, value)
+
+
+class TopKShape(object):
+    """
+    The `k` first nodes of a `(conditions, order_by, axis)` shape, as sorted `(sort key, id)` pairs.
+    :exhaustive: the shape had less than `k` complying nodes when computed: members are all of them.
+    :stale: members must be recomputed before use.
+    """
+    def __init__(self, conditions: Conditions | None, order_by: list[str], axis: int, k: int) -> None:
+        self.conditions = conditions
+        self.order_by = order_by
+        self.axis = axis
+        self.k = k
+        self.members: list[tuple[tuple, str]] = []
+        self.exhaustive = False
+        self.stale = True
+        self.hits = 0
+
+
+class TopK(object):
+    """
+    `nodes_where` with a fast path for `(order_by, axis, limit)` shapes, such as dashboards top N.
+    Shapes with an `order_by` and a `limit` up to MAX_K take one of these paths:
+        - index: sqlite already walks an index in the requested order and stops at `limit` (no sort in its query plan).
+        - topk: otherwise, the first `k` nodes of the shape are kept sorted in memory. Written nodes are re-evaluated
+          against the shape conditions and merged in, so the structure is maintained rather than recomputed.
+          Only the fields of the returned nodes are then fetched.
+    Other queries take the regular `sort` (or `scan`, without `order_by`) path.
+    Ties are broken by node id on the topk path, sqlite leaves them in any order.
+    Writes are recorded by temporary triggers into a connection private log table, replayed before each topk query.
+    The log stops past MAX_CHANGES writes, whatever the time until the next topk query: all the shapes are then recomputed.
+    Must be used within the tree thread.
+    """
+    MAX_K = 1000
+    MAX_SHAPES = 64
+    # logged writes beyond which the structures are recomputed rather than patched, and logging stops.
+    MAX_CHANGES = 10000
+
+    def __init__(self, tree: Tree, enabled: bool = False) -> None:
+        self.tree = tree
+        self.enabled = enabled
+        self.nodes_table = storage_table(tree)
+        self.metadata_table = tree.tables["metadata"]._name
+        self.log_table = f"_changes__{tree.tree_name}"
+        self.shapes: OrderedDict[tuple, TopKShape] = OrderedDict()
+        self.plans: OrderedDict[tuple, tuple[bool, list[str]]] = OrderedDict()
+        self.logging = False
+        self.changes = 0
+
+    @property
+    def source(self) -> Tree | StatementCache:
+        """regular paths go through the compiled statements of the tree, when set."""
+        return getattr(self.tree, "statements", None) or self.tree
+
+    def nodes_where(
+        self,
+        conditions: Conditions | None = None,
+        fields: list[str] | None = None,
+        order_by: list[str] | None = None,
+        axis: int = 1,
+        limit: int | None = None
+    ) -> Nodes:
+        return self.run(conditions, fields, order_by, axis, limit)[0]
+
+    def explained(
+        self,
+        conditions: Conditions | None = None,
+        fields: list[str] | None = None,
+        order_by: list[str] | None = None,
+        axis: int = 1,
+        limit: int | None = None
+    ) -> dict[str, Any]:
+        nodes, explain = self.run(conditions, fields, order_by, axis, limit)
+        return {"nodes": nodes, "explain": explain}
+
+    def run(
+        self,
+        conditions: Conditions | None,
+        fields: list[str] | None,
+        order_by: list[str] | None,
+        axis: int,
+        limit: int | None
+    ) -> tuple[Nodes, dict[str, Any]]:
+        explain = {"path": "sort" if order_by else "scan", "order_by": order_by, "axis": axis, "limit": limit}
+        if not order_by or limit is None:
+            return (self.source.nodes_where(conditions, fields, order_by, axis, limit), explain)
+
+        key = (json.dumps(conditions), tuple(order_by), axis)
+        # sqlite weighs the limit against the sort when picking an index: plans are kept per power of two of the limit.
+        in_order, plan = self._plan(key + (limit.bit_length(),), conditions, order_by, axis, limit)
+        explain["plan"] = plan
+        if in_order:
+            explain["path"] = "index"
+        elif self.enabled and limit <= self.MAX_K and self._sortable(order_by):
+            shape = self._shape(key, conditions, order_by, axis, limit)
+            explain.update({"path": "topk", "k": shape.k, "exhaustive": shape.exhaustive, "hits": shape.hits})
+            ids = [nid for _, nid in shape.members[:limit]]
+            return (fetch_nodes(self.tree, ids, fields), explain)
+        return (self.source.nodes_where(conditions, fields, order_by, axis, limit), explain)
+
+    def _plan(self, key: tuple, conditions: Conditions | None, order_by: list[str], axis: int, limit: int) -> tuple[bool, list[str]]:
+        """whether sqlite reads the shape in order, without sorting it, and its query plan."""
+        if key in self.plans:
+            self.plans.move_to_end(key)
+            return self.plans[key]
+
+        converter = SqlConverter(namespaces=self.tree.namespaces, tables=self.tree.tables, conds=conditions, order_by=order_by, axis=axis, limit=limit)
+        stmt, values = converter.read_many()
+        plan = [r["detail"] for r in self.tree.con.execute(f"EXPLAIN QUERY PLAN {stmt}", values).fetchall()]
+        in_order = not any([("TEMP B-TREE" in detail and "ORDER BY" in detail) for detail in plan])
+        self.plans[key] = (in_order, plan)
+        if len(self.plans) > self.MAX_SHAPES:
+            self.plans.popitem(last=False)
+        return (in_order, plan)
+
+    def _shape(self, key: tuple, conditions: Conditions | None, order_by: list[str], axis: int, limit: int) -> TopKShape:
+        self._sync()
+        shape = self.shapes.get(key, None)
+        if shape is None or shape.k < limit:
+            # room above the limit, so that removed members rarely force a recomputation.
+            shape = TopKShape(conditions, order_by, axis, min(self.MAX_K, max(2 * limit, 10)))
+            self.shapes[key] = shape
+            if len(self.shapes) > self.MAX_SHAPES:
+                self.shapes.popitem(last=False)
+        self.shapes.move_to_end(key)
+
+        if shape.stale:
+            self._compute(shape)
+        else:
+            shape.hits += 1
+        return shape
+
+    def _compute(self, shape: TopKShape) -> None:
+        self._start_logging()
+        converter = SqlConverter(
+            namespaces=self.tree.namespaces,
+            tables=self.tree.tables,
+            fields=["id"] + shape.order_by,
+            conds=shape.conditions,
+            order_by=shape.order_by,
+            axis=shape.axis,
+            limit=shape.k
+        )
+        stmt, values = converter.read_many()
+        rows = self.tree.con.execute(stmt, values).fetchall()
+        shape.members = sorted([(self._sort_key(shape, row), row["id"]) for row in rows])
+        shape.exhaustive = len(rows) < shape.k
+        shape.stale = False
+
+    def _patch(self, shape: TopKShape, changed: list[str]) -> None:
+        """merge written nodes into the shape: drop them, then put back the ones still complying with its conditions."""
+        changed_ids = set(changed)
+        members = [m for m in shape.members if m[1] not in changed_ids]
+        converter = SqlConverter(
+            namespaces=self.tree.namespaces,
+            tables=self.tree.tables,
+            fields=["id"] + shape.order_by,
+            conds=shape.conditions
+        )
+        stmt, values = converter.read_many()
+        stmt = f"SELECT * FROM ({stmt.strip().rstrip(';')}) WHERE id IN (SELECT value FROM json_each(?));"
+        for row in self.tree.con.execute(stmt, values + [self.tree._serialize(changed)]).fetchall():
+            insort(members, (self._sort_key(shape, row), row["id"]))
+
+        if len(members) > shape.k:
+            members = members[:shape.k]
+            shape.exhaustive = False
+        elif len(members) < shape.k and not shape.exhaustive:
+            # members left the shape: the following nodes are unknown.
+            shape.stale = True
+        shape.members = members
+
+    def _sync(self) -> None:
+        if not self.logging or self.tree.con.total_changes == self.changes:
+            return
+        logged = self.tree.con.execute(f"SELECT max(seq) AS logged FROM {self.log_table};").fetchone()["logged"]
+        if logged:
+            full = logged > self.MAX_CHANGES
+            changed = [] if full else [r["id"] for r in self.tree.con.execute(f"SELECT DISTINCT id FROM {self.log_table};").fetchall()]
+            self.tree.con.execute(f"DELETE FROM {self.log_table};")
+            self.tree.con.commit()
+            for shape in self.shapes.values():
+                if full:
+                    shape.stale = True
+                elif not shape.stale:
+                    self._patch(shape, changed)
+        self.changes = self.tree.con.total_changes
+
+    def _start_logging(self) -> None:
+        if self.logging:
+            return
+        not_full = NOT_FULL.format(log_table=self.log_table, max_changes=self.MAX_CHANGES)
+        params = {"log_table": self.log_table, "nodes_table": self.nodes_table, "metadata_table": self.metadata_table, "not_full": not_full}
+        self.tree._execute_many(
+            CREATE_LOG.format(**params),
+            *[trigger.format(**params) for trigger in LOG_TRIGGERS],
+            f"DELETE FROM {self.log_table};"
+        )
+        self.logging = True
+        self.changes = self.tree.con.total_changes
+
+    def _sortable(self, order_by: list[str]) -> bool:
+        namespaces = [self.tree.namespaces.get(fname, None) for fname in order_by]
+        return all([ns is not None and ns.ftype in SORTABLE for ns in namespaces])
+
+    @staticmethod
+    def _sort_key(shape: TopKShape, row: Node) -> tuple:
+        # the engine orders as `ORDER BY f0, f1, ..., fn ASC|DESC`: the axis applies to the last field only.
+        key = [sql_order(row[fname]) for fname in shape.order_by]
+        if shape.axis == 0:
+            key[-1] = Descending(key[-1])
+        return tuple(key)
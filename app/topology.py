@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import sys
+from array import array
+
+from typing import Any
+
+from weetags.tree import Tree
+from app.fetch import fetch_nodes
+from app.interning import storage_table
+
+Node = dict[str, Any]
+Nodes = list[Node]
+
+NONE = -1
+
+CREATE_LOG = "CREATE TEMP TABLE IF NOT EXISTS {log_table} (seq INTEGER PRIMARY KEY, op TEXT NOT NULL, id TEXT NOT NULL, parent TEXT);"
+INSERT_LOG_TRIGGER = """\
+CREATE TEMP TRIGGER IF NOT EXISTS {log_table}__insert_trigger AFTER INSERT ON main.{nodes_table} BEGIN
+INSERT INTO {log_table}(op, id, parent) VALUES ('insert', NEW.id, NEW.parent);
+END;
+"""
+DELETE_LOG_TRIGGER = """\
+CREATE TEMP TRIGGER IF NOT EXISTS {log_table}__delete_trigger AFTER DELETE ON main.{nodes_table} BEGIN
+INSERT INTO {log_table}(op, id, parent) VALUES ('delete', OLD.id, OLD.parent);
+END;
+"""
+MOVE_LOG_TRIGGER = """\
+CREATE TEMP TRIGGER IF NOT EXISTS {log_table}__move_trigger AFTER UPDATE OF parent ON main.{nodes_table} WHEN OLD.parent IS NOT NEW.parent BEGIN
+INSERT INTO {log_table}(op, id, parent) VALUES ('move', NEW.id, NEW.parent);
+END;
+"""
+TOPOLOGY = "SELECT n.id AS id, n.parent AS parent, n.children AS children, m.depth AS depth FROM {nodes_table} n JOIN {metadata_table} m ON m.nid = n.id;"
+
+
+class Topology(object):
+    """
+    In memory structure of a tree, for relation traversals without sqlite row lookups.
+    Node ids are interned into slots. Each slot has its parent, depth, first child and next sibling slots,
+    held in `array` columns. Children are linked in their `children` order.
+    Traversals resolve the related ids here, then sqlite fetches the requested fields of all of them in one query.
+
+    Memory per node: 16 bytes of array columns (4 x int32), a list slot and a dict entry for the id interning
+    (about 40 bytes amortized) and the id string itself (about 49 bytes + its length). `memory` returns the actual figures.
+
+    Writes are recorded by temporary triggers on the nodes table into a connection private log table, whatever their path
+    (writer routes, deltas...). The log is replayed before each traversal, rolled back writes leave no entries.
+    Deleted slots are compacted by a rebuild once they outnumber the live ones.
+    Must be used within the tree thread.
+    """
+    def __init__(self, tree: Tree) -> None:
+        self.tree = tree
+        self.nodes_table = storage_table(tree)
+        self.metadata_table = tree.tables["metadata"]._name
+        self.log_table = f"_topology__{tree.tree_name}"
+        self.ids: list[str | None] = []
+        self.slots: dict[str, int] = {}
+        self.parent = array("i")
+        self.depth = array("i")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self.dead = 0
+        self.changes = 0
+
+    def build(self) -> None:
+        params = {"log_table": self.log_table, "nodes_table": self.nodes_table}
+        self.tree._execute_many(
+            CREATE_LOG.format(**params),
+            INSERT_LOG_TRIGGER.format(**params),
+            DELETE_LOG_TRIGGER.format(**params),
+            MOVE_LOG_TRIGGER.format(**params),
+            f"DELETE FROM {self.log_table};"
+        )
+        self._load()
+
+    def sync(self) -> None:
+        """replay the writes logged since the last traversal."""
+        if self.tree.con.total_changes == self.changes:
+            return
+        log = self.tree.con.execute(f"SELECT seq, op, id, parent FROM {self.log_table} ORDER BY seq;").fetchall()
+        if log:
+            for entry in log:
+                getattr(self, f"_{entry['op']}")(entry["id"], entry["parent"])
+            self.tree.con.execute(f"DELETE FROM {self.log_table} WHERE seq <= ?;", [log[-1]["seq"]])
+            self.tree.con.commit()
+            if self.dead > len(self.slots):
+                self._load()
+        self.changes = self.tree.con.total_changes
+
+    def memory(self) -> dict[str, int]:
+        columns = sum([a.itemsize * len(a) for a in [self.parent, self.depth, self.first_child, self.next_sibling]])
+        interning = sys.getsizeof(self.ids) + sys.getsizeof(self.slots) + sum([sys.getsizeof(nid) for nid in self.slots])
+        nodes = len(self.slots)
+        return {
+            "nodes": nodes,
+            "slots": len(self.ids),
+            "columns_bytes": columns,
+            "interning_bytes": interning,
+            "bytes_per_node": round((columns + interning) / nodes, 1) if nodes else 0,
+        }
+
+    def parent_node(self, nid: str, fields: list[str] | None = None) -> Node | None:
+        self.sync()
+        slot = self.slots.get(nid, None)
+        if slot is None or self.parent[slot] == NONE:
+            return None
+        nodes = self._fetch([self.parent[slot]], fields)
+        return nodes[0] if nodes else None
+
+    def children_nodes(
+        self,
+        nid: str,
+        fields: list[str] | None = None,
+        order_by: list[str] | None = None,
+        axis: int = 1,
+        limit: int | None = None
+    ) -> Nodes:
+        self.sync()
+        slot = self.slots.get(nid, None)
+        if slot is None:
+            return []
+        return self._fetch(list(self._children(slot)), fields, order_by, axis, limit)
+
+    def siblings_nodes(
+        self,
+        nid: str,
+        fields: list[str] | None = None,
+        order_by: list[str] | None = None,
+        axis: int = 1,
+        limit: int | None = None
+    ) -> Nodes:
+        self.sync()
+        slot = self.slots.get(nid, None)
+        if slot is None or self.parent[slot] == NONE:
+            return []
+        return self._fetch([s for s in self._children(self.parent[slot]) if s != slot], fields, order_by, axis, limit)
+
+    def ancestors_nodes(self, nid: str, fields: list[str] | None = None, axis: int = 1, limit: int | None = None) -> Nodes:
+        """ancestors, from the parent up to the root."""
+        self.sync()
+        slot = self.slots.get(nid, None)
+        if slot is None:
+            return []
+        return self._fetch(self._ancestors(slot), fields, axis=axis, limit=limit)
+
+    def descendants_nodes(self, nid: str, fields: list[str] | None = None, axis: int = 1, limit: int | None = None) -> Nodes:
+        """descendants, in depth first order."""
+        self.sync()
+        slot = self.slots.get(nid, None)
+        if slot is None:
+            return []
+        return self._fetch(self._descendants(slot), fields, axis=axis, limit=limit)
+
+    def is_related(self, nid0: str, nid1: str, check_siblings: bool = False) -> bool:
+        self.sync()
+        if nid0 == nid1:
+            return True
+        slot0, slot1 = self.slots.get(nid0, None), self.slots.get(nid1, None)
+        if slot0 is None or slot1 is None:
+            return False
+        if slot1 in self._ancestors(slot0) or slot0 in self._ancestors(slot1):
+            return True
+        return bool(check_siblings) and self.parent[slot0] != NONE and self.parent[slot0] == self.parent[slot1]
+
+    def _children(self, slot: int):
+        child = self.first_child[slot]
+        while child != NONE:
+            yield child
+            child = self.next_sibling[child]
+
+    def _ancestors(self, slot: int) -> list[int]:
+        ancestors, parent = [], self.parent[slot]
+        while parent != NONE:
+            ancestors.append(parent)
+            parent = self.parent[parent]
+        return ancestors
+
+    def _descendants(self, slot: int) -> list[int]:
+        descendants, stack = [], []
+        child = self.first_child[slot]
+        while child != NONE:
+            descendants.append(child)
+            if self.first_child[child] != NONE:
+                stack.append(self.next_sibling[child])
+                child = self.first_child[child]
+            else:
+                child = self.next_sibling[child]
+            while child == NONE and stack:
+                child = stack.pop()
+        return descendants
+
+    def _fetch(
+        self,
+        slots: list[int],
+        fields: list[str] | None,
+        order_by: list[str] | None = None,
+        axis: int = 1,
+        limit: int | None = None
+    ) -> Nodes:
+        """without `order_by`, the traversal order is kept: reversed when axis is 0, then limited, as the tree relations methods do."""
+        ids = [self.ids[s] for s in slots]
+        if order_by is None:
+            ids = ids if axis == 1 else ids[::-1]
+            ids = ids[:limit] if limit is not None else ids
+            limit = None
+        return fetch_nodes(self.tree, ids, fields, order_by, axis, limit)
+
+    def _load(self) -> None:
+        rows = self.tree.con.execute(TOPOLOGY.format(nodes_table=self.nodes_table, metadata_table=self.metadata_table)).fetchall()
+        self.ids = [r["id"] for r in rows]
+        self.slots = {nid:i for i, nid in enumerate(self.ids)}
+        size = len(self.ids)
+        self.parent = array("i", [self.slots.get(r["parent"], NONE) for r in rows])
+        self.depth = array("i", [r["depth"] for r in rows])
+        self.first_child = array("i", [NONE]) * size
+        self.next_sibling = array("i", [NONE]) * size
+        for i, row in enumerate(rows):
+            children = [self.slots[c] for c in row["children"] or [] if c in self.slots]
+            if children:
+                self.first_child[i] = children[0]
+                for previous, child in zip(children, children[1:]):
+                    self.next_sibling[previous] = child
+        self.dead = 0
+        self.changes = self.tree.con.total_changes
+
+    def _insert(self, nid: str, parent: str | None) -> None:
+        slot = len(self.ids)
+        self.ids.append(nid)
+        self.slots[nid] = slot
+        self.parent.append(NONE)
+        self.depth.append(0)
+        self.first_child.append(NONE)
+        self.next_sibling.append(NONE)
+        self._link(slot, self.slots.get(parent, NONE))
+
+    def _delete(self, nid: str, parent: str | None) -> None:
+        slot = self.slots.pop(nid, None)
+        if slot is None:
+            return
+        self._unlink(slot)
+        for child in list(self._children(slot)):
+            # orphans, until they are deleted as well.
+            self.parent[child] = NONE
+            self.next_sibling[child] = NONE
+        self.first_child[slot] = NONE
+        self.ids[slot] = None
+        self.dead += 1
+
+    def _move(self, nid: str, parent: str | None) -> None:
+        slot = self.slots.get(nid, None)
+        if slot is None:
+            return
+        depth = self.depth[slot]
+        self._unlink(slot)
+        self._link(slot, self.slots.get(parent, NONE))
+        shift = self.depth[slot] - depth
+        for s in self._descendants(slot):
+            self.depth[s] += shift
+
+    def _link(self, slot: int, parent: int) -> None:
+        """append a slot to the children of its parent."""
+        self.parent[slot] = parent
+        self.next_sibling[slot] = NONE
+        if parent == NONE:
+            self.depth[slot] = 0
+            return
+        self.depth[slot] = self.depth[parent] + 1
+        last = self.first_child[parent]
+        if last == NONE:
+            self.first_child[parent] = slot
+            return
+        while self.next_sibling[last] != NONE:
+            last = self.next_sibling[last]
+        self.next_sibling[last] = slot
+
+    def _unlink(self, slot: int) -> None:
+        parent = self.parent[slot]
+        if parent != NONE:
+            if self.first_child[parent] == slot:
+                self.first_child[parent] = self.next_sibling[slot]
+            else:
+                previous = self.first_child[parent]
+                while previous != NONE and self.next_sibling[previous] != slot:
+                    previous = self.next_sibling[previous]
+                if previous != NONE:
+                    self.next_sibling[previous] = self.next_sibling[slot]
+        self.parent[slot] = NONE
+        self.next_sibling[slot] = NONE
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import re
+import hmac
+import json
+import asyncio
+import logging
+import secrets
+from math import ceil
+from pathlib import Path
+from time import time, perf_counter
+from collections import Counter
+from urllib.parse import urlsplit
+from sanic import Sanic
+from sanic.request import Request
+from sanic.exceptions import SanicException
+
+from typing import Any
+
+logger = logging.getLogger("sanic.root")
+
+WARMUP_HEADER = "X-Warmup"
+# appended to the access log lines of the replays, left out of the next warm-ups.
+WARMUP_TAG = "[warmup]"
+# seconds a replay token outlives the warm-up budget.
+TOKEN_MARGIN = 5
+# `endpointAccess` log lines: [{host}] > {method} {url} [{status}][{size}b][{perf}s]
+ACCESS_LOG = re.compile(r"\] > (?P<method>[A-Z]+) (?P<url>\S+) \[(?P<status>\d{3})\]")
+# routes never replayed: mutations, and the endless or introspection ones.
+SKIPPED_BLUEPRINTS = ["writer", "admin", "login"]
+SKIPPED_ROUTES = ["changes", "profiles", "profile", "ready", "slow_queries"]
+
+Entry = tuple[str, str, str | None]
+
+
+class WarmUp(object):
+    """
+    Replay the hottest read requests of a recorded traffic before the server is marked ready,
+    so that the sqlite page caches and the app level structures (top-k shapes, plans...) are warm.
+    Requests are sent to the server itself, once it listens, authorized on the replayable read routes by a token issued
+    for this warm-up: a nonce and an expiry (the budget, plus a few seconds), signed with the app secret. Workers share
+    the listening socket, so that the replays of a worker are spread over all of them: a worker still warming accepts
+    the tokens of the others, a warm one refuses them, like any token once expired. Each worker marks itself ready once
+    its own replay is done. Replays are access logged, tagged `[warmup]`.
+    :source: `endpointAccess` log file, or json lines file of `{"method", "path" | "url", "body"}` records.
+    :top: number of distinct requests replayed, the most frequent first.
+    :budget: time budget in seconds. The server is marked ready once it is spent, whatever is left.
+    :concurrency: requests in flight.
+    :secret: app secret. Without it, the tokens are signed with a per process key and refused by the other workers.
+    """
+    def __init__(
+        self,
+        source: str | None = None,
+        top: int = 100,
+        budget: float = 30.0,
+        concurrency: int = 4,
+        secret: str | None = None
+    ) -> None:
+        self.source = source
+        self.top = top
+        self.budget = budget
+        self.concurrency = concurrency
+        self.key = secret.encode() if secret else secrets.token_bytes(32)
+        self.token: str | None = None
+        self.ready = source is None
+        self.task: asyncio.Task | None = None
+        self.stats = {"status": "done" if self.ready else "pending", "requests": 0, "replayed": 0, "failed": 0, "elapsed": 0.0}
+
+    def authorized(self, request: Request) -> bool:
+        """replayed requests skip the authentication, while warming up only."""
+        if self.ready or request.route is None or not replayable(request.route.name):
+            return False
+        payload, _, signature = request.headers.get(WARMUP_HEADER, "").rpartition(".")
+        expires, _, _ = payload.partition(".")
+        if not expires.isdigit() or int(expires) < time():
+            return False
+        return secrets.compare_digest(signature, self._sign(payload))
+
+    def issue(self) -> str:
+        """replay token of this warm-up: `{expires}.{nonce}.{signature}`."""
+        payload = f"{int(time()) + ceil(self.budget) + TOKEN_MARGIN}.{secrets.token_hex(16)}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def _sign(self, payload: str) -> str:
+        return hmac.new(self.key, payload.encode(), "sha256").hexdigest()
+
+    async def start(self, app: Sanic, _: Any = None) -> None:
+        """after_server_start listener."""
+        if self.ready or self.task is not None:
+            return
+        self.task = app.add_task(self.run(app), name="weetags-warmup")
+
+    async def run(self, app: Sanic) -> None:
+        t = perf_counter()
+        self.stats["status"] = "running"
+        try:
+            address = self.address(app)
+            self.token = self.issue()
+            entries = self.hottest(app, self.read(Path(self.source)))
+            self.stats["requests"] = len(entries)
+            if address is not None and entries:
+                await asyncio.wait_for(self.replay(address, entries), timeout=self.budget)
+            self.stats["status"] = "done"
+        except asyncio.CancelledError:
+            # server stopped before the end: start over with the next server start.
+            self.task = None
+            self.stats.update({"status": "pending", "replayed": 0, "failed": 0})
+            raise
+        except asyncio.TimeoutError:
+            self.stats["status"] = "timeout"
+        except OSError as e:
+            logger.error(f"warm-up aborted: {e}")
+            self.stats["status"] = "failed"
+        self.stats["elapsed"] = round(perf_counter() - t, 3)
+        self.ready = True
+        logger.info(f"warm-up {self.stats['status']}: {self.stats['replayed']}/{self.stats['requests']} requests in {self.stats['elapsed']}s")
+
+    async def replay(self, address: tuple[str, int], entries: list[Entry]) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(entry: Entry) -> None:
+            async with semaphore:
+                status = await self.send(address, *entry)
+                self.stats["replayed" if status < 400 else "failed"] += 1
+
+        await asyncio.gather(*[send(entry) for entry in entries])
+
+    async def send(self, address: tuple[str, int], method: str, target: str, body: str | None) -> int:
+        """
+        minimal HTTP/1.1 request. Return the response status.
+        The response is read in full, then the connection closed from this side, leaving the server port clean.
+        """
+        reader, writer = await asyncio.open_connection(*address)
+        try:
+            payload = (body or "").encode()
+            head = (
+                f"{method} {target} HTTP/1.1\r\nHost: {address[0]}\r\n"
+                f"{WARMUP_HEADER}: {self.token}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n"
+            )
+            writer.write(head.encode() + payload)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            while (line := await reader.readline()) not in [b"\r\n", b""]:
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if headers.get("transfer-encoding", "") == "chunked":
+                while (size := int((await reader.readline()).strip() or b"0", 16)) > 0:
+                    await reader.readexactly(size + 2)
+            else:
+                await reader.readexactly(int(headers.get("content-length", 0)))
+            return status
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    @staticmethod
+    def read(source: Path) -> list[Entry]:
+        entries = []
+        with open(source) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("{"):
+                    record = json.loads(line)
+                    body = record.get("body", None)
+                    target = record.get("path", None) or record.get("url", "")
+                    entries.append((record.get("method", "GET").upper(), target, None if body is None else json.dumps(body)))
+                    continue
+                match = ACCESS_LOG.search(line)
+                if match is not None and match["status"] == "200" and not line.endswith(WARMUP_TAG):
+                    # access logs hold no payloads: POST reads would be replayed without their params.
+                    if match["method"] == "GET":
+                        entries.append(("GET", match["url"], None))
+        return entries
+
+    def hottest(self, app: Sanic, entries: list[Entry]) -> list[Entry]:
+        """most frequent read requests, with targets reduced to their path and query string."""
+        reads = Counter()
+        for method, target, body in entries:
+            url = urlsplit(target)
+            target = url.path + (f"?{url.query}" if url.query else "")
+            try:
+                route, _, _ = app.router.get(url.path, method, None)
+            except SanicException:
+                continue
+            if not replayable(route.name):
+                continue
+            reads[(method, target, body)] += 1
+        return [entry for entry, _ in reads.most_common(self.top)]
+
+    @staticmethod
+    def address(app: Sanic) -> tuple[str, int] | None:
+        """local address of a plain http listener of the server."""
+        for info in app.state.server_info:
+            settings = info.settings
+            if settings.get("ssl", None) or settings.get("unix", None):
+                continue
+            sock = settings.get("sock", None)
+            host, port = sock.getsockname()[:2] if sock is not None else (settings.get("host", None), settings.get("port", None))
+            if port is None:
+                continue
+            host = {"0.0.0.0": "127.0.0.1", "::": "::1"}.get(host, host)
+            return (host, port)
+        return None
+
+
+def replayable(route_name: str) -> bool:
+    """blueprint read routes, other than the endless or introspection ones."""
+    parts = route_name.split(".")
+    if len(parts) != 3:
+        return False
+    _, blueprint, name = parts
+    return blueprint not in SKIPPED_BLUEPRINTS and name not in SKIPPED_ROUTES
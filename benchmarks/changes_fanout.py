@@ -0,0 +1,66 @@
+"""
+Change feed fan-out benchmark.
+Publish events to N in-process subscribers and measure the publish cost and the time until every subscriber
+has consumed every event. Network writes are left out, this measures the feed itself.
+
+usage: python -m benchmarks.changes_fanout [--subscribers 100 1000 5000] [--events 200]
+"""
+from __future__ import annotations
+
+import asyncio
+import argparse
+from time import perf_counter
+
+from app.changes import ChangeFeed
+
+
+async def fanout(n_subscribers: int, n_events: int) -> dict[str, float]:
+    feed = ChangeFeed("bench", buffer_size=n_events)
+    done = asyncio.Event()
+    remaining = n_subscribers
+
+    async def consume(subscriber):
+        nonlocal remaining
+        for _ in range(n_events):
+            await subscriber.queue.get()
+        remaining -= 1
+        if remaining == 0:
+            done.set()
+
+    tasks = [asyncio.create_task(consume(feed.subscribe())) for _ in range(n_subscribers)]
+    await asyncio.sleep(0)
+
+    t = perf_counter()
+    publish = 0.0
+    for i in range(n_events):
+        p = perf_counter()
+        feed.publish("update_node", {"nid": str(i), "set_values": [["label", "x" * 64]]})
+        publish += perf_counter() - p
+        await asyncio.sleep(0)
+    await done.wait()
+    total = perf_counter() - t
+    await asyncio.gather(*tasks)
+
+    return {
+        "subscribers": n_subscribers,
+        "events": n_events,
+        "publish_us": round(publish / n_events * 1e6, 1),
+        "total_s": round(total, 4),
+        "deliveries_per_s": round(n_subscribers * n_events / total),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--events", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'subscribers':>12} {'events':>8} {'publish (us)':>14} {'total (s)':>10} {'deliveries/s':>14}")
+    for n in args.subscribers:
+        r = asyncio.run(fanout(n, args.events))
+        print(f"{r['subscribers']:>12} {r['events']:>8} {r['publish_us']:>14} {r['total_s']:>10} {r['deliveries_per_s']:>14}")
+
+
+if __name__ == "__main__":
+    main()
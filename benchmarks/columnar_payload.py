@@ -0,0 +1,68 @@
+"""
+Columnar response benchmark.
+Read the same wide result set as a list of nodes (dict per node, the default response), as rows and as columns,
+then serialize it with the json encoder of the responses. Measure the read, the encoding and the payload size.
+
+usage: python -m benchmarks.columnar_payload [--nodes 10000] [--fields 12] [--repeat 20]
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+from time import perf_counter
+from sanic.response import json_dumps
+
+from weetags.tree_builder import TreeBuilder
+from app.statements import StatementCache
+
+FANOUT = 10
+
+
+def tree_data(n_nodes: int, n_fields: int) -> list[dict]:
+    data = []
+    for i in range(n_nodes):
+        node = {"id": str(i), "parent": None if i == 0 else str((i - 1) // FANOUT)}
+        node.update({f"attribute_{k:02d}": (i * k if k % 2 else f"value-{i % 97}-{k}") for k in range(n_fields)})
+        data.append(node)
+    return data
+
+def timed(f, *args) -> tuple[float, object]:
+    t = perf_counter()
+    res = f(*args)
+    return ((perf_counter() - t) * 1e3, res)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--fields", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    tree = TreeBuilder.build_tree("bench", data=tree_data(args.nodes, args.fields), replace=True, cache="shared")
+    statements = StatementCache(tree)
+    fields = ["id", "parent", "depth"] + [f"attribute_{k:02d}" for k in range(args.fields)]
+
+    readers = {
+        "nodes": lambda: {"data": statements.nodes_where(None, fields)},
+        "rows": lambda: statements.rows(None, fields).encode("rows"),
+        "columnar": lambda: statements.rows(None, fields).encode("columnar"),
+    }
+    print(f"{args.nodes} nodes x {len(fields)} fields. median of {args.repeat} runs, in ms.")
+    print(f"{'format':>10} {'read':>9} {'encode':>9} {'total':>9} {'bytes':>11} {'ratio':>7}")
+    baseline = None
+    for name, read in readers.items():
+        reads, encodes = [], []
+        for _ in range(args.repeat):
+            t_read, body = timed(read)
+            t_encode, payload = timed(json_dumps, body)
+            reads.append(t_read)
+            encodes.append(t_encode)
+        size = len(payload.encode())
+        baseline = baseline or size
+        r, e = statistics.median(reads), statistics.median(encodes)
+        print(f"{name:>10} {r:>9.2f} {e:>9.2f} {r + e:>9.2f} {size:>11} {size / baseline:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
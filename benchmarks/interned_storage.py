@@ -0,0 +1,126 @@
+"""
+Interned storage benchmark.
+Build an in-memory tree whose nodes repeat long labels, language codes and category lists, with and without
+interning of the labels and categories, each in a fresh process. Language codes are indexed: indexed fields cannot be
+interned. Report the bytes of the tree tables and indexes (dbstat), then
+the process RSS:
+    - build: growth over the build. The interned build first writes the plain values, then recodes and compacts them:
+      its peak is higher, the freed pages stay in the process heap.
+    - steady: growth once the freed heap is handed back to the system (glibc `malloc_trim`), what the tree holds.
+    - writes: growth over `--grow` more nodes upserted after the build, in batches.
+Then point lookups, subtree reads, indexed lookups on the language (first 10 nodes) and condition scans on an
+interned field.
+
+usage: python -m benchmarks.interned_storage [--nodes 200000] [--reads 2000] [--grow 50000]
+"""
+from __future__ import annotations
+
+import ctypes
+import random
+import argparse
+import statistics
+from time import perf_counter
+from multiprocessing import get_context
+
+from weetags.tree_builder import TreeBuilder
+from app.memory import process_rss, table_memory
+from app.options import prepare_tree
+from app.delta import DeltaApplier
+
+FANOUT = 10
+INTERNED = ["label", "categories"]
+LABELS = [f"a rather long label shared by many nodes of the tree, number {i}" for i in range(200)]
+LANGS = ["en", "fr", "de", "es", "it", "pt", "nl", "pl", "ja", "zh"]
+CATEGORIES = [[f"category-{i}", f"category-{(i * 7) % 50}", f"category-{(i * 13) % 50}"] for i in range(50)]
+
+
+def tree_data(n_nodes: int, start: int = 0) -> list[dict]:
+    data = [{"id": "0", "parent": None, "label": LABELS[0], "lang": "en", "categories": CATEGORIES[0]}] if start == 0 else []
+    for i in range(max(start, 1), start + n_nodes):
+        data.append({
+            "id": str(i),
+            "parent": str((i - 1) // FANOUT),
+            "label": LABELS[i % len(LABELS)],
+            "lang": LANGS[i % len(LANGS)],
+            "categories": CATEGORIES[i % len(CATEGORIES)],
+        })
+    return data
+
+def trim_heap() -> None:
+    """hand the freed heap back to the system, where glibc allows it."""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def timed(f, *args) -> float:
+    t = perf_counter()
+    f(*args)
+    return (perf_counter() - t) * 1e3
+
+def percentiles(latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    return f"{statistics.median(latencies):.3f}/{p99:.3f}"
+
+def run_mode(n_nodes: int, n_reads: int, n_grow: int, intern: bool) -> dict:
+    data = tree_data(n_nodes)
+    trim_heap()
+    rss = process_rss()
+    tree = TreeBuilder.build_tree("bench", data=data, indexes=["lang"], replace=True, cache="shared")
+    prepare_tree(tree, {"intern": INTERNED if intern else None, "topk": False})
+    build_growth = process_rss() - rss
+    trim_heap()
+    steady_growth = process_rss() - rss
+    memory = table_memory(tree)
+
+    grown = tree_data(n_grow, start=n_nodes)
+    rss = process_rss()
+    for i in range(0, n_grow, 1000):
+        DeltaApplier(tree).apply([{"op": "upsert", "node": node} for node in grown[i:i + 1000]])
+    writes_growth = process_rss() - rss
+    rng = random.Random(0)
+
+    lookups = [timed(tree.node, str(rng.randrange(n_nodes))) for _ in range(n_reads)]
+    subtrees = [timed(tree.descendants_nodes, str(rng.randrange(1, FANOUT * FANOUT))) for _ in range(n_reads // 10)]
+    indexed = [timed(tree.nodes_where, [[("lang", "=", rng.choice(LANGS))]], ["id"], None, 1, 10) for _ in range(n_reads)]
+    scans = [timed(tree.nodes_where, [[("label", "=", rng.choice(LABELS))]], ["id"]) for _ in range(n_reads // 100)]
+
+    return {
+        "mode": "interned" if intern else "plain",
+        "tree_mb": round(memory["bytes"] / 2**20, 1),
+        "nodes_mb": round(memory["tables"]["_interned__bench" if intern else "bench__nodes"]["bytes"] / 2**20, 1),
+        "build_mb": round(build_growth / 2**20, 1),
+        "steady_mb": round(steady_growth / 2**20, 1),
+        "writes_mb": round(writes_growth / 2**20, 1),
+        "lookup": percentiles(lookups),
+        "subtree": percentiles(subtrees),
+        "indexed": percentiles(indexed),
+        "scan": percentiles(scans),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=200000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--grow", type=int, default=50000)
+    args = parser.parse_args()
+
+    print(f"latencies in ms (p50/p99), tables and indexes of the tree, RSS growth in MB. {args.nodes} nodes, {args.grow} written after.")
+    print(
+        f"{'mode':>10} {'tree (MB)':>10} {'nodes (MB)':>11} {'build':>7} {'steady':>7} {'writes':>7} "
+        f"{'lookup':>14} {'subtree':>14} {'indexed':>14} {'scan':>14}"
+    )
+    ctx = get_context("spawn")
+    for intern in [False, True]:
+        with ctx.Pool(1) as pool:
+            r = pool.apply(run_mode, (args.nodes, args.reads, args.grow, intern))
+        print(
+            f"{r['mode']:>10} {r['tree_mb']:>10} {r['nodes_mb']:>11} {r['build_mb']:>7} {r['steady_mb']:>7} {r['writes_mb']:>7} "
+            f"{r['lookup']:>14} {r['subtree']:>14} {r['indexed']:>14} {r['scan']:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
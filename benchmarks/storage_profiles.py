@@ -0,0 +1,86 @@
+"""
+Storage profiles benchmark.
+Build an on-disk tree once, then open it under each storage profile in a fresh process, so that the resident memory
+of a profile does not leak into the next one. Measure point lookups, subtree reads, condition scans and single node
+updates (one transaction each), then the process RSS.
+
+usage: python -m benchmarks.storage_profiles [--nodes 100000] [--reads 2000] [--writes 500]
+"""
+from __future__ import annotations
+
+import random
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from time import perf_counter
+from multiprocessing import get_context
+
+from weetags.tree import Tree
+from weetags.tree_builder import TreeBuilder
+from app.memory import process_rss
+from app.storage import STORAGE_PROFILES, storage_settings, apply_storage, active_storage
+
+FANOUT = 10
+
+
+def tree_data(n_nodes: int) -> list[dict]:
+    data = [{"id": "0", "parent": None, "label": "root", "payload": "x" * 64}]
+    for i in range(1, n_nodes):
+        data.append({"id": str(i), "parent": str((i - 1) // FANOUT), "label": f"label{i % 100}", "payload": "x" * 64})
+    return data
+
+def timed(f, *args) -> float:
+    t = perf_counter()
+    f(*args)
+    return (perf_counter() - t) * 1e3
+
+def percentiles(latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    return f"{statistics.median(latencies):.3f}/{p99:.3f}"
+
+def run_profile(database: str, n_nodes: int, n_reads: int, n_writes: int, profile: str | None) -> dict:
+    rss = process_rss()
+    tree = Tree(tree_name="bench", database=database)
+    apply_storage(tree, storage_settings(profile))
+    rng = random.Random(0)
+
+    lookups = [timed(tree.node, str(rng.randrange(n_nodes))) for _ in range(n_reads)]
+    subtrees = [timed(tree.descendants_nodes, str(rng.randrange(1, FANOUT * FANOUT))) for _ in range(n_reads // 10)]
+    scans = [timed(tree.nodes_where, [[("label", "=", f"label{rng.randrange(100)}")]]) for _ in range(n_reads // 100)]
+    writes = [timed(tree.update_node, str(rng.randrange(1, n_nodes)), [("payload", "y" * 64)]) for _ in range(n_writes)]
+
+    return {
+        "profile": profile or "default",
+        "journal": active_storage(tree)["journal_mode"],
+        "lookup": percentiles(lookups),
+        "subtree": percentiles(subtrees),
+        "scan": percentiles(scans),
+        "write": percentiles(writes),
+        "rss_mb": round((process_rss() - rss) / 2**20, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--writes", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = str(Path(tmp) / "bench.db")
+        TreeBuilder.build_tree("bench", database=database, data=tree_data(args.nodes), indexes=["label"], replace=True)
+
+        print(f"latencies in ms (p50/p99), RSS growth of the process over the run. {args.nodes} nodes.")
+        print(f"{'profile':>20} {'journal':>9} {'lookup':>14} {'subtree':>14} {'scan':>14} {'write':>14} {'rss (MB)':>9}")
+        ctx = get_context("spawn")
+        for profile in [None, *STORAGE_PROFILES]:
+            with ctx.Pool(1) as pool:
+                r = pool.apply(run_profile, (database, args.nodes, args.reads, args.writes, profile))
+            print(f"{r['profile']:>20} {r['journal']:>9} {r['lookup']:>14} {r['subtree']:>14} {r['scan']:>14} {r['write']:>14} {r['rss_mb']:>9}")
+
+
+if __name__ == "__main__":
+    main()
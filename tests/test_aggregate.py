@@ -0,0 +1,90 @@
+import pytest
+
+from app.main import Weetags
+from app.delta import DeltaApplier
+
+DATA = [
+    {"id": "root", "parent": None, "kind": "root", "score": 0, "tags": []},
+    {"id": "a", "parent": "root", "kind": "branch", "score": 3, "tags": ["x", "y"]},
+    {"id": "a1", "parent": "a", "kind": "leaf", "score": 5, "tags": ["x"]},
+    {"id": "a2", "parent": "a", "kind": "leaf", "score": 1, "tags": []},
+    {"id": "a21", "parent": "a2", "kind": "leaf", "score": 8, "tags": ["y"]},
+    {"id": "b", "parent": "root", "kind": "branch", "score": 2, "tags": ["x"]},
+]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={"aggregate": {"tree_name": "aggregate", "data": DATA, "replace": True, "cache": "shared"}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["utils"]}
+    )
+    return weetags.app
+
+
+def recount(tree):
+    """descendants count of every node, from the parent links."""
+    parents = {n["id"]:n["parent"] for n in tree.nodes_where(fields=["id", "parent"])}
+    sizes = {nid:0 for nid in parents}
+    for nid in parents:
+        parent = parents[nid]
+        while parent is not None:
+            sizes[parent] += 1
+            parent = parents[parent]
+    return sizes
+
+def counters(tree):
+    return {r["nid"]:r["size"] for r in tree.con.execute(f"SELECT nid, size FROM {tree.aggregator.sizes.table_name}").fetchall()}
+
+
+@pytest.mark.aggregate
+def test_aggregates(app):
+    client = app.test_client
+    _, response = client.get("/utils/aggregate/aggregate/count")
+    assert response.json["data"] == {"count": 6}
+
+    _, response = client.post("/utils/aggregate/aggregate/count", json={"conditions": [[["kind", "=", "leaf"]]]})
+    assert response.json["data"] == {"count": 3}
+
+    _, response = client.get("/utils/aggregate/aggregate/max", params={"field_name": "score", "relation": "descendants", "nid": "a"})
+    assert response.json["data"] == {"max": 8}
+
+    _, response = client.post("/utils/aggregate/aggregate/min", json={"field_name": "score", "relation": "children", "conditions": [[["kind", "=", "branch"]]]})
+    assert response.json["data"] == {"min": 1}
+
+    _, response = client.get("/utils/aggregate/aggregate/group_by", params={"field_name": "kind"})
+    assert response.json["data"] == [{"value": "leaf", "count": 3}, {"value": "branch", "count": 2}, {"value": "root", "count": 1}]
+
+    _, response = client.get("/utils/aggregate/aggregate/group_by", params={"field_name": "tags", "limit": 1})
+    assert response.json["data"] == [{"value": "x", "count": 3}]
+
+    _, response = client.get("/utils/aggregate/aggregate/subtree_sizes", params={"relation": "children", "nid": "root", "include_base": "true"})
+    assert response.json["data"] == [{"id": "root", "size": 5}, {"id": "a", "size": 3}, {"id": "b", "size": 0}]
+
+    _, response = client.get("/utils/aggregate/aggregate/median")
+    assert response.status == 400
+    _, response = client.get("/utils/aggregate/aggregate/max")
+    assert response.status == 400
+
+@pytest.mark.aggregate
+def test_subtree_sizes_maintained(app):
+    tree = app.ctx.trees["aggregate"]
+    run = lambda f, *args: tree.executor.pool.submit(f, *args).result()
+    assert run(counters, tree) == run(recount, tree)
+
+    run(tree.add_node, {"id": "a211", "parent": "a21", "kind": "leaf", "score": 0, "tags": []})
+    assert run(counters, tree) == run(recount, tree)
+    assert run(counters, tree)["root"] == 6
+
+    applier = DeltaApplier(tree)
+    run(applier.apply, [{"op": "move", "id": "a2", "parent": "b"}])
+    assert run(counters, tree) == run(recount, tree)
+    assert (run(counters, tree)["a"], run(counters, tree)["b"]) == (1, 3)
+
+    run(applier.apply, [{"op": "delete", "id": "b"}])
+    assert run(counters, tree) == run(recount, tree)
+    assert run(counters, tree)["root"] == 2
+
+    run(tree.delete_node, "a1")
+    assert run(counters, tree) == run(recount, tree) == {"root": 1, "a": 0}
@@ -0,0 +1,78 @@
+import pytest
+
+from app.main import Weetags
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root"},
+    {"id": "a", "parent": "root", "label": "A"},
+    {"id": "b", "parent": "root", "label": "B"},
+]
+USERS = [
+    {"username": "admin", "password": "admin", "auth_level": ["admin"], "max_age": 600},
+    {"username": "reader", "password": "reader", "auth_level": ["reader"], "max_age": 600},
+]
+# the reader has no access to the `secret` tree.
+RESTRICTIONS = [{"tree": "secret", "blueprint": blueprint, "auth_level": ["admin"]} for blueprint in ["records", "utils", "writer"]]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={
+            "public": {"tree_name": "public", "data": DATA, "replace": True, "cache": "shared"},
+            "secret": {"tree_name": "secret", "data": DATA, "replace": True, "cache": "shared"},
+        },
+        sanic={"app": {"secret": "xxx", "slow_query_ms": 0}, "blueprints": ["login", "records", "writer", "utils"]},
+        authentication={"users": USERS, "restrictions": RESTRICTIONS, "replace": True}
+    )
+    return weetags.app
+
+
+def token(app, username: str) -> dict[str, str]:
+    _, response = app.test_client.post("/auth", json={"username": username, "password": username})
+    return {"Authorization": f"Bearer {response.json['data']['token']}"}
+
+
+@pytest.mark.authorization
+def test_treeless_routes(app):
+    admin, reader = token(app, "admin"), token(app, "reader")
+    for tree in ["public", "secret"]:
+        _, response = app.test_client.get(f"/records/node/{tree}/a", headers={**admin, "X-Profile": "1"})
+        assert response.status == 200
+    _, response = app.test_client.get("/records/node/secret/a", headers=reader)
+    assert response.status == 401
+
+    # profiles and slow queries of the secret tree are left out for the reader.
+    _, response = app.test_client.get("/utils/profiles", headers=admin)
+    assert sorted([p["trees"][0] for p in response.json["data"] if p["trees"]]) == ["public", "secret"]
+    secret = next(p["id"] for p in response.json["data"] if p["trees"] == ["secret"])
+    _, response = app.test_client.get("/utils/profiles", headers=reader)
+    assert all([p["trees"] != ["secret"] for p in response.json["data"]])
+    _, response = app.test_client.get(f"/utils/profiles/{secret}", headers=reader)
+    assert response.status == 404
+    _, response = app.test_client.get(f"/utils/profiles/{secret}", headers=admin)
+    assert response.status == 200
+
+    _, response = app.test_client.get("/utils/slow-queries", headers=admin)
+    assert {e["tree"] for e in response.json["data"]} == {"public", "secret"}
+    _, response = app.test_client.get("/utils/slow-queries", headers=reader)
+    assert {e["tree"] for e in response.json["data"]} == {"public"}
+
+    # multi trees lookups are checked against their `trees` param.
+    _, response = app.test_client.post("/records/multi", json={"lookup": "node", "nid": "a", "trees": ["public", "secret"]}, headers=reader)
+    assert response.status == 401
+
+@pytest.mark.authorization
+def test_jobs_authorization(app):
+    admin, reader = token(app, "admin"), token(app, "reader")
+    payload = {"conditions": [[["label", "=", "nothing"]]], "job": True}
+    _, response = app.test_client.post("/records/delete/nodes/secret", json=payload, headers=admin)
+    job_id = response.json["data"]["job"]
+
+    _, response = app.test_client.get(f"/records/jobs/{job_id}", headers=reader)
+    assert response.status == 401
+    _, response = app.test_client.delete(f"/records/jobs/{job_id}", headers=reader)
+    assert response.status == 401
+    _, response = app.test_client.get(f"/records/jobs/{job_id}", headers=admin)
+    assert response.status == 200 and response.json["data"]["tree"] == "secret"
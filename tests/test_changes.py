@@ -0,0 +1,83 @@
+import json
+import asyncio
+import pytest
+
+from app.main import Weetags
+from app.changes import ChangeFeed
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root"},
+    {"id": "a", "parent": "root", "label": "A"},
+]
+
+
+def decode(payload):
+    lines = dict([line.split(": ", 1) for line in payload.decode().strip().split("\n")])
+    return lines.get("id", None), lines["event"], json.loads(lines["data"])
+
+@pytest.mark.changes
+def test_feed_resume():
+    async def run():
+        feed = ChangeFeed("topics", history_size=3, buffer_size=10)
+        [feed.publish("update_node", {"nid": str(i)}) for i in range(5)]
+
+        subscriber = feed.subscribe(since=3)
+        assert [decode(payload)[0] for payload in subscriber.backlog] == ["4", "5"]
+
+        subscriber = feed.subscribe(since=1)
+        assert decode(subscriber.backlog[0])[1] == "reset"
+        assert [decode(payload)[0] for payload in subscriber.backlog[1:]] == ["3", "4", "5"]
+
+        subscriber = feed.subscribe(since=10)
+        assert decode(subscriber.backlog[0])[1] == "reset"
+
+        live = feed.subscribe()
+        assert feed.publish("add_node", {"node": {"id": "x"}}) == 6
+        seq, event, data = decode(live.queue.get_nowait())
+        assert (seq, event, data["op"], data["data"]) == ("6", "change", "add_node", {"node": {"id": "x"}})
+
+    asyncio.run(run())
+
+@pytest.mark.changes
+def test_feed_slow_subscriber():
+    async def run():
+        feed = ChangeFeed("topics", buffer_size=2)
+        slow, fast = feed.subscribe(), feed.subscribe()
+        for i in range(3):
+            feed.publish("update_node", {"nid": str(i)})
+            while not fast.queue.empty():
+                fast.queue.get_nowait()
+
+        assert slow.overflowed and slow not in feed.subscribers
+        assert slow.queue.get_nowait() is None
+        assert fast in feed.subscribers and not fast.overflowed
+
+    asyncio.run(run())
+
+@pytest.mark.changes
+def test_changes_stream():
+    weetags = Weetags(
+        env="test",
+        trees={"changes": {"tree_name": "changes", "data": DATA, "replace": True, "cache": "shared"}},
+        sanic={"app": {"secret": "xxx", "changes_buffer": 2}, "blueprints": ["records"]}
+    )
+    app = weetags.app
+    [app.ctx.changes.publish("changes", "update_node", {"nid": "a"}) for _ in range(4)]
+
+    # a client further behind than its 2 events buffer catches up, then gets the live events.
+    async def run():
+        feed = app.ctx.changes["changes"]
+        stream = asyncio.create_task(app.asgi_client.get("/records/changes/changes", headers={"Last-Event-ID": "1"}))
+        while not feed.subscribers or next(iter(feed.subscribers)).backlog:
+            await asyncio.sleep(0.01)
+        feed.publish("update_node", {"nid": "a"})
+        subscriber = next(iter(feed.subscribers))
+        while not subscriber.queue.empty():
+            await asyncio.sleep(0.01)
+        subscriber.close()
+        return await stream
+
+    _, response = asyncio.run(run())
+    assert response.status == 200
+    assert response.headers["content-type"] == "text/event-stream"
+    assert [line[4:] for line in response.body.decode().split("\n") if line.startswith("id: ")] == ["2", "3", "4", "5"]
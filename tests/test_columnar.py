@@ -0,0 +1,56 @@
+import pytest
+
+from app.main import Weetags
+
+DATA = [{"id": "root", "parent": None, "kind": "root", "score": 0}] + [
+    {"id": f"n{i}", "parent": "root", "kind": "a" if i % 2 else "b", "score": i} for i in range(6)
+]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={"columnar": {"tree_name": "columnar", "data": DATA, "replace": True, "cache": "shared"}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records"]}
+    )
+    return weetags.app
+
+
+@pytest.mark.columnar
+def test_columnar_nodes_where(app):
+    payload = {"conditions": [[["kind", "=", "a"]]], "fields": ["id", "score"], "order_by": ["score"]}
+    _, response = app.test_client.post("/records/nodes/columnar/where", json=payload)
+    nodes = response.json["data"]
+
+    _, response = app.test_client.post("/records/nodes/columnar/where", json={**payload, "format": "rows"})
+    assert response.json["format"] == "rows"
+    assert response.json["fields"] == ["id", "score"]
+    assert response.json["data"] == [[n["id"], n["score"]] for n in nodes] == [["n1", 1], ["n3", 3], ["n5", 5]]
+
+    _, response = app.test_client.post("/records/nodes/columnar/where", json={**payload, "format": "columnar"})
+    assert response.json["data"] == [["n1", "n3", "n5"], [1, 3, 5]]
+
+    # all fields: the same records as the dict per node response.
+    _, response = app.test_client.post("/records/nodes/columnar/where", json={"format": "rows"})
+    fields = response.json["fields"]
+    _, expected = app.test_client.post("/records/nodes/columnar/where", json={})
+    assert [dict(zip(fields, row)) for row in response.json["data"]] == expected.json["data"]
+
+    _, response = app.test_client.post("/records/nodes/columnar/where", json={**payload, "format": "csv"})
+    assert response.status == 400
+
+@pytest.mark.columnar
+def test_columnar_relations(app):
+    _, response = app.test_client.get("/records/nodes/columnar/children/root?fields=id&fields=kind&format=columnar")
+    assert response.json["fields"] == ["id", "kind"]
+    assert sorted(response.json["data"][0]) == [f"n{i}" for i in range(6)]
+
+    payload = {"conditions": [[["id", "=", "n1"]]], "fields": ["id"], "format": "rows"}
+    _, response = app.test_client.post("/records/nodes/columnar/siblings/where", json=payload)
+    assert response.json["fields"] == ["id"]
+    assert sorted([row[0] for row in response.json["data"]]) == [f"n{i}" for i in range(6) if i != 1]
+
+    payload = {"conditions": [[["id", "=", "missing"]]], "fields": ["id"], "format": "columnar"}
+    _, response = app.test_client.post("/records/nodes/columnar/siblings/where", json=payload)
+    assert response.json["fields"] == [] and response.json["data"] == []
@@ -0,0 +1,75 @@
+import pytest
+
+from app.executor import TreeExecutor
+from app.delta import DeltaApplier
+from app.exceptions import DeltaError
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root", "tags": []},
+    {"id": "a", "parent": "root", "label": "A", "tags": ["x"]},
+    {"id": "b", "parent": "root", "label": "B", "tags": []},
+    {"id": "a1", "parent": "a", "label": "A1", "tags": ["x", "y"]},
+    {"id": "a11", "parent": "a1", "label": "A11", "tags": []},
+]
+
+
+@pytest.fixture
+def tree():
+    executor = TreeExecutor("delta")
+    tree = executor.build(tree_name="delta", data=[dict(n) for n in DATA], indexes=["tags"], replace=True, cache="shared")
+    yield tree
+    executor.pool.shutdown()
+
+def run(tree, f, *args):
+    return tree.executor.pool.submit(f, *args).result()
+
+def indexed(tree, tag):
+    stmt = "SELECT nid FROM delta__tags WHERE tags = ? ORDER BY nid;"
+    return [r["nid"] for r in run(tree, lambda: tree.con.execute(stmt, [tag]).fetchall())]
+
+def structure(tree, nid):
+    return run(tree, tree.node, nid, ["id", "parent", "children", "depth", "is_leaf"])
+
+@pytest.mark.delta
+def test_delta_upsert(tree):
+    report = run(tree, DeltaApplier(tree).apply, [
+        {"op": "upsert", "node": {"id": "b1", "parent": "b", "label": "B1", "tags": ["y"]}},
+        {"op": "upsert", "node": {"id": "a", "label": "A*"}},
+    ])
+    assert report["applied"] == {"upsert": 2}
+    assert structure(tree, "b1") == {"id": "b1", "parent": "b", "children": [], "depth": 2, "is_leaf": True}
+    assert structure(tree, "b")["children"] == ["b1"] and not structure(tree, "b")["is_leaf"]
+    assert run(tree, tree.node, "a", ["label"]) == {"label": "A*"}
+    assert indexed(tree, "y") == ["a1", "b1"]
+
+@pytest.mark.delta
+def test_delta_move(tree):
+    run(tree, DeltaApplier(tree).apply, [{"op": "move", "id": "a1", "parent": "b"}])
+    assert structure(tree, "a1") == {"id": "a1", "parent": "b", "children": ["a11"], "depth": 2, "is_leaf": False}
+    assert structure(tree, "a")["children"] == [] and structure(tree, "a")["is_leaf"]
+
+    run(tree, DeltaApplier(tree).apply, [{"op": "upsert", "node": {"id": "a1", "parent": "root"}}])
+    assert structure(tree, "a1")["depth"] == 1
+    assert structure(tree, "a11")["depth"] == 2
+
+    with pytest.raises(DeltaError):
+        run(tree, DeltaApplier(tree).apply, [{"op": "move", "id": "a1", "parent": "a11"}])
+
+@pytest.mark.delta
+def test_delta_delete(tree):
+    run(tree, DeltaApplier(tree).apply, [{"op": "delete", "id": "a"}, {"op": "delete", "id": "missing"}])
+    assert run(tree, lambda: tree.tree_size) == 2
+    assert structure(tree, "a11") is None
+    assert structure(tree, "root")["children"] == ["b"]
+    assert indexed(tree, "x") == []
+
+@pytest.mark.delta
+def test_delta_batches(tree):
+    records = [
+        {"op": "upsert", "node": {"id": "c", "parent": "root"}},
+        {"op": "upsert", "node": {"id": "d", "parent": "root"}},
+        {"op": "upsert", "node": {"id": "e", "parent": "unknown"}},
+    ]
+    with pytest.raises(DeltaError, match="record 2 .* 2 records were committed"):
+        run(tree, DeltaApplier(tree, batch_size=2).apply, records)
+    assert structure(tree, "d") is not None and structure(tree, "e") is None
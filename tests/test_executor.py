@@ -0,0 +1,102 @@
+import sqlite3
+import asyncio
+import threading
+import pytest
+from time import perf_counter
+
+from app.main import Weetags
+from app.executor import TreeExecutor
+from app.exceptions import TreeRetired
+
+INFINITE_QUERY = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c) SELECT count(*) FROM c;"
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root"},
+    {"id": "a", "parent": "root", "label": "A"},
+    {"id": "b", "parent": "root", "label": "B"},
+    {"id": "a1", "parent": "a", "label": "A1"},
+]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={"executor": {"tree_name": "executor", "data": DATA, "replace": True, "cache": "shared"}},
+        sanic={"app": {"secret": "xxx", "max_timeout_ms": 5000}, "blueprints": ["records"]}
+    )
+    return weetags.app
+
+@pytest.mark.executor
+def test_guarded_deadline():
+    executor = TreeExecutor("executor_deadline")
+    tree = executor.build(tree_name="executor_deadline", data=DATA, replace=True, cache="shared")
+
+    async def run():
+        return await executor.guarded(tree._execute, perf_counter() + 0.05, INFINITE_QUERY)
+
+    t = perf_counter()
+    with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+        asyncio.run(run())
+    assert perf_counter() - t < 1
+
+    async def info():
+        return await executor.submit(lambda: tree.info)
+    assert asyncio.run(info())["size"] == 4
+
+@pytest.mark.executor
+def test_guarded_cancellation():
+    executor = TreeExecutor("executor_cancel")
+    tree = executor.build(tree_name="executor_cancel", data=DATA, replace=True, cache="shared")
+
+    async def run():
+        task = asyncio.create_task(executor.guarded(tree._execute, None, INFINITE_QUERY))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # the worker thread must be released for the next queries.
+        return await asyncio.wait_for(executor.submit(tree.node, "a", ["id"]), 1)
+
+    assert asyncio.run(run()) == {"id": "a"}
+
+@pytest.mark.executor
+def test_retired_executor():
+    executor = TreeExecutor("executor_retired")
+    tree = executor.build(tree_name="executor_retired", data=DATA, replace=True, cache="shared")
+
+    async def run():
+        released = threading.Event()
+        executor.pool.submit(released.wait, 5)
+        with executor.using():
+            first = asyncio.create_task(executor.submit(lambda: tree.info))
+            retire = asyncio.create_task(executor.retire(tree, drop=True))
+            await asyncio.sleep(0.05)
+            released.set()
+            await first
+            # held by a handler submitting several calls: retired once it is done.
+            node = await executor.submit(tree.node, "a", ["id"])
+            assert not retire.done()
+        await retire
+        # later calls of the callers that got the tree before its reload are refused, retryable.
+        with pytest.raises(TreeRetired):
+            await executor.submit(tree.node, "a", ["id"])
+        with pytest.raises(TreeRetired):
+            await executor.guarded(tree.node, None, "a", ["id"])
+        return node
+
+    assert asyncio.run(run()) == {"id": "a"}
+    assert TreeRetired("executor_retired").status == 503
+
+@pytest.mark.executor
+def test_query_timeout(app):
+    request, response = app.test_client.get("/records/node/executor/a", headers={"X-Timeout-Ms": "1000"})
+    assert response.status == 200
+    assert response.json["data"]["label"] == "A"
+
+    request, response = app.test_client.get("/records/node/executor/a", headers={"X-Timeout-Ms": "0"})
+    assert response.status == 504
+    assert app.ctx.metrics.get("queries_aborted", "deadline") == 1
+
+    request, response = app.test_client.get("/records/node/executor/a", headers={"X-Timeout-Ms": "abc"})
+    assert response.status == 400
@@ -0,0 +1,56 @@
+import pytest
+from urllib.parse import urlencode
+
+from app.main import Weetags
+
+DATA = [{"id": "root", "parent": None, "label": "root"}]
+for i in range(3):
+    DATA.append({"id": f"g{i}", "parent": "root", "label": f"G{i}"})
+    DATA.extend([{"id": f"g{i}-{j}", "parent": f"g{i}", "label": f"G{i}-{j}"} for j in range(4)])
+
+
+@pytest.fixture(params=[False, True], ids=["tree", "topology"])
+def app(request):
+    weetags = Weetags(
+        env="test",
+        trees={"expand": {"tree_name": "expand", "data": DATA, "replace": True, "cache": "shared", "topology": request.param}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records"]}
+    )
+    return weetags.app
+
+
+@pytest.mark.expand
+def test_expand_node(app):
+    include = {
+        "parent": {"fields": ["id"]},
+        "children": {"fields": ["id", "label"], "limit": 2},
+        "siblings": {"fields": ["id"]},
+        "ancestors": {},
+    }
+    _, response = app.test_client.get(f"/records/node/expand/g1?{urlencode({'fields': 'id,label', 'include': str(include)})}")
+    data = response.json["data"]
+    assert data["node"] == {"id": "g1", "label": "G1"}
+    relations = data["relations"]
+    assert relations["parent"] == {"id": "root"}
+    assert relations["children"] == [{"id": "g1-0", "label": "G1-0"}, {"id": "g1-1", "label": "G1-1"}]
+    assert sorted([n["id"] for n in relations["siblings"]]) == ["g0", "g2"]
+    assert [n["id"] for n in relations["ancestors"]] == ["root"] and "children" in relations["ancestors"][0]
+    assert set(relations) == {"parent", "children", "siblings", "ancestors"}
+
+    # the same documents as the separate relation routes.
+    _, response = app.test_client.get("/records/node/expand/g1-2?include=parent,descendants&fields=id")
+    data = response.json["data"]
+    _, parent = app.test_client.get("/records/node/expand/parent/g1-2")
+    assert data["node"] == {"id": "g1-2"}
+    assert data["relations"]["parent"] == parent.json["data"]
+    assert data["relations"]["descendants"] == []
+
+    _, response = app.test_client.get("/records/node/expand/root?include=siblings,parent")
+    assert response.json["data"]["relations"] == {"siblings": [], "parent": None}
+    _, response = app.test_client.get("/records/node/expand/missing?include=children")
+    assert response.json["data"] == {"node": None, "relations": {"children": []}}
+
+    _, response = app.test_client.get("/records/node/expand/g1?include=cousins")
+    assert response.status != 200
+    _, response = app.test_client.get(f"/records/node/expand/g1?{urlencode({'include': str({'children': {'limit': 'all'}})})}")
+    assert response.status != 200
@@ -0,0 +1,110 @@
+import pytest
+
+from app.main import Weetags
+from app.options import pop_tree_options
+
+DATA = [{"id": "root", "parent": None, "label": "root", "lang": "fr", "cats": ["root"]}]
+for i in range(3):
+    DATA.append({"id": f"g{i}", "parent": "root", "label": "group", "lang": "en", "cats": ["a", "b"]})
+    DATA.extend([{"id": f"g{i}-{j}", "parent": f"g{i}", "label": "leaf", "lang": "en", "cats": ["a", "b"]} for j in range(4)])
+
+
+@pytest.fixture
+def app():
+    trees = {
+        "plain": {"tree_name": "plain", "data": DATA, "replace": True, "cache": "shared", "indexes": ["lang"]},
+        "interned": {
+            "tree_name": "interned",
+            "data": DATA,
+            "replace": True,
+            "cache": "shared",
+            "indexes": ["lang"],
+            "topology": True,
+            "intern": ["label", "cats"]
+        },
+    }
+    weetags = Weetags(env="test", trees=trees, sanic={"app": {"secret": "xxx"}, "blueprints": ["records", "writer", "utils"]})
+    return weetags.app
+
+
+@pytest.mark.interning
+def test_tree_memory(app):
+    _, response = app.test_client.get("/weetags/infos")
+    memory = response.json["data"]["plain"]["memory"]["tree"]
+    # the tables of the other trees of the shared database are left out.
+    assert set(memory["tables"]) == {"plain__nodes", "plain__metadata", "_sizes__plain"}
+    nodes = memory["tables"]["plain__nodes"]
+    assert set(nodes["indexes"]) == {"idx_plain__nodes_lang", "sqlite_autoindex_plain__nodes_1"}
+    assert nodes["bytes"] > 0 and nodes["payload"] > 0
+    assert memory["bytes"] == sum([t["bytes"] + sum(t["indexes"].values()) for t in memory["tables"].values()])
+    assert response.json["data"]["plain"]["memory"]["interning"] is None
+
+    _, response = app.test_client.get("/weetags/infos/interned")
+    memory = response.json["data"]["memory"]
+    assert {"_interned__interned", "_dictionary__interned"} <= set(memory["tree"]["tables"])
+    assert "idx_interned__nodes_lang" in memory["tree"]["tables"]["_interned__interned"]["indexes"]
+    assert memory["interning"]["dictionary_entries"] == 5
+
+@pytest.mark.interning
+def test_interned_reads(app):
+    plain, interned = app.ctx.trees["plain"], app.ctx.trees["interned"]
+    run = lambda tree, f, *args: tree.executor.pool.submit(f, *args).result()
+    assert run(interned, interned.node, "g1-2") == run(plain, plain.node, "g1-2")
+    conditions = [[("lang", "=", "en"), ("label", "=", "leaf")]]
+    assert run(interned, interned.nodes_where, conditions, ["id"]) == run(plain, plain.nodes_where, conditions, ["id"])
+    fields = ["id", "label", "cats"]
+    assert run(interned, interned.descendants_nodes, "g0", fields) == run(plain, plain.descendants_nodes, "g0", fields)
+    # indexed fields are left as they are, their lookups still search their index.
+    plan = run(interned, lambda: [r["detail"] for r in interned.con.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM interned__nodes WHERE lang = 'en'"
+    ).fetchall()])
+    assert any(["USING INDEX idx_interned__nodes_lang" in detail for detail in plan])
+    # the nodes only hold codes.
+    stored = run(interned, lambda: interned.con.execute("SELECT label FROM _interned__interned WHERE id = 'g1'").fetchone()["label"])
+    assert stored != "group"
+
+    _, response = app.test_client.get("/records/nodes/interned/children/g2?fields=id,label,cats")
+    assert response.json["data"][0] == {"id": "g2-0", "label": "leaf", "cats": ["a", "b"]}
+
+@pytest.mark.interning
+def test_interned_writes(app):
+    tree = app.ctx.trees["interned"]
+    run = lambda tree, f, *args: tree.executor.pool.submit(f, *args).result()
+    run(tree, tree.add_node, {"id": "new", "parent": "g0-1", "label": "brand new", "lang": "en", "cats": ["c"]})
+    run(tree, tree.update_node, "g0", [("label", "renamed"), ("cats", ["a"])])
+    _, response = app.test_client.post("/records/update/nodes/interned", json={"conditions": [[["label", "=", "leaf"]]], "set_values": [["lang", "de"]]})
+    assert response.status == 200
+    _, response = app.test_client.get("/records/delete/node/interned/g2")
+    assert response.status == 200
+
+    new = {"id": "new", "parent": "g0-1", "label": "brand new", "cats": ["c"], "depth": 3}
+    assert run(tree, tree.node, "new", ["id", "parent", "label", "cats", "depth"]) == new
+    g0 = {"label": "renamed", "cats": ["a"], "children": ["g0-0", "g0-1", "g0-2", "g0-3"]}
+    assert run(tree, tree.node, "g0", ["label", "cats", "children"]) == g0
+    assert {n["lang"] for n in run(tree, tree.nodes_where, [[("label", "=", "leaf")]], ["lang"])} == {"de"}
+    assert run(tree, tree.node, "g2-0") is None
+    assert run(tree, lambda: tree.con.execute("SELECT count(*) AS n FROM interned__metadata WHERE nid LIKE 'g2%'").fetchone()["n"]) == 0
+
+    # structures set on the storage table follow the writes.
+    assert {"id": "new"} in run(tree, tree.topology.descendants_nodes, "g0", ["id"])
+    _, response = app.test_client.get("/utils/interned/aggregate/subtree_sizes?nid=root&relation=children")
+    sizes = {n["id"]:n["size"] for n in response.json["data"]}
+    assert sizes == {"g0": 5, "g1": 4}
+
+@pytest.mark.interning
+def test_interning_options():
+    settings = {"tree_name": "tree", "intern": ["label"]}
+    assert pop_tree_options(settings)["intern"] == ["label"]
+    # interned trees get an in memory database of their own.
+    assert settings == {"tree_name": "tree", "database": "tree-0", "mode": "memory", "cache": "shared"}
+    for settings in [{"tree_name": "tree", "intern": ["label"], "database": "tree.db"}, {"tree_name": "tree", "intern": ["label"], "search": ["label"]}]:
+        with pytest.raises(ValueError):
+            pop_tree_options(settings)
+
+    for intern in [["id"], ["depth"], ["missing"], ["lang"]]:
+        with pytest.raises(ValueError):
+            Weetags(
+                env="test",
+                trees={"invalid": {"tree_name": "invalid", "data": DATA, "replace": True, "cache": "shared", "indexes": ["lang"], "intern": intern}},
+                sanic={"app": {"secret": "xxx"}, "blueprints": ["records"]}
+            )
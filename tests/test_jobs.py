@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+
+from app.main import Weetags
+from app.executor import TreeExecutor
+
+DATA = [{"id": "root", "parent": None, "kind": "root", "label": "root"}]
+for i in range(6):
+    DATA.append({"id": f"g{i}", "parent": "root", "kind": "a" if i % 2 else "b", "label": f"G{i}"})
+    DATA.extend([{"id": f"g{i}-{j}", "parent": f"g{i}", "kind": "leaf", "label": f"G{i}-{j}"} for j in range(5)])
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={"jobs": {"tree_name": "jobs", "data": DATA, "replace": True, "cache": "shared"}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records", "writer"]}
+    )
+    return weetags.app
+
+
+def run_job(app, op, conditions, set_values=None, chunk_size=None, cancel=False):
+    async def run():
+        job = app.ctx.jobs.submit(app.ctx.trees["jobs"], "jobs", op, conditions, set_values, chunk_size)
+        while cancel and job.processed == 0:
+            await asyncio.sleep(0.001)
+        if cancel:
+            app.ctx.jobs.cancel(job.id)
+        await job.task
+        return job.describe()
+    return asyncio.run(run())
+
+def nodes(app, fields=["id"]):
+    tree = app.ctx.trees["jobs"]
+    return tree.executor.pool.submit(tree.nodes_where, None, fields).result()
+
+
+@pytest.mark.jobs
+def test_jobs_routes(app):
+    payload = {"conditions": [[["kind", "=", "a"]]], "job": True, "chunk_size": 1}
+    _, response = app.test_client.post("/records/delete/nodes/jobs", json=payload)
+    assert response.status == 202
+    job_id = response.json["data"]["job"]
+    assert response.json["data"]["url"] == f"/records/jobs/{job_id}"
+
+    _, response = app.test_client.get(f"/records/jobs/{job_id}")
+    assert response.json["data"]["id"] == job_id
+    assert response.json["data"]["op"] == "delete_nodes_where"
+
+    _, response = app.test_client.delete(f"/records/jobs/{job_id}")
+    assert response.status == 200
+    _, response = app.test_client.get("/records/jobs/missing")
+    assert response.status == 404
+
+@pytest.mark.jobs
+def test_jobs_chunks(app):
+    job = run_job(app, "update_nodes_where", [[("kind", "=", "leaf")]], [["label", "updated"]], chunk_size=7)
+    assert job["status"] == "done" and job["total"] == 30 and job["chunks"] == 5 and job["progress"] == 1.0
+    assert len([n for n in nodes(app, ["label"]) if n["label"] == "updated"]) == 30
+
+    job = run_job(app, "delete_nodes_where", [[("kind", "=", "a")]], chunk_size=2)
+    # as `Tree.delete_nodes_where` with `remove_orphans`: the dead branches go too, counted and chunked.
+    assert job["status"] == "done" and job["total"] == 18 and job["chunks"] == 9
+    assert sorted([n["id"] for n in nodes(app)]) == sorted(["root"] + [n["id"] for n in DATA if n["id"][1:2] in "024" and n["id"] != "root"])
+    assert nodes(app, ["id", "children"])[0]["children"] == ["g0", "g2", "g4"]
+
+    job = run_job(app, "update_nodes_where", None, [["parent", "root"]])
+    assert job["status"] == "failed" and job["processed"] == 0
+
+    job = run_job(app, "delete_nodes_where", [[("kind", "=", "leaf")]], chunk_size=1, cancel=True)
+    assert job["status"] == "cancelled" and 0 < job["processed"] < job["total"]
+
+@pytest.mark.jobs
+def test_jobs_keep_orphans(app):
+    app.ctx.trees["jobs"].remove_orphans = False
+    job = run_job(app, "delete_nodes_where", [[("kind", "=", "a")]], chunk_size=2)
+    assert job["status"] == "done" and job["total"] == 3 and job["chunks"] == 2
+    # only the complying nodes, their children are left orphans.
+    orphans = [n["id"] for n in nodes(app, ["id", "parent"]) if n["parent"] is None and n["id"] != "root"]
+    assert sorted(orphans) == sorted([n["id"] for n in DATA if n["parent"] in ["g1", "g3", "g5"]])
+    assert nodes(app, ["id", "children"])[0]["children"] == ["g0", "g2", "g4"]
+
+@pytest.mark.jobs
+def test_jobs_reloaded_tree(app):
+    old = app.ctx.trees["jobs"]
+
+    async def run():
+        job = app.ctx.jobs.submit(old, "jobs", "update_nodes_where", [[("kind", "=", "leaf")]], [["label", "updated"]], 1)
+        while job.processed == 0:
+            await asyncio.sleep(0.001)
+        # swapped in as a reload does, the old tree is held until the job stops.
+        app.ctx.trees["jobs"] = TreeExecutor("jobs").build(**app.ctx.reloader.generation_settings("jobs", 1))
+        assert old.executor.users == 1
+        await job.task
+        return job.describe()
+
+    job = asyncio.run(run())
+    assert job["status"] == "cancelled" and "reloaded" in job["error"]
+    assert 0 < job["processed"] < job["total"]
+    assert old.executor.users == 0
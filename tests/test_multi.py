@@ -0,0 +1,62 @@
+import pytest
+
+from app.main import Weetags
+
+TOPICS = [
+    {"id": "root", "parent": None, "label": "topics"},
+    {"id": "sport", "parent": "root", "label": "sport"},
+    {"id": "football", "parent": "sport", "label": "football"},
+]
+LOCATIONS = [
+    {"id": "root", "parent": None, "label": "locations"},
+    {"id": "europe", "parent": "root", "label": "europe"},
+    {"id": "france", "parent": "europe", "label": "france"},
+]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={
+            "topics": {"tree_name": "topics", "data": TOPICS, "replace": True, "cache": "shared", "search": ["label"]},
+            "locations": {"tree_name": "locations", "data": LOCATIONS, "replace": True, "cache": "shared"},
+        },
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records"]}
+    )
+    return weetags.app
+
+
+@pytest.mark.multi
+def test_multi_lookups(app):
+    payload = {"trees": ["topics", "locations"], "lookup": "node", "nid": "root", "fields": ["label"]}
+    _, response = app.test_client.post("/records/multi", json=payload)
+    assert response.status == 200
+    assert response.json["data"] == {"topics": {"label": "topics"}, "locations": {"label": "locations"}}
+    assert response.json["errors"] == {}
+
+    payload = {"trees": ["topics", "locations"], "lookup": "relations", "relation": "children", "nid": "root", "fields": ["id"]}
+    _, response = app.test_client.post("/records/multi", json=payload)
+    assert response.json["data"] == {"topics": [{"id": "sport"}], "locations": [{"id": "europe"}]}
+
+    payload = {"trees": ["topics", "locations"], "lookup": "nodes_where", "conditions": [[["depth", "=", 2]]], "fields": ["id"]}
+    _, response = app.test_client.post("/records/multi", json=payload)
+    assert response.json["data"] == {"topics": [{"id": "football"}], "locations": [{"id": "france"}]}
+
+@pytest.mark.multi
+def test_multi_partial_failure(app):
+    payload = {"trees": ["topics", "locations", "missing"], "lookup": "search", "query": "foot", "prefix": True, "fields": ["id"]}
+    _, response = app.test_client.post("/records/multi", json=payload)
+    assert response.status == 207
+    assert response.json["data"] == {"topics": [{"id": "football"}]}
+    assert set(response.json["errors"]) == {"locations", "missing"}
+    assert response.json["errors"]["locations"]["status"] == 400
+
+    payload = {"trees": ["topics", "locations"], "lookup": "nodes_where", "fields": ["id"], "timeouts": {"locations": 0}}
+    _, response = app.test_client.post("/records/multi", json=payload)
+    assert response.status == 207
+    assert len(response.json["data"]["topics"]) == len(TOPICS)
+    assert response.json["errors"]["locations"]["status"] == 504
+
+    _, response = app.test_client.post("/records/multi", json={"trees": ["topics"], "lookup": "tree"})
+    assert response.status == 400
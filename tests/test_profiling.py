@@ -0,0 +1,92 @@
+import asyncio
+import pstats
+import threading
+import pytest
+
+from app.main import Weetags
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root"},
+    {"id": "a", "parent": "root", "label": "A"},
+    {"id": "a1", "parent": "a", "label": "A1"},
+    {"id": "b", "parent": "root", "label": "B"},
+]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={
+            "profiled": {"tree_name": "profiled", "data": DATA, "replace": True, "cache": "shared"},
+            "other": {"tree_name": "other", "data": DATA, "replace": True, "cache": "shared"},
+        },
+        sanic={"app": {"secret": "xxx", "profiles_size": 2}, "blueprints": ["records", "utils"]}
+    )
+    return weetags.app
+
+
+@pytest.mark.profiling
+def test_profiling(app, tmp_path):
+    _, response = app.test_client.get("/records/nodes/profiled/descendants/root")
+    assert "X-Profile-Id" not in response.headers
+    _, response = app.test_client.get("/utils/profiles")
+    assert response.json["data"] == []
+
+    _, response = app.test_client.get("/records/nodes/profiled/descendants/root", headers={"X-Profile": "1"})
+    assert response.status == 200
+    pid = int(response.headers["X-Profile-Id"])
+
+    _, response = app.test_client.get("/utils/profiles")
+    [profile] = response.json["data"]
+    assert profile["id"] == pid and profile["status"] == 200 and not profile["sampled"]
+    assert any([thread.startswith("weetags-profiled") for thread in profile["threads"]])
+    # the response serialization, on the event loop, is captured too.
+    assert threading.main_thread().name in profile["threads"]
+
+    _, response = app.test_client.get(f"/utils/profiles/{pid}", params={"format": "text"})
+    assert "descendants_nodes" in response.text
+    _, response = app.test_client.get(f"/utils/profiles/{pid}")
+    (tmp_path / "request.prof").write_bytes(response.body)
+    functions = [f[2] for f in pstats.Stats(str(tmp_path / "request.prof")).stats]
+    assert "descendants_nodes" in functions
+    assert any(["sqlite3" in f for f in functions])
+    assert "encode" in functions
+
+    # bounded ring buffer.
+    for _ in range(2):
+        app.test_client.get("/records/node/profiled/a", headers={"X-Profile": "1"})
+    _, response = app.test_client.get(f"/utils/profiles/{pid}")
+    assert response.status == 404
+    _, response = app.test_client.get("/utils/profiles")
+    assert len(response.json["data"]) == 2
+
+@pytest.mark.profiling
+def test_single_profiler(app):
+    # queries of one request on several tree threads are captured one after the other.
+    payload = {"lookup": "node", "nid": "a", "trees": ["profiled", "other"]}
+    _, response = app.test_client.post("/records/multi", json=payload, headers={"X-Profile": "1"})
+    assert response.status == 200
+    _, response = app.test_client.get(f"/utils/profiles/{response.headers['X-Profile-Id']}", params={"format": "text"})
+    assert response.status == 200
+
+    async def run():
+        # hold the tree thread, so that the first profiled request is still running when the second one arrives.
+        tree = app.ctx.trees["profiled"]
+        released = threading.Event()
+        tree.executor.pool.submit(released.wait, 5)
+        first = asyncio.create_task(app.asgi_client.get("/records/node/profiled/a", headers={"X-Profile": "1"}))
+        for _ in range(500):
+            if app.ctx.profiles.active is not None:
+                break
+            await asyncio.sleep(0.01)
+        second = await app.asgi_client.get("/records/node/other/a", headers={"X-Profile": "1"})
+        unprofiled = await app.asgi_client.get("/records/node/other/a")
+        released.set()
+        return await first, second, unprofiled
+
+    (_, first), (_, second), (_, unprofiled) = asyncio.run(run())
+    assert first.status == 200 and "X-Profile-Id" in first.headers
+    assert second.status == 409
+    assert unprofiled.status == 200
+    assert app.ctx.profiles.active is None
@@ -0,0 +1,120 @@
+import json
+import asyncio
+import pytest
+
+from app.executor import TreeExecutor
+from app.reloader import TreeReloader, active_settings
+from app.exceptions import ReloadInProgress
+
+
+def write_data(path, labels):
+    nodes = [{"id": "root", "parent": None, "label": "root"}]
+    nodes += [{"id": label.lower(), "parent": "root", "label": label} for label in labels]
+    path.write_text("\n".join([json.dumps(n) for n in nodes]))
+
+
+@pytest.mark.reload
+def test_reload_memory_tree(tmp_path):
+    data = tmp_path / "data.jl"
+    write_data(data, ["A", "B"])
+    settings = {"reload": {"tree_name": "reload", "data": [str(data)], "replace": True, "cache": "shared"}}
+
+    async def run():
+        trees = {"reload": TreeExecutor("reload").build(**settings["reload"])}
+        reloader = TreeReloader(trees, settings)
+        old = trees["reload"]
+        assert await old.executor.submit(lambda: old.tree_size) == 3
+
+        write_data(data, ["A", "B", "C"])
+        task = asyncio.create_task(reloader.reload("reload"))
+        await asyncio.sleep(0)
+        with pytest.raises(ReloadInProgress):
+            reloader.start("reload")
+        report = await task
+
+        new = trees["reload"]
+        assert report["state"] == "swapped"
+        assert report["old"]["database_bytes"] > 0 and report["new"]["database_bytes"] > 0
+        assert new is not old
+        assert new.uri.startswith("file:reload-1?")
+        assert await new.executor.submit(new.node, "c", ["label"]) == {"label": "C"}
+        assert old.executor.pool._shutdown
+
+        report = await reloader.reload("reload")
+        assert report["generation"] == 2 and trees["reload"].uri.startswith("file:reload-2?")
+
+    asyncio.run(run())
+
+@pytest.mark.reload
+def test_reload_disk_tree(tmp_path):
+    data = tmp_path / "data.jl"
+    write_data(data, ["A"])
+    db = tmp_path / "tree.db"
+    settings = {"disk": {"tree_name": "disk", "database": str(db), "data": [str(data)], "replace": True}}
+
+    async def run():
+        trees = {"disk": TreeExecutor("disk").build(**settings["disk"])}
+        reloader = TreeReloader(trees, settings)
+        write_data(data, ["A", "Z"])
+        report = await reloader.reload("disk")
+        assert report["state"] == "swapped"
+        assert trees["disk"].database == str(tmp_path / "tree.1.db")
+        assert await trees["disk"].executor.submit(trees["disk"].node, "z", ["id"]) == {"id": "z"}
+
+        # retired generations are deleted, the configured database is kept.
+        write_data(data, ["A", "Z", "Y"])
+        report = await reloader.reload("disk")
+        assert trees["disk"].database == str(tmp_path / "tree.2.db")
+        assert not (tmp_path / "tree.1.db").exists() and db.exists()
+        assert (tmp_path / "tree.db.generation").read_text() == "2"
+
+    asyncio.run(run())
+
+    # a restart opens the active generation, and builds the next ones after it.
+    write_data(data, ["A"])
+    restarted = TreeExecutor("disk").build(**active_settings({**settings["disk"], "replace": False}))
+    assert restarted.database == str(tmp_path / "tree.2.db")
+    assert restarted.executor.pool.submit(restarted.node, "y", ["id"]).result() == {"id": "y"}
+    assert TreeReloader({"disk": restarted}, settings).generation_settings("disk", 3)["database"] == str(tmp_path / "tree.3.db")
+    assert TreeReloader({"disk": restarted}, settings).generations["disk"] == 2
+
+@pytest.mark.reload
+def test_reload_failure(tmp_path):
+    data = tmp_path / "data.jl"
+    write_data(data, ["A"])
+    settings = {"failing": {"tree_name": "failing", "data": [str(data)], "replace": True, "cache": "shared"}}
+
+    async def run():
+        trees = {"failing": TreeExecutor("failing").build(**settings["failing"])}
+        reloader = TreeReloader(trees, settings)
+        old = trees["failing"]
+        data.unlink()
+        report = await reloader.reload("failing")
+        assert report["state"] == "failed"
+        assert trees["failing"] is old
+        assert await old.executor.submit(old.node, "a", ["id"]) == {"id": "a"}
+
+    asyncio.run(run())
+
+@pytest.mark.reload
+def test_reload_in_flight(tmp_path):
+    data = tmp_path / "data.jl"
+    write_data(data, ["A"])
+    settings = {"held": {"tree_name": "held", "data": [str(data)], "replace": True, "cache": "shared"}}
+
+    async def run():
+        trees = {"held": TreeExecutor("held").build(**settings["held"])}
+        reloader = TreeReloader(trees, settings)
+        old = trees["held"]
+        with old.executor.using():
+            task = asyncio.create_task(reloader.reload("held"))
+            while trees["held"] is old:
+                await asyncio.sleep(0.001)
+            # swapped, but still usable by its holder.
+            await asyncio.sleep(0.01)
+            assert not task.done() and not old.executor.pool._shutdown
+            assert await old.executor.submit(old.node, "a", ["id"]) == {"id": "a"}
+        report = await task
+        assert report["state"] == "swapped" and old.executor.pool._shutdown
+
+    asyncio.run(run())
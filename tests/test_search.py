@@ -0,0 +1,69 @@
+import pytest
+
+from app.main import Weetags
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root", "description": "all topics"},
+    {"id": "sport", "parent": "root", "label": "Sport", "description": "football, tennis and basketball"},
+    {"id": "tennis", "parent": "sport", "label": "Tennis", "description": "racket sport"},
+    {"id": "food", "parent": "root", "label": "Food", "description": "cooking and restaurants"},
+    {"id": "football", "parent": "food", "label": "Football snacks", "description": "food for the stadium"},
+]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={
+            "search": {
+                "tree_name": "search",
+                "data": DATA,
+                "replace": True,
+                "cache": "shared",
+                "search": ["label", "description"]
+            }
+        },
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records", "writer"]}
+    )
+    return weetags.app
+
+
+def ids(response):
+    return [n["id"] for n in response.json["data"]]
+
+@pytest.mark.search
+def test_search_ranked(app):
+    _, response = app.test_client.get("/records/search/search", params={"query": "football", "fields": "id"})
+    assert response.status == 200
+    assert sorted(ids(response)) == ["football", "sport"]
+
+    # the node matching both terms ranks first.
+    _, response = app.test_client.get("/records/search/search", params={"query": "football OR stadium", "fields": "id"})
+    assert ids(response)[0] == "football"
+
+    _, response = app.test_client.get("/records/search/search", params={"query": "racket spo", "prefix": "true", "fields": "label"})
+    assert response.json["data"] == [{"label": "Tennis"}]
+
+    _, response = app.test_client.get("/records/search/search", params={"query": "football", "relation": "descendants", "nid": "food", "fields": "id"})
+    assert ids(response) == ["football"]
+
+    _, response = app.test_client.get("/records/search/search", params={"query": "\"unbalanced"})
+    assert response.status == 400
+
+@pytest.mark.search
+def test_search_follows_writes(app):
+    tree = app.ctx.trees["search"]
+    write = lambda f, *args: tree.executor.pool.submit(f, *args).result()
+
+    write(tree.add_node, {"id": "golf", "parent": "sport", "label": "Golf", "description": "clubs"})
+    _, response = app.test_client.get("/records/search/search", params={"query": "golf", "fields": "id"})
+    assert ids(response) == ["golf"]
+
+    write(tree.update_node, "golf", [("label", "Mini golf")])
+    _, response = app.test_client.get("/records/search/search", params={"query": "mini", "fields": "id"})
+    assert ids(response) == ["golf"]
+
+    write(tree.delete_node, "golf")
+    _, response = app.test_client.get("/records/search/search", params={"query": "golf", "fields": "id"})
+    assert ids(response) == []
@@ -0,0 +1,151 @@
+import asyncio
+from time import perf_counter
+import threading
+import pytest
+
+from app.main import Weetags
+from app.singleflight import SingleFlight
+from app.metrics import Metrics
+from app.exceptions import QueryTimeout
+
+DATA = [{"id": "root", "parent": None, "label": "root"}] + [
+    {"id": f"n{i}", "parent": "root", "label": f"N{i}"} for i in range(10)
+]
+CHILDREN = "/records/nodes/flights/children/root"
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={"flights": {"tree_name": "flights", "data": DATA, "replace": True, "cache": "shared"}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records"]}
+    )
+    return weetags.app
+
+
+def hold(app) -> threading.Event:
+    """keep the tree thread busy until the returned event is set, so that the following requests overlap."""
+    tree = app.ctx.trees["flights"]
+    released = threading.Event()
+    tree.executor.pool.submit(released.wait, 5)
+    return released
+
+async def flights(app, n: int) -> None:
+    """wait for `n` flights in progress."""
+    for _ in range(500):
+        if len(app.ctx.single_flight.flights) == n:
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError()
+
+
+@pytest.mark.singleflight
+def test_single_flight_joins(app):
+    async def run():
+        released = hold(app)
+        requests = asyncio.gather(
+            *[app.asgi_client.get(f"{CHILDREN}?fields=id") for _ in range(5)],
+            app.asgi_client.get(f"{CHILDREN}?fields=label"),
+        )
+        await flights(app, 2)
+        await asyncio.sleep(0.2)
+        released.set()
+        return await requests
+    responses = asyncio.run(run())
+    assert all([response.status == 200 for _, response in responses])
+    bodies = [response.body for _, response in responses[:5]]
+    assert len(set(bodies)) == 1 and len(responses[0][1].json["data"]) == 10
+    assert "label" in responses[5][1].json["data"][0]
+    assert app.ctx.metrics.get("single_flight_joins", "flights") == 4
+    assert app.ctx.single_flight.flights == {}
+
+@pytest.mark.singleflight
+def test_single_flight_writes(app):
+    async def run():
+        released = hold(app)
+        first = asyncio.create_task(app.asgi_client.get(f"{CHILDREN}?fields=id"))
+        await flights(app, 1)
+        # requests following a write never join the flights started before it.
+        app.ctx.changes.publish("flights", "update_node", {"nid": "n0"})
+        second = asyncio.create_task(app.asgi_client.get(f"{CHILDREN}?fields=id"))
+        await flights(app, 2)
+        released.set()
+        return await asyncio.gather(first, second)
+    responses = asyncio.run(run())
+    assert all([response.status == 200 for _, response in responses])
+    assert app.ctx.metrics.get("single_flight_joins", "flights") == 0
+
+@pytest.mark.singleflight
+def test_single_flight_fallback():
+    metrics = Metrics()
+    single_flight = SingleFlight(metrics)
+    calls = []
+
+    async def handler():
+        calls.append(len(calls))
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise ValueError("leader failed")
+        return None
+
+    async def run():
+        return await asyncio.gather(*[single_flight.run("key", "tree", handler) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert isinstance(results[0], ValueError) and results[1:] == [None, None]
+    # failed flights are not shared: the joined requests ran their own handler.
+    assert len(calls) == 3
+    assert metrics.get("single_flight_fallbacks", "tree") == 2 and metrics.get("single_flight_joins", "tree") == 0
+
+@pytest.mark.singleflight
+def test_single_flight_deadlines(app):
+    async def run():
+        released = hold(app)
+        # requests of different timeouts don't share their flight.
+        requests = asyncio.gather(
+            app.asgi_client.get(f"{CHILDREN}?fields=id", headers={"X-Timeout-Ms": "5000"}),
+            app.asgi_client.get(f"{CHILDREN}?fields=id", headers={"X-Timeout-Ms": "4000"}),
+        )
+        await flights(app, 2)
+        released.set()
+        return await requests
+    responses = asyncio.run(run())
+    assert all([response.status == 200 for _, response in responses])
+    assert app.ctx.metrics.get("single_flight_joins", "flights") == 0
+
+    metrics = Metrics()
+    single_flight = SingleFlight(metrics)
+    calls = []
+
+    async def handler():
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        raise QueryTimeout(50)
+
+    async def timed_out():
+        return await asyncio.gather(*[single_flight.run("key", "tree", handler, 50) for _ in range(3)], return_exceptions=True)
+
+    # joined requests of a flight over its deadline time out with it, without querying again.
+    results = asyncio.run(timed_out())
+    assert all([isinstance(result, QueryTimeout) for result in results])
+    assert len(calls) == 1 and metrics.get("single_flight_timeouts", "tree") == 2
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        return None
+
+    async def joined():
+        loop = asyncio.get_running_loop()
+        first = asyncio.create_task(single_flight.run("slow", "tree", slow))
+        await asyncio.sleep(0)
+        started = loop.time()
+        # a joined request waits up to its own deadline only.
+        with pytest.raises(QueryTimeout):
+            await single_flight.run("slow", "tree", slow, 10, perf_counter() + 0.01)
+        waited = loop.time() - started
+        await first
+        return waited
+
+    assert asyncio.run(joined()) < 0.15
+    assert single_flight.flights == {}
@@ -0,0 +1,58 @@
+import json
+import pytest
+
+from app.main import Weetags
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root"},
+    {"id": "a", "parent": "root", "label": "A"},
+    {"id": "a1", "parent": "a", "label": "A1"},
+    {"id": "b", "parent": "root", "label": "B"},
+]
+
+
+def build(threshold_ms):
+    weetags = Weetags(
+        env="test",
+        trees={"slow": {"tree_name": "slow", "data": DATA, "replace": True, "cache": "shared"}},
+        sanic={"app": {"secret": "xxx", "slow_query_ms": threshold_ms, "slow_queries_size": 2}, "blueprints": ["records", "utils"]}
+    )
+    return weetags.app
+
+
+@pytest.mark.slowlog
+def test_slow_query_log(caplog):
+    app = build(0)
+    payload = {"conditions": [[["label", "=", "A1"]]], "fields": ["id"]}
+    _, response = app.test_client.post("/records/nodes/slow/where", json=payload)
+    assert response.json["data"] == [{"id": "a1"}]
+
+    _, response = app.test_client.get("/utils/slow-queries")
+    [entry] = response.json["data"]
+    assert entry["tree"] == "slow" and entry["route"] == "nodes_where" and entry["method"] == "nodes_where"
+    assert entry["params"] == {"axis": 1, "conditions": [[["label", "=", "A1"]]], "fields": ["id"]}
+    assert entry["rows"] == 1
+    [statement] = entry["statements"]
+    assert "'A1'" in statement["sql"]
+    assert any(["SCAN" in detail or "SEARCH" in detail for detail in statement["plan"]])
+
+    logged = [json.loads(r.message) for r in caplog.records if r.name == "slowQueries"]
+    assert logged[0]["params"] == entry["params"]
+
+    # bounded top-N view.
+    for nid in ["a", "b", "root"]:
+        app.test_client.get(f"/records/node/slow/{nid}")
+    _, response = app.test_client.get("/utils/slow-queries")
+    assert len(response.json["data"]) == 2
+    elapsed = [e["elapsed_ms"] for e in response.json["data"]]
+    assert elapsed == sorted(elapsed, reverse=True)
+
+    _, response = app.test_client.get("/weetags/metrics")
+    assert response.json["data"]["slow_queries"]["slow"] == 4
+
+@pytest.mark.slowlog
+def test_slow_query_log_disabled():
+    app = build(None)
+    app.test_client.get("/records/node/slow/a")
+    _, response = app.test_client.get("/utils/slow-queries")
+    assert response.json["data"] == []
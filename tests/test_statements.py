@@ -0,0 +1,89 @@
+import pytest
+
+from app.main import Weetags
+
+DATA = [{"id": "root", "parent": None, "kind": "root", "score": 0, "label": "root"}]
+for i in range(5):
+    DATA.append({"id": f"g{i}", "parent": "root", "kind": "a" if i % 2 else "b", "score": i, "label": f"G{i}"})
+    DATA.extend([{"id": f"g{i}-{j}", "parent": f"g{i}", "kind": "leaf", "score": j, "label": f"G{i}-{j}"} for j in range(4)])
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={"statements": {"tree_name": "statements", "data": DATA, "replace": True, "cache": "shared"}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records", "writer"]}
+    )
+    return weetags.app
+
+
+@pytest.mark.statements
+def test_statements_shapes(app):
+    tree = app.ctx.trees["statements"]
+    run = lambda f, *args: tree.executor.pool.submit(f, *args).result()
+    statements = tree.statements
+    queries = [
+        ([[("kind", "=", "leaf"), ("score", ">", 1)]], ["id", "score"], ["score", "id"], 0, 5),
+        ([[("kind", "=", "a")], "OR", [("score", "IN", [2, 3])]], ["id"], ["id"], 1, None),
+        ([[("label", "ILIKE", "g1%")]], ["id", "label"], ["id"], 1, None),
+    ]
+    for conditions, fields, order_by, axis, limit in queries:
+        assert run(statements.nodes_where, conditions, fields, order_by, axis, limit) == run(tree.nodes_where, conditions, fields, order_by, axis, limit)
+
+    # same shapes, other values: served from the compiled statements.
+    misses = statements.misses
+    assert run(statements.nodes_where, [[("kind", "=", "b"), ("score", ">", 2)]], ["id", "score"], ["score", "id"], 0, 5) == [{"id": "g4", "score": 4}]
+    assert run(statements.nodes_where, [[("kind", "=", "a")], "OR", [("score", "in", [0, 1])]], ["id"], ["id"], 1, None) == run(
+        tree.nodes_where, [[("kind", "=", "a")], "OR", [("score", "IN", [0, 1])]], ["id"], ["id"], 1, None
+    )
+    assert statements.misses == misses and statements.hits == 2
+    # IN lists of another size are another shape.
+    run(statements.nodes_where, [[("kind", "=", "a")], "OR", [("score", "IN", [0, 1, 2])]], ["id"], ["id"], 1, None)
+    assert statements.misses == misses + 1
+    # lists compared with other operators are a single serialized value.
+    assert run(statements.shape, [[("kind", "=", ["a", "b"])]]) == (((("kind", "=", None),),), [["a", "b"]])
+    assert run(statements.nodes_where, [[("kind", "=", ["a", "b"])]], ["id"]) == []
+    assert len(run(statements.nodes_where, [[("kind", "!=", ["a", "b"])]], ["id"])) == len(DATA)
+
+    with pytest.raises(KeyError):
+        run(statements.nodes_where, [[("missing", "=", 1)]])
+
+@pytest.mark.statements
+def test_statements_lru(app):
+    tree = app.ctx.trees["statements"]
+    run = lambda f, *args: tree.executor.pool.submit(f, *args).result()
+    statements = tree.statements
+    statements.size = 2
+    for limit in [1, 2, 3, 1]:
+        run(statements.nodes_where, None, ["id"], None, 1, limit)
+    assert statements.stats() == {"size": 2, "capacity": 2, "hits": 0, "misses": 4, "evictions": 2, "hit_rate": 0.0}
+
+@pytest.mark.statements
+def test_statements_routes(app):
+    payload = {"conditions": [[["kind", "=", "a"]]], "fields": ["id"]}
+    _, response = app.test_client.post("/records/nodes/statements/where", json=payload)
+    assert sorted([n["id"] for n in response.json["data"]]) == ["g1", "g3"]
+    payload = {"conditions": [[["kind", "=", "b"]]], "fields": ["id"]}
+    _, response = app.test_client.post("/records/nodes/statements/where", json=payload)
+    assert sorted([n["id"] for n in response.json["data"]]) == ["g0", "g2", "g4"]
+
+    payload = {"conditions": [[["id", "=", "g1"]]], "fields": ["id"], "include_base": True}
+    _, response = app.test_client.post("/records/nodes/statements/children/where", json=payload)
+    assert sorted([n["id"] for n in response.json["data"]]) == ["g1"] + [f"g1-{j}" for j in range(4)]
+
+    payload = {"conditions": [[["kind", "=", "b"]]], "set_values": [["label", "updated"]]}
+    _, response = app.test_client.post("/records/update/nodes/statements", json=payload)
+    assert response.status == 200
+    payload = {"conditions": [[["kind", "=", "a"]]]}
+    _, response = app.test_client.post("/records/delete/nodes/statements", json=payload)
+    assert response.status == 200
+
+    tree = app.ctx.trees["statements"]
+    nodes = tree.executor.pool.submit(tree.nodes_where, None, ["id", "label"]).result()
+    assert sorted([n["id"] for n in nodes if n["label"] == "updated"]) == ["g0", "g2", "g4"]
+    assert not any([n["id"].startswith(("g1", "g3")) for n in nodes])
+
+    _, response = app.test_client.get("/weetags/metrics")
+    stats = response.json["data"]["statement_cache"]["statements"]
+    assert stats["hits"] >= 2 and 0 < stats["hit_rate"] < 1
@@ -0,0 +1,60 @@
+import pytest
+
+from app.main import Weetags
+from app.storage import storage_settings
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root"},
+    {"id": "a", "parent": "root", "label": "A"},
+    {"id": "b", "parent": "root", "label": "B"},
+]
+
+
+@pytest.fixture
+def app(tmp_path):
+    weetags = Weetags(
+        env="test",
+        trees={
+            "reads": {"tree_name": "reads", "database": str(tmp_path / "reads.db"), "data": DATA, "replace": True, "storage": "read-heavy"},
+            "small": {
+                "tree_name": "small",
+                "database": str(tmp_path / "small.db"),
+                "data": DATA,
+                "replace": True,
+                "storage": {"profile": "memory-constrained", "cache_size": -512}
+            },
+            "default": {"tree_name": "default", "data": DATA, "replace": True, "cache": "shared"},
+        },
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records"]}
+    )
+    return weetags.app
+
+
+@pytest.mark.storage
+def test_storage_profiles(app):
+    _, response = app.test_client.get("/weetags/infos")
+    storage = {name:info["storage"] for name, info in response.json["data"].items()}
+    assert storage["reads"]["profile"] == "read-heavy"
+    assert storage["reads"]["journal_mode"] == "wal"
+    assert storage["reads"]["mmap_size"] == 268435456
+    assert storage["reads"]["temp_store"] == "memory"
+
+    assert storage["small"]["profile"] == "memory-constrained"
+    assert storage["small"]["cache_size"] == -512
+    assert storage["small"]["mmap_size"] == 0
+    assert storage["small"]["journal_mode"] == "truncate"
+
+    assert storage["default"]["profile"] is None
+
+    _, response = app.test_client.get("/weetags/infos/small")
+    assert response.json["data"]["storage"]["temp_store"] == "file"
+
+    _, response = app.test_client.get("/records/node/reads/a", params={"fields": "label"})
+    assert response.json["data"] == {"label": "A"}
+
+@pytest.mark.storage
+def test_storage_settings_validation():
+    assert storage_settings({"profile": "write-heavy", "synchronous": "full"})["synchronous"] == "full"
+    for storage in ["fast", {"page_size": 8192}, {"mmap_size": "1; DROP TABLE x"}, {"journal_mode": "wall"}]:
+        with pytest.raises(ValueError):
+            storage_settings(storage)
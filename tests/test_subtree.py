@@ -0,0 +1,70 @@
+import json
+import pytest
+
+from app.main import Weetags
+from app.subtree import Subtree, SUBTREE
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root"},
+    {"id": "a", "parent": "root", "label": "A"},
+    {"id": "a1", "parent": "a", "label": "A1"},
+    {"id": "a2", "parent": "a", "label": "A2"},
+    {"id": "a3", "parent": "a", "label": "A3"},
+    {"id": "a11", "parent": "a1", "label": "A11"},
+    {"id": "b", "parent": "root", "label": "B"},
+]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={"subtree": {"tree_name": "subtree", "data": DATA, "replace": True, "cache": "shared"}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records"]}
+    )
+    return weetags.app
+
+
+def shape(node):
+    return {node["id"]: [shape(c) for c in node["children"]]}
+
+@pytest.mark.subtree
+def test_subtree_nested(app):
+    _, response = app.test_client.get("/records/subtree/subtree/root", params={"fields": "id,label"})
+    assert response.status == 200
+    data = response.json["data"]
+    assert shape(data) == {"root": [{"a": [{"a1": [{"a11": []}]}, {"a2": []}, {"a3": []}]}, {"b": []}]}
+    assert data["children"][0]["label"] == "A"
+
+    _, response = app.test_client.get("/records/subtree/subtree/root", params={"fields": "id", "max_depth": 1})
+    assert shape(response.json["data"]) == {"root": [{"a": []}, {"b": []}]}
+
+    _, response = app.test_client.get("/records/subtree/subtree/root", params={"fields": "id", "child_limits": "[1, 2]"})
+    assert shape(response.json["data"]) == {"root": [{"a": [{"a1": [{"a11": []}]}, {"a2": []}]}]}
+
+    _, response = app.test_client.get("/records/subtree/subtree/a", params={"fields": "id,depth"})
+    assert response.json["data"]["depth"] == 1
+
+    _, response = app.test_client.get("/records/subtree/subtree/missing")
+    assert response.json["data"] is None
+
+@pytest.mark.subtree
+def test_subtree_stream(app):
+    for params in [{"fields": "id,label"}, {"fields": "id", "child_limits": 1}, {}]:
+        _, expected = app.test_client.get("/records/subtree/subtree/root", params=params)
+        _, streamed = app.test_client.get("/records/subtree/subtree/root", params={**params, "stream": "true"})
+        assert streamed.status == 200
+        assert json.loads(streamed.body) == expected.json
+
+    _, streamed = app.test_client.get("/records/subtree/subtree/missing", params={"stream": "true"})
+    assert json.loads(streamed.body)["data"] is None
+
+@pytest.mark.subtree
+def test_subtree_unsorted(app):
+    tree = app.ctx.trees["subtree"]
+    materializer = Subtree(tree)
+    stmt = SUBTREE.format(nodes_table=materializer.nodes_table, metadata_table=materializer.metadata_table, fields=materializer._fields(["id"]))
+    explain = lambda: [r["detail"] for r in tree.con.execute(f"EXPLAIN QUERY PLAN {stmt}", ["root", None, None, None, None, 0]).fetchall()]
+    # depth first from the queue of the cte, never sorted as a whole.
+    plan = tree.executor.pool.submit(explain).result()
+    assert not any(["TEMP B-TREE" in detail for detail in plan])
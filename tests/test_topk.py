@@ -0,0 +1,97 @@
+import pytest
+
+from app.main import Weetags
+from app.delta import DeltaApplier
+
+DATA = [{"id": "root", "parent": None, "score": 0, "rank": 0, "label": "root"}] + [
+    {"id": f"n{i:02d}", "parent": "root", "score": (i * 7) % 13, "rank": i, "label": f"N{i % 3}"} for i in range(40)
+]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={"topk": {"tree_name": "topk", "data": DATA, "replace": True, "cache": "shared", "indexes": ["rank"], "topk": True}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records"]}
+    )
+    return weetags.app
+
+
+def same_top(tree, conditions, order_by, axis, limit):
+    """the top-k path returns the nodes sqlite sorts first, ties aside."""
+    nodes, explain = tree.topk.run(conditions, ["id"] + order_by, order_by, axis, limit)
+    assert explain["path"] == "topk"
+    expected = tree.nodes_where(conditions, ["id"] + order_by, order_by, axis, None)
+    assert [[n[f] for f in order_by] for n in nodes] == [[n[f] for f in order_by] for n in expected[:limit]]
+    return True
+
+@pytest.mark.topk
+def test_topk_paths(app):
+    payload = {"fields": ["id"], "order_by": ["rank"], "axis": 0, "limit": 3, "explain": True}
+    _, response = app.test_client.post("/records/nodes/topk/where", json=payload)
+    assert response.json["explain"]["path"] == "index"
+    assert [n["id"] for n in response.json["data"]] == ["n39", "n38", "n37"]
+
+    payload = {"fields": ["id", "score"], "order_by": ["score"], "axis": 0, "limit": 3, "explain": True}
+    _, response = app.test_client.post("/records/nodes/topk/where", json=payload)
+    explain = response.json["explain"]
+    assert explain["path"] == "topk"
+    assert any(["TEMP B-TREE" in detail for detail in explain["plan"]])
+    assert [n["score"] for n in response.json["data"]] == [12, 12, 12]
+
+    _, response = app.test_client.post("/records/nodes/topk/where", json=payload)
+    assert response.json["explain"]["hits"] == 1
+    _, response = app.test_client.post("/records/nodes/topk/where", json={**payload, "explain": False})
+    assert "explain" not in response.json
+
+    # plans depend on the limit, cached per power of two of it.
+    plans = len(app.ctx.trees["topk"].topk.plans)
+    app.test_client.post("/records/nodes/topk/where", json={**payload, "limit": 2})
+    assert len(app.ctx.trees["topk"].topk.plans) == plans
+    app.test_client.post("/records/nodes/topk/where", json={**payload, "limit": 30})
+    assert len(app.ctx.trees["topk"].topk.plans) == plans + 1
+
+    _, response = app.test_client.post("/records/nodes/topk/where", json={"fields": ["id"], "explain": True})
+    assert response.json["explain"]["path"] == "scan"
+    assert len(response.json["data"]) == len(DATA)
+
+@pytest.mark.topk
+def test_topk_follows_writes(app):
+    tree = app.ctx.trees["topk"]
+    run = lambda f, *args: tree.executor.pool.submit(f, *args).result()
+    applier = DeltaApplier(tree)
+    shapes = [
+        (None, ["score"], 0, 5),
+        ([[("label", "=", "N1")]], ["score"], 1, 3),
+        (None, ["label", "score"], 0, 4),
+    ]
+    for shape in shapes:
+        assert run(same_top, tree, *shape)
+
+    run(tree.add_node, {"id": "top", "parent": "root", "score": 100, "rank": 100, "label": "N1"})
+    run(applier.apply, [{"op": "upsert", "node": {"id": "low", "parent": "root", "score": -1, "rank": 101, "label": "N1"}}])
+    for shape in shapes:
+        assert run(same_top, tree, *shape)
+
+    # members leaving the shapes, down to recomputations.
+    run(applier.apply, [{"op": "delete", "id": "top"}] + [{"op": "delete", "id": f"n{i:02d}"} for i in range(0, 40, 2)])
+    for shape in shapes:
+        assert run(same_top, tree, *shape)
+    assert run(lambda: [n["id"] for n in tree.topk.nodes_where(None, ["id"], ["score"], 1, 1)]) == ["low"]
+
+@pytest.mark.topk
+def test_topk_bounded_log(app):
+    tree = app.ctx.trees["topk"]
+    run = lambda f, *args: tree.executor.pool.submit(f, *args).result()
+    applier = DeltaApplier(tree)
+    tree.topk.MAX_CHANGES = 5
+    shape = (None, ["score"], 0, 5)
+    assert run(same_top, tree, *shape)
+
+    # writes with no topk query in between: the log stops, the shapes are recomputed.
+    run(applier.apply, [{"op": "upsert", "node": {"id": f"n{i:02d}", "parent": "root", "score": 50 + i, "rank": i, "label": "N0"}} for i in range(20)])
+    logged = run(lambda: tree.con.execute(f"SELECT count(*) AS n FROM {tree.topk.log_table};").fetchone()["n"])
+    assert logged == tree.topk.MAX_CHANGES + 1
+    assert run(same_top, tree, *shape)
+    assert run(lambda: tree.con.execute(f"SELECT count(*) AS n FROM {tree.topk.log_table};").fetchone()["n"]) == 0
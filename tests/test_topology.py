@@ -0,0 +1,82 @@
+import pytest
+
+from app.main import Weetags
+from app.delta import DeltaApplier
+from app.exceptions import DeltaError
+
+DATA = [
+    {"id": "root", "parent": None, "label": "root"},
+    {"id": "a", "parent": "root", "label": "A"},
+    {"id": "a1", "parent": "a", "label": "A1"},
+    {"id": "a2", "parent": "a", "label": "A2"},
+    {"id": "a21", "parent": "a2", "label": "A21"},
+    {"id": "b", "parent": "root", "label": "B"},
+    {"id": "b1", "parent": "b", "label": "B1"},
+]
+
+
+@pytest.fixture
+def app():
+    weetags = Weetags(
+        env="test",
+        trees={"topology": {"tree_name": "topology", "data": DATA, "replace": True, "cache": "shared", "topology": True}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["records", "utils"]}
+    )
+    return weetags.app
+
+
+def same_relations(tree):
+    """the topology cache answers as the tree does."""
+    topology = tree.topology
+    topology.sync()
+    for nid in list(topology.slots):
+        assert topology.parent_node(nid, ["id"]) == tree.parent_node(nid, ["id"])
+        # without ordering, the tree returns children in table order, the cache in `children` order.
+        children = sorted(topology.children_nodes(nid, ["id", "label"]), key=lambda n: n["id"])
+        assert children == sorted(tree.children_nodes(nid, ["id", "label"]), key=lambda n: n["id"])
+        assert topology.siblings_nodes(nid, ["id"], ["label"], 0) == tree.siblings_nodes(nid, ["id"], ["label"], 0)
+        assert topology.ancestors_nodes(nid, ["label"]) == tree.ancestors_nodes(nid, ["label"])
+        descendants = sorted([n["id"] for n in topology.descendants_nodes(nid, ["id"])])
+        assert descendants == sorted([n["id"] for n in tree.descendants_nodes(nid, ["id"])])
+    depths = {n["id"]:n["depth"] for n in tree.nodes_where(fields=["id", "depth"])}
+    assert {nid:topology.depth[slot] for nid, slot in topology.slots.items()} == depths
+    return True
+
+@pytest.mark.topology
+def test_topology_routes(app):
+    _, response = app.test_client.get("/records/nodes/topology/descendants/a", params={"fields": "id"})
+    assert response.json["data"] == [{"id": "a1"}, {"id": "a2"}, {"id": "a21"}]
+
+    _, response = app.test_client.get("/records/nodes/topology/children/root", params={"fields": "id", "order_by": "label", "axis": 0, "limit": 1})
+    assert response.json["data"] == [{"id": "b"}]
+
+    _, response = app.test_client.get("/records/node/topology/parent/a21", params={"fields": "id"})
+    assert response.json["data"] == {"id": "a2"}
+
+    _, response = app.test_client.get("/utils/topology/related/a21/root")
+    assert response.json["data"] is True
+
+    _, response = app.test_client.get("/weetags/infos/topology")
+    assert response.json["data"]["topology"]["nodes"] == len(DATA)
+
+@pytest.mark.topology
+def test_topology_follows_writes(app):
+    tree = app.ctx.trees["topology"]
+    run = lambda f, *args: tree.executor.pool.submit(f, *args).result()
+    applier = DeltaApplier(tree)
+    assert run(same_relations, tree)
+
+    run(tree.add_node, {"id": "a22", "parent": "a2", "label": "A22"})
+    assert run(same_relations, tree)
+
+    run(applier.apply, [{"op": "move", "id": "a2", "parent": "b"}])
+    assert run(same_relations, tree)
+
+    run(applier.apply, [{"op": "delete", "id": "a"}])
+    assert run(same_relations, tree)
+
+    # rolled back writes leave the cache untouched.
+    with pytest.raises(DeltaError):
+        run(applier.apply, [{"op": "upsert", "node": {"id": "c", "parent": "root", "label": "C"}}, {"op": "move", "id": "b", "parent": "b1"}])
+    assert run(same_relations, tree)
+    assert "c" not in tree.topology.slots
@@ -0,0 +1,99 @@
+import json
+import pytest
+from time import time
+from types import SimpleNamespace
+
+from sanic.response import json as json_response
+
+from app.main import Weetags
+from app.warmup import WarmUp
+
+DATA = [{"id": "root", "parent": None, "score": 0}] + [{"id": f"n{i}", "parent": "root", "score": i % 7} for i in range(20)]
+ACCESS_LOG = [
+    "2024-06-01 10:00:00 - endpointAccess - INFO - [localhost] > GET http://localhost/records/node/warm/n1?fields=id [200][15b][0.001s]",
+    "2024-06-01 10:00:01 - endpointAccess - INFO - [localhost] > GET http://localhost/records/node/warm/n1?fields=id [200][15b][0.001s]",
+    "2024-06-01 10:00:02 - endpointAccess - INFO - [localhost] > GET http://localhost/records/nodes/warm/children/root [200][900b][0.002s]",
+    "2024-06-01 10:00:03 - endpointAccess - INFO - [localhost] > GET http://localhost/records/delete/node/warm/n2 [200][40b][0.002s]",
+    "2024-06-01 10:00:04 - endpointAccess - INFO - [localhost] > GET http://localhost/unknown/route [200][40b][0.002s]",
+]
+RECORDED = [
+    {"method": "POST", "path": "/records/nodes/warm/where", "body": {"fields": ["id"], "order_by": ["score"], "limit": 3}},
+]
+
+
+@pytest.fixture
+def app(tmp_path):
+    source = tmp_path / "access.log"
+    source.write_text("\n".join(ACCESS_LOG + [json.dumps(r) for r in RECORDED]))
+    weetags = Weetags(
+        env="test",
+        trees={"warm": {"tree_name": "warm", "data": DATA, "replace": True, "cache": "shared", "topk": True}},
+        sanic={"app": {"secret": "xxx", "warmup": {"source": str(source), "top": 10}}, "blueprints": ["records", "writer"]}
+    )
+    app = weetags.app
+
+    @app.get("/test/warmed")
+    async def warmed(request):
+        await request.app.ctx.warmup.task
+        return json_response(request.app.ctx.warmup.stats)
+    return app
+
+
+@pytest.mark.warmup
+def test_warmup(app):
+    assert not app.ctx.warmup.ready
+    _, response = app.test_client.get("/test/warmed")
+    assert response.json["status"] == "done"
+    # the write and the unknown route are left out.
+    assert response.json["requests"] == 3
+    assert response.json["replayed"] == 3
+
+    _, response = app.test_client.get("/weetags/ready")
+    assert response.status == 200
+
+    tree = app.ctx.trees["warm"]
+    assert "n2" in [n["id"] for n in tree.executor.pool.submit(tree.nodes_where, None, ["id"]).result()]
+    # warmed app level structures.
+    assert len(tree.topk.shapes) == 1
+
+@pytest.mark.warmup
+def test_warmup_token():
+    weetags = Weetags(
+        env="test",
+        trees={"warm": {"tree_name": "warm", "data": DATA, "replace": True, "cache": "shared", "topk": True}},
+        sanic={"app": {"secret": "xxx"}, "blueprints": ["login", "records", "writer"]},
+        authentication={"users": [{"username": "u", "password": "u", "auth_level": ["admin"], "max_age": 600}], "replace": True}
+    )
+    app = weetags.app
+    # tokens are signed with the app secret, and only accepted while warming up.
+    token = WarmUp(source="log", secret="xxx").issue()
+    _, response = app.test_client.get("/records/node/warm/n1", headers={"X-Warmup": token})
+    assert response.status == 401
+
+    warming, other = WarmUp(source="log", secret="xxx"), WarmUp(source="log", secret="yyy")
+    request = lambda route, token: SimpleNamespace(route=SimpleNamespace(name=f"Weetags.{route}"), headers={"X-Warmup": token})
+    assert warming.authorized(request("records.node", token))
+    assert not other.authorized(request("records.node", token))
+    # read routes only.
+    assert not warming.authorized(request("writer.delete_node", token))
+    expired = f"{int(time()) - 1}.nonce"
+    assert not warming.authorized(request("records.node", f"{expired}.{warming._sign(expired)}"))
+    assert not warming.authorized(request("records.node", "forged"))
+    warming.ready = True
+    assert not warming.authorized(request("records.node", token))
+
+@pytest.mark.warmup
+def test_warmup_access_log(app, caplog, tmp_path):
+    caplog.set_level("INFO", logger="endpointAccess")
+    _, response = app.test_client.get("/test/warmed")
+    _, response = app.test_client.get("/records/node/warm/n1", headers={"X-Warmup": "forged"})
+    assert response.status == 200
+    # replays are logged, tagged.
+    logged = [r.message for r in caplog.records if r.name == "endpointAccess" and "/records/node/warm/n1" in r.message]
+    assert len([m for m in logged if m.endswith("[warmup]")]) == 1
+    assert len([m for m in logged if not m.endswith("[warmup]")]) == 1
+
+    # and left out of the next warm-ups.
+    source = tmp_path / "next.log"
+    source.write_text("\n".join(logged))
+    assert len(WarmUp.read(source)) == 1